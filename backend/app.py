@@ -5,12 +5,20 @@ Maia Chess Backend API
 A lightweight Flask application that serves as the API for the Maia chess engine.
 """
 
+import os
+import hmac
 import time
 import logging
 from collections import defaultdict, deque
 from threading import Lock
+import chess
 from flask import Flask, jsonify, request
-from maia_engine import predict_move
+import maia_engine
+from maia_engine import get_engine_type
+from job_queue import JobQueue, job_to_json
+from json_provider import install_json_provider
+from game_scoring import parse_score_request, score_game
+from move_request import parse_move_request, is_terminal, RequestValidationError
 from flask_cors import CORS
 
 # Enable Cross-Origin Resource Sharing so that the React frontend
@@ -19,6 +27,9 @@ from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)  # allow all origins by default; restrict in production if needed
 
+# Use orjson for request/response bodies when it is installed
+install_json_provider(app)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -106,6 +117,7 @@ def get_metrics():
     return jsonify({
         'api_performance': api_metrics,
         'engine_performance': engine_metrics,
+        'job_queue': _job_queue.stats() if _job_queue is not None else None,
         'timestamp': time.time()
     })
 
@@ -141,38 +153,13 @@ def get_move():
             error_occurred = True
             return jsonify({'error': 'Request must contain JSON data'}), 400
         
-        # Get JSON data from request
-        data = request.get_json()
-        if not data:
-            error_occurred = True
-            return jsonify({'error': 'No JSON data provided'}), 400
-        
-        # Extract FEN string
-        fen = data.get('fen')
-        if not fen:
-            error_occurred = True
-            return jsonify({'error': 'FEN string is required'}), 400
-        
-        # Extract level (optional, defaults to 1500)
-        level = data.get('level', 1500)
-        
-        # Validate level is an integer
-        try:
-            level = int(level)
-            request_level = level
-        except (ValueError, TypeError):
-            error_occurred = True
-            return jsonify({'error': 'Level must be an integer'}), 400
-        
-        # Extract nodes (optional, defaults to 1)
-        nodes = data.get('nodes', 1)
-        
-        # Validate nodes is an integer
+        # Validate the payload (cheap FEN syntax pre-check, int coercions)
         try:
-            nodes = int(nodes)
-        except (ValueError, TypeError):
+            fen, level, nodes = parse_move_request(request.get_json())
+        except RequestValidationError as e:
             error_occurred = True
-            return jsonify({'error': 'Nodes must be an integer'}), 400
+            return jsonify({'error': str(e)}), 400
+        request_level = level
         
         # Log the request
         logger.info(f"Move request: FEN={fen[:20]}..., Level={level}, Nodes={nodes}")
@@ -182,12 +169,9 @@ def get_move():
         move, engine_was_cached = predict_move_with_metrics(fen, level, nodes)
         move_time = time.time() - move_start_time
         
-        # Additional validation logging
-        try:
-            from maia_engine import predict_move_with_validation_logging
-            _, engine_type = predict_move_with_validation_logging(fen, level, nodes)
-        except ImportError:
-            engine_type = "UNKNOWN"
+        # Reported for validation purposes; the lc0 check is cached so this
+        # doesn't recompute the move or spawn a process per request
+        engine_type = get_engine_type()
         
         response_time = time.time() - start_time
         
@@ -234,18 +218,166 @@ def get_move():
             update_metrics(final_response_time, request_level or 1500, cache_hit=False, error=True)
 
 
+@app.route('/score_game', methods=['POST'])
+def score_game_route():
+    """
+    Score how human the moves of a played game are.
+
+    Expected JSON payload:
+    {
+        "pgn": "1. e4 e5 2. Nf3 ...",
+        "levels": [1100, 1500, 1900],  # optional, defaults to [1500]
+        "nodes": 1                      # optional, 1-100
+    }
+
+    Returns, for every ply, the probability each Maia level gave the played
+    move and its rank among the legal moves:
+    {
+        "plies": [{"ply": 1, "move": "e2e4", "san": "e4", "fen": "...",
+                   "scores": {"1500": {"probability": 0.41, "rank": 1}}}],
+        "summary": {"1500": {"mean_probability": 0.32, "top1_rate": 0.51}},
+        ...
+    }
+    """
+    start_time = time.time()
+
+    if not request.is_json:
+        return jsonify({'error': 'Request must contain JSON data'}), 400
+
+    try:
+        pgn, levels, nodes = parse_score_request(request.get_json(silent=True))
+        result = score_game(pgn, levels, nodes)
+    except RequestValidationError as e:
+        return jsonify({'error': str(e)}), 400
+    except FileNotFoundError as e:
+        logger.error(f"Model not found: {str(e)}")
+        return jsonify({'error': f'Model not found: {str(e)}'}), 404
+    except Exception as e:
+        logger.error(f"Internal server error: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+    result['response_time_ms'] = round((time.time() - start_time) * 1000, 2)
+    logger.info(f"Game scored: {len(result['plies'])} plies, Levels={levels}, "
+                f"Time: {result['response_time_ms']:.2f}ms")
+    return jsonify(result)
+
+
+# Long-running searches are executed off the request path by a process pool,
+# created lazily so importing the app doesn't spawn workers.
+_job_queue = None
+_job_queue_lock = Lock()
+
+# Upper bound on how long GET /jobs/<id>?wait= may block
+MAX_JOB_WAIT_SECONDS = 30
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, starting it on first use."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
+
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue a position for analysis in a background worker process.
+
+    Accepts the same JSON payload as /get_move and is intended for large
+    ``nodes`` values; ``nodes=1`` requests should keep using /get_move.
+
+    Returns 202 with:
+    {
+        "job_id": "3f2a...",
+        "status": "queued"
+    }
+    """
+    if not request.is_json:
+        return jsonify({'error': 'Request must contain JSON data'}), 400
+
+    try:
+        fen, level, nodes = parse_move_request(request.get_json(silent=True), check_nodes=True)
+    except RequestValidationError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Reject bad positions now rather than after the job has been queued
+    try:
+        board = chess.Board(fen)
+    except ValueError:
+        return jsonify({'error': f'Invalid FEN string: {fen}'}), 400
+    if is_terminal(board):
+        return jsonify({'error': 'No legal moves available in the given position'}), 400
+
+    job_id = get_job_queue().submit(fen, level, nodes)
+    logger.info(f"Job queued: {job_id}, FEN={fen[:20]}..., Level={level}, Nodes={nodes}")
+
+    response = jsonify({'job_id': job_id, 'status': 'queued'})
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response, 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll a queued job.
+
+    Pass ``?wait=<seconds>`` to long-poll until the job finishes (capped at
+    MAX_JOB_WAIT_SECONDS).
+    """
+    try:
+        wait = min(float(request.args.get('wait', 0)), MAX_JOB_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+
+    job = get_job_queue().get(job_id, wait=max(wait, 0))
+    if job is None:
+        return jsonify({'error': f'Job not found: {job_id}'}), 404
+    return jsonify(job_to_json(job))
+
+
+@app.route('/engines/reload', methods=['POST'])
+def reload_engines():
+    """
+    Restart running engines on the current weight files without downtime.
+
+    Requires the ``X-Admin-Token`` header to match the MAIA_ADMIN_TOKEN
+    environment variable; the endpoint is disabled when it is unset.
+    Optional JSON body: {"level": 1500} to reload a single level.
+    """
+    admin_token = os.environ.get('MAIA_ADMIN_TOKEN')
+    if not admin_token:
+        return jsonify({'error': 'Engine reload is disabled'}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        return jsonify({'error': 'Invalid admin token'}), 403
+
+    data = request.get_json(silent=True) or {}
+    level = data.get('level')
+    if level is not None and type(level) is not int:
+        return jsonify({'error': 'Level must be an integer'}), 400
+
+    try:
+        levels = maia_engine.reload_weights(level)
+    except Exception as e:
+        logger.error(f"Engine reload failed: {str(e)}")
+        return jsonify({'error': f'Engine reload failed: {str(e)}'}), 500
+
+    logger.info(f"Reloaded engines for levels {levels}")
+    return jsonify({'reloaded_levels': levels})
+
+
 def predict_move_with_metrics(fen_string: str, level: int = 1500, nodes: int = 1):
     """
     Wrapper around predict_move that tracks engine caching.
     Returns tuple of (move, was_engine_cached)
     """
-    from maia_engine import _engine_cache
-    
     # Check if engine is already cached
-    engine_was_cached = level in _engine_cache
+    engine_was_cached = level in maia_engine._engine_cache
     
-    # Call the original predict_move function
-    move = predict_move(fen_string, level, nodes)
+    # Call the original predict_move function (looked up on the module so
+    # it can be patched in tests)
+    move = maia_engine.predict_move(fen_string, level, nodes)
     
     return move, engine_was_cached
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the per-request CPU overhead of /get_move
+
+Compares the old request path (stdlib JSON, int() coercions,
+board.is_game_over()) with the fast path (move_request validation,
+is_terminal and the orjson provider when installed).  The engine itself is
+not timed.
+
+Usage:
+    python benchmark_request.py [--number N]
+"""
+
+import json
+import argparse
+import timeit
+
+import chess
+
+from json_provider import orjson
+from move_request import parse_move_request, is_terminal
+
+POSITIONS = [
+    'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R w KQ - 2 9',
+    '8/8/8/8/8/8/6KP/7k w - - 0 1',
+]
+
+RESPONSE = {
+    'move': 'e2e4',
+    'level': 1500,
+    'nodes': 1,
+    'response_time_ms': 1.23,
+    'engine_cached': True,
+    'computation_time_ms': 0.45,
+    'engine_type': 'LC0',
+}
+
+
+def old_path(body: bytes) -> None:
+    data = json.loads(body)
+    fen = data.get('fen')
+    level = int(data.get('level', 1500))
+    nodes = int(data.get('nodes', 1))
+    board = chess.Board(fen)
+    board.is_game_over()
+    json.dumps(dict(RESPONSE, level=level, nodes=nodes), sort_keys=True)
+
+
+def new_path(body: bytes) -> None:
+    data = orjson.loads(body) if orjson is not None else json.loads(body)
+    fen, level, nodes = parse_move_request(data)
+    board = chess.Board(fen)
+    is_terminal(board)
+    if orjson is not None:
+        orjson.dumps(dict(RESPONSE, level=level, nodes=nodes))
+    else:
+        json.dumps(dict(RESPONSE, level=level, nodes=nodes))
+
+
+def bench(func, bodies, number: int) -> float:
+    """Return the mean time per request in microseconds."""
+    total = 0.0
+    for body in bodies:
+        total += timeit.timeit(lambda: func(body), number=number)
+    return total / (number * len(bodies)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /get_move request overhead')
+    parser.add_argument('--number', type=int, default=20000, help='iterations per position')
+    args = parser.parse_args()
+
+    bodies = [json.dumps({'fen': fen, 'level': 1500, 'nodes': 1}).encode() for fen in POSITIONS]
+
+    print(f"JSON codec: {'orjson' if orjson is not None else 'stdlib json'}")
+    old = bench(old_path, bodies, args.number)
+    new = bench(new_path, bodies, args.number)
+    print(f"old path: {old:8.2f} us/request")
+    print(f"new path: {new:8.2f} us/request")
+    print(f"speedup:  {old / new:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
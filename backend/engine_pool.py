@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Supervised Engine Pool
+
+Keeps a small pool of engine processes for one Maia level.  Dead or hung
+engines are evicted and replaced in the background while requests are
+routed to the remaining members, and the whole pool can be swapped for
+engines loaded with new weights without interrupting in-flight searches.
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# How long a request waits for a replacement engine when no member is healthy
+ACQUIRE_TIMEOUT_SECONDS = 30
+
+# Background restarts back off between failed attempts
+RESTART_ATTEMPTS = 3
+RESTART_BACKOFF_SECONDS = 1.0
+
+
+def engine_is_alive(engine: Any) -> bool:
+    """Return False once the engine's process has exited.
+
+    python-chess engines expose the process exit code as the
+    ``protocol.returncode`` future; engines without one (the random
+    fallback) are always considered alive.
+    """
+    returncode = getattr(getattr(engine, 'protocol', None), 'returncode', None)
+    return returncode is None or not returncode.done()
+
+
+def _close_engine(engine: Any, graceful: bool) -> None:
+    try:
+        if graceful:
+            engine.quit()
+        else:
+            engine.close()
+    except Exception as exc:  # pragma: no cover - best effort cleanup
+        logger.debug(f"Error while closing engine: {exc}")
+
+
+class _Member(object):
+    __slots__ = ('engine', 'in_flight', 'retired', 'graceful')
+
+    def __init__(self, engine: Any):
+        self.engine = engine
+        self.in_flight = 0
+        self.retired = False
+        self.graceful = True
+
+
+class EnginePool(object):
+    """A supervised set of interchangeable engines.
+
+    Args:
+        name: label used in log messages
+        start_engine: factory returning a new, ready engine
+        size: number of engines to keep running
+    """
+
+    def __init__(self, name: str, start_engine: Callable[[], Any], size: int = 1):
+        self.name = name
+        self.start_engine = start_engine
+        self.size = max(1, size)
+        self.restarts = 0
+        self.reloads = 0
+        self._members: List[_Member] = []
+        self._pending = 0
+        self._next = 0
+        self._last_error: Optional[BaseException] = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def start(self) -> None:
+        """Start the first engine synchronously and the rest in the background.
+
+        Errors from the first start (e.g. missing weights) propagate so the
+        caller can report them.
+        """
+        engine = self.start_engine()
+        with self._cond:
+            self._members.append(_Member(engine))
+            for _ in range(self.size - 1):
+                self._spawn_replacement()
+
+    def _spawn_replacement(self) -> None:
+        # Must be called with the lock held
+        self._pending += 1
+        threading.Thread(
+            target=self._replace,
+            name=f"engine-restart-{self.name}",
+            daemon=True,
+        ).start()
+
+    def _replace(self) -> None:
+        # An engine started before a reload() has the old weights
+        with self._cond:
+            generation = self.reloads
+            start_engine = self.start_engine
+        engine = None
+        error = None
+        for attempt in range(RESTART_ATTEMPTS):
+            try:
+                engine = start_engine()
+                break
+            except Exception as exc:
+                error = exc
+                logger.error(f"Engine {self.name} restart attempt {attempt + 1} failed: {exc}")
+                time.sleep(RESTART_BACKOFF_SECONDS * (attempt + 1))
+        with self._cond:
+            self._pending -= 1
+            if engine is not None and (self._closed or generation != self.reloads
+                                       or len(self._members) >= self.size):
+                _close_engine(engine, graceful=True)
+            elif engine is not None:
+                self._members.append(_Member(engine))
+                self._last_error = None
+                logger.info(f"Engine {self.name} replacement ready")
+            else:
+                self._last_error = error
+            self._cond.notify_all()
+
+    def _healthy_members(self) -> List[_Member]:
+        # Must be called with the lock held; evicts members whose process died
+        for m in [m for m in self._members if not engine_is_alive(m.engine)]:
+            logger.warning(f"Engine {self.name} process exited, replacing it")
+            self._retire(m, graceful=False)
+        return self._members
+
+    def _retire(self, member: _Member, graceful: bool) -> None:
+        # Must be called with the lock held
+        if member.retired:
+            return
+        member.retired = True
+        member.graceful = graceful
+        if member in self._members:
+            self._members.remove(member)
+            if not graceful:
+                self.restarts += 1
+                if len(self._members) + self._pending < self.size:
+                    self._spawn_replacement()
+        if member.in_flight == 0:
+            self._close(member)
+
+    def _close(self, member: _Member) -> None:
+        threading.Thread(
+            target=_close_engine,
+            args=(member.engine, member.graceful),
+            name=f"engine-close-{self.name}",
+            daemon=True,
+        ).start()
+
+    @contextmanager
+    def lease(self, timeout: float = ACQUIRE_TIMEOUT_SECONDS) -> Iterator[Any]:
+        """Borrow a healthy engine, waiting for a replacement if needed."""
+        member = self._acquire(timeout)
+        try:
+            yield member.engine
+        finally:
+            with self._cond:
+                member.in_flight -= 1
+                if member.retired and member.in_flight == 0:
+                    self._close(member)
+
+    def _acquire(self, timeout: float) -> _Member:
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                members = self._healthy_members()
+                if members:
+                    # Prefer the least busy engine, round robin on ties
+                    self._next += 1
+                    order = members[self._next % len(members):] + members[:self._next % len(members)]
+                    member = min(order, key=lambda m: m.in_flight)
+                    member.in_flight += 1
+                    return member
+                if self._pending == 0:
+                    if self._last_error is not None:
+                        error, self._last_error = self._last_error, None
+                        raise RuntimeError(f"No engine available for {self.name}: {error}") from error
+                    self._spawn_replacement()
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError(f"Timed out waiting for an engine for {self.name}")
+                self._cond.wait(remaining)
+
+    def evict(self, engine: Any, reason: str = '') -> None:
+        """Remove a dead or hung engine; a replacement starts in the background."""
+        with self._cond:
+            for m in self._members:
+                if m.engine is engine:
+                    logger.warning(f"Evicting engine {self.name}: {reason}")
+                    self._retire(m, graceful=False)
+                    break
+
+    def reload(self, start_engine: Optional[Callable[[], Any]] = None) -> None:
+        """Replace every engine with freshly started ones.
+
+        New engines are started before any old one is retired, and old
+        engines are only shut down once their in-flight searches finish, so
+        no request is dropped.  Raises if the new engines fail to start, in
+        which case the old ones keep serving.
+        """
+        factory = start_engine or self.start_engine
+        new_engines = []
+        try:
+            for _ in range(self.size):
+                new_engines.append(factory())
+        except Exception:
+            for engine in new_engines:
+                _close_engine(engine, graceful=True)
+            raise
+        with self._cond:
+            self.start_engine = factory
+            old_members = list(self._members)
+            self._members = [_Member(e) for e in new_engines]
+            for m in old_members:
+                m.retired = True
+                if m.in_flight == 0:
+                    self._close(m)
+            self.reloads += 1
+            self._cond.notify_all()
+        logger.info(f"Reloaded {len(new_engines)} engine(s) for {self.name}")
+
+    def shutdown(self) -> None:
+        """Stop every engine immediately."""
+        with self._cond:
+            self._closed = True
+            members, self._members = self._members, []
+        for m in members:
+            m.retired = True
+            _close_engine(m.engine, graceful=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'pool_size': self.size,
+                'healthy_engines': len(self._members),
+                'restarting_engines': self._pending,
+                'in_flight': sum(m.in_flight for m in self._members),
+                'restarts': self.restarts,
+                'reloads': self.reloads,
+            }
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Human Move Probability Scoring
+
+Scores a played game against Maia: for every ply and every requested level,
+the probability Maia assigned to the move actually played and that move's
+rank among the legal moves.  Positions are spread over the engine pools of
+all requested levels in parallel.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import chess
+import chess.pgn
+
+from move_request import RequestValidationError, DEFAULT_LEVEL, _as_int
+
+# Keep requests bounded; a long game is ~300 plies
+MAX_GAME_PLIES = 600
+MAX_PGN_LENGTH = 64 * 1024
+MAX_LEVELS = 9
+
+# Number of plies scored concurrently per level
+SCORING_THREADS_PER_LEVEL = int(os.environ.get("MAIA_SCORING_THREADS", os.environ.get("MAIA_ENGINES_PER_LEVEL", 1)))
+
+# lc0 sees the current position plus 7 previous ones
+HISTORY_PLIES = 7
+
+
+class ScoreRequest(NamedTuple):
+    pgn: str
+    levels: List[int]
+    nodes: int
+
+
+def parse_score_request(data: Any) -> ScoreRequest:
+    """Validate a decoded ``/score_game`` payload."""
+    if not data or not isinstance(data, dict):
+        raise RequestValidationError('No JSON data provided')
+
+    pgn = data.get('pgn')
+    if not pgn or not isinstance(pgn, str):
+        raise RequestValidationError('PGN string is required')
+    if len(pgn) > MAX_PGN_LENGTH:
+        raise RequestValidationError(f'PGN must be at most {MAX_PGN_LENGTH} characters')
+
+    levels = data.get('levels', [data.get('level', DEFAULT_LEVEL)])
+    if not isinstance(levels, list) or not levels:
+        raise RequestValidationError('Levels must be a non-empty list of integers')
+    levels = sorted(set(_as_int(level, 'Level') for level in levels))
+    if len(levels) > MAX_LEVELS:
+        raise RequestValidationError(f'At most {MAX_LEVELS} levels can be scored at once')
+
+    # Only the policy prior is used, extra nodes just cost time
+    nodes = _as_int(data.get('nodes', 1), 'Nodes')
+    if not 1 <= nodes <= 100:
+        raise RequestValidationError('Nodes must be an integer between 1 and 100')
+
+    return ScoreRequest(pgn, levels, nodes)
+
+
+def read_game(pgn: str) -> Tuple[chess.Board, List[chess.Move]]:
+    """Parse a single PGN game and return its starting board and moves."""
+    game = chess.pgn.read_game(io.StringIO(pgn))
+    if game is None:
+        raise RequestValidationError('Could not parse PGN')
+    if game.errors:
+        raise RequestValidationError(f'Invalid PGN: {game.errors[0]}')
+
+    moves = list(game.mainline_moves())
+    if not moves:
+        raise RequestValidationError('PGN contains no moves')
+    if len(moves) > MAX_GAME_PLIES:
+        raise RequestValidationError(f'Games are limited to {MAX_GAME_PLIES} plies')
+    return game.board(), moves
+
+
+def move_rank(probs: Dict[str, float], move: str) -> Optional[int]:
+    """1-based rank of *move* by probability, ties share the better rank."""
+    if move not in probs:
+        return None
+    p = probs[move]
+    return 1 + sum(1 for q in probs.values() if q > p)
+
+
+def score_game(
+    pgn: str,
+    levels: List[int],
+    nodes: int = 1,
+    score_moves: Optional[Callable[[chess.Board, int, int], Dict[str, float]]] = None,
+) -> Dict[str, Any]:
+    """Score every move of *pgn* at each of *levels*.
+
+    ``score_moves(board, level, nodes)`` returns the probability of each
+    legal move, it defaults to :func:`maia_engine.score_moves`.
+    """
+    if score_moves is None:
+        from maia_engine import score_moves
+
+    board, moves = read_game(pgn)
+
+    # Positions before each move, each with just enough history for lc0
+    positions = []
+    for move in moves:
+        positions.append((board.copy(stack=HISTORY_PLIES), move))
+        board.push(move)
+
+    # Interleave levels so every level's engines are kept busy
+    tasks = [(level, i) for i in range(len(positions)) for level in levels]
+
+    def run(task):
+        level, i = task
+        return score_moves(positions[i][0], level, nodes)
+
+    workers = max(1, SCORING_THREADS_PER_LEVEL) * len(levels)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='score-game') as executor:
+        results = list(executor.map(run, tasks))
+
+    plies = []
+    for i, (position, move) in enumerate(positions):
+        plies.append({
+            'ply': i + 1,
+            'move': move.uci(),
+            'san': position.san(move),
+            'fen': position.fen(),
+            'scores': {},
+        })
+    for (level, i), probs in zip(tasks, results):
+        played = plies[i]['move']
+        plies[i]['scores'][level] = {
+            'probability': round(probs.get(played, 0.0), 6),
+            'rank': move_rank(probs, played),
+        }
+
+    summary = {}
+    for level in levels:
+        scores = [ply['scores'][level] for ply in plies]
+        summary[level] = {
+            'mean_probability': round(sum(s['probability'] for s in scores) / len(scores), 6),
+            'top1_rate': round(sum(1 for s in scores if s['rank'] == 1) / len(scores), 6),
+        }
+
+    return {
+        'levels': levels,
+        'nodes': nodes,
+        'plies': plies,
+        'summary': summary,
+    }
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Maia Analysis Job Queue
+
+Runs long searches (high ``nodes`` values) in a local pool of worker
+processes so they never tie up HTTP workers.  Job state lives in a small
+SQLite database, which lets every Gunicorn worker see every job regardless
+of which worker accepted it.
+"""
+
+import os
+import time
+import uuid
+import sqlite3
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional
+
+from engine_pool import ACQUIRE_TIMEOUT_SECONDS
+from maia_engine import ENGINE_MOVE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs are kept around this long so clients can collect results
+JOB_TTL_SECONDS = 60 * 60
+
+# Unfinished jobs older than these were lost with the process running them
+# (a search can wait for an engine and be retried once, hence the margin)
+STALE_RUNNING_SECONDS = 2 * ENGINE_MOVE_TIMEOUT + ACQUIRE_TIMEOUT_SECONDS + 60
+STALE_QUEUED_SECONDS = JOB_TTL_SECONDS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    fen TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    nodes INTEGER NOT NULL,
+    move TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+)
+"""
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_FINISHED = (STATUS_DONE, STATUS_FAILED)
+
+
+def get_db_path() -> str:
+    """Return the SQLite job store path (``MAIA_JOBS_DB`` overrides it)."""
+    return os.environ.get(
+        "MAIA_JOBS_DB",
+        os.path.join(tempfile.gettempdir(), "maia-jobs.sqlite3"),
+    )
+
+
+class JobStore(object):
+    """SQLite backed job table shared by the API and the worker processes."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A fresh connection per call keeps this safe across threads and
+        # processes; SQLite connections are cheap to open. The connection's
+        # own context manager only commits or rolls back, so it's closed here.
+        with closing(sqlite3.connect(self.db_path, timeout=30)) as conn:
+            conn.row_factory = sqlite3.Row
+            with conn:
+                yield conn
+
+    def create(self, fen: str, level: int, nodes: int) -> str:
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, fen, level, nodes, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, fen, level, nodes, time.time()),
+            )
+        return job_id
+
+    def mark_running(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, started = ? WHERE id = ?",
+                (STATUS_RUNNING, time.time(), job_id),
+            )
+
+    def mark_done(self, job_id: str, move: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, move = ?, finished = ? WHERE id = ?",
+                (STATUS_DONE, move, time.time(), job_id),
+            )
+
+    def mark_failed(self, job_id: str, error: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND status NOT IN (?, ?)",
+                (STATUS_FAILED, error, time.time(), job_id, *_FINISHED),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def fail_stale(self) -> int:
+        """Mark jobs that can no longer finish as failed, returning how many."""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished = ? "
+                "WHERE (status = ? AND started < ?) OR (status = ? AND created < ?)",
+                (STATUS_FAILED, "Job was lost, its worker stopped", now,
+                 STATUS_RUNNING, now - STALE_RUNNING_SECONDS,
+                 STATUS_QUEUED, now - STALE_QUEUED_SECONDS),
+            )
+        if cur.rowcount:
+            logger.warning(f"Marked {cur.rowcount} stale job(s) as failed")
+        return cur.rowcount
+
+    def prune(self, max_age: float = JOB_TTL_SECONDS) -> int:
+        """Fail stale jobs and delete finished jobs older than *max_age* seconds."""
+        self.fail_stale()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                (*_FINISHED, time.time() - max_age),
+            )
+        return cur.rowcount
+
+
+def _run_job(db_path: str, job_id: str, fen: str, level: int, nodes: int) -> None:
+    """Worker process entry point; engines stay cached per worker process."""
+    from maia_engine import predict_move
+
+    store = JobStore(db_path)
+    store.mark_running(job_id)
+    try:
+        move = predict_move(fen, level, nodes)
+    except Exception as exc:
+        store.mark_failed(job_id, str(exc))
+    else:
+        store.mark_done(job_id, move)
+
+
+class JobQueue(object):
+    """Process pool that executes jobs recorded in a :class:`JobStore`."""
+
+    def __init__(self, db_path: str = None, max_workers: int = None):
+        self.store = JobStore(db_path or get_db_path())
+        self.max_workers = max_workers or int(os.environ.get("MAIA_JOB_WORKERS", 1))
+        # spawn rather than fork so workers don't inherit the parent's lc0
+        # pipes or Flask state
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        self._lock = Lock()
+        # Jobs left behind by a previous process that died
+        self.store.prune()
+
+    def submit(self, fen: str, level: int, nodes: int) -> str:
+        """Record a new job and hand it to the pool, returning its id."""
+        self.store.prune()
+        job_id = self.store.create(fen, level, nodes)
+        with self._lock:
+            future = self._executor.submit(_run_job, self.store.db_path, job_id, fen, level, nodes)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        logger.info(f"Queued job {job_id}: Level={level}, Nodes={nodes}")
+        return job_id
+
+    def _on_done(self, job_id: str, future) -> None:
+        # Only hit if the worker itself died (e.g. BrokenProcessPool); normal
+        # engine errors are recorded by the worker.
+        exc = future.exception()
+        if exc is not None:
+            logger.error(f"Job {job_id} worker failed: {exc}")
+            self.store.mark_failed(job_id, f"Worker failed: {exc}")
+
+    def get(self, job_id: str, wait: float = 0, poll_interval: float = 0.05) -> Optional[Dict[str, Any]]:
+        """Return the job, blocking up to *wait* seconds for it to finish."""
+        deadline = time.time() + wait
+        job = self.store.get(job_id)
+        while job is not None and job['status'] not in _FINISHED and time.time() < deadline:
+            time.sleep(poll_interval)
+            job = self.store.get(job_id)
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.max_workers,
+            'jobs': self.store.counts(),
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+def job_to_json(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Format a job row for the API response."""
+    ret = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'fen': job['fen'],
+        'level': job['level'],
+        'nodes': job['nodes'],
+    }
+    if job['status'] == STATUS_DONE:
+        ret['move'] = job['move']
+    elif job['status'] == STATUS_FAILED:
+        ret['error'] = job['error']
+    if job['started'] is not None:
+        ret['queue_time_ms'] = round((job['started'] - job['created']) * 1000, 2)
+    if job['finished'] is not None and job['started'] is not None:
+        ret['computation_time_ms'] = round((job['finished'] - job['started']) * 1000, 2)
+    return ret
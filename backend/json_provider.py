@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Optional fast JSON codec for Flask
+
+Uses orjson for request parsing and response encoding when it is installed,
+otherwise the app keeps Flask's default provider.
+"""
+
+import typing as t
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson.
+
+    Unsupported types fall back to Flask's default serialiser, and integer
+    dict keys (used in the metrics payloads) are allowed.
+    """
+
+    option = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def dumps(self, obj: t.Any, **kwargs: t.Any) -> str:
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s: t.Union[str, bytes], **kwargs: t.Any) -> t.Any:
+        return orjson.loads(s)
+
+    def response(self, *args: t.Any, **kwargs: t.Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Skip the bytes -> str -> bytes round trip of dumps()
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option),
+            mimetype=self.mimetype,
+        )
+
+
+def install_json_provider(app) -> bool:
+    """Switch *app* to the orjson provider if available, returns whether it did."""
+    if orjson is None:
+        return False
+    app.json_provider_class = ORJSONProvider
+    app.json = ORJSONProvider(app)
+    return True
@@ -7,6 +7,8 @@ Enhanced with comprehensive validation logging for diagnostic purposes.
 """
 
 import os
+import re
+import asyncio
 import subprocess
 import tempfile
 import time
@@ -27,6 +29,10 @@ import chess
 import chess.engine  # type: ignore
 import gzip
 
+from weights_cache import prepare_weights, WeightsValidationError
+from move_request import is_terminal
+from engine_pool import EnginePool
+
 # Configure validation logger
 validation_logger = logging.getLogger('maia_validation')
 validation_logger.setLevel(logging.INFO)
@@ -48,8 +54,24 @@ _WEIGHTS_DIRS = [
     os.path.join(os.path.dirname(__file__), "models"),             # For Docker deployment
 ]
 
-# Cache of running lc0 processes keyed by skill level (1100-1900)
-_engine_cache: dict[int, chess.engine.SimpleEngine] = {}
+# Supervised pools of running lc0 processes keyed by skill level (1100-1900)
+_engine_cache: dict[int, EnginePool] = {}
+_engine_cache_lock = Lock()
+
+# Number of lc0 processes kept per level
+ENGINES_PER_LEVEL = int(os.environ.get("MAIA_ENGINES_PER_LEVEL", 1))
+
+# Searches are capped at this many seconds; python-chess raises a timeout if
+# the engine hasn't answered a few seconds after that, so a hung lc0 is
+# detected instead of blocking the request forever.
+ENGINE_MOVE_TIMEOUT = float(os.environ.get("MAIA_ENGINE_MOVE_TIMEOUT", 60))
+
+# lc0 prints the policy prior of every root move when VerboseMoveStats is on:
+#   e2e4  (322 ) N:       0 (+ 0) (P:  9.21%) (WL:  -.-----) ...
+_VERBOSE_STATS_RE = re.compile(r"^(\S+)\s.*\(P: +([\d.]+)%\)")
+# lc0's default PolicyTemperature is above 1 and flattens the priors, the
+# scores must be Maia's raw policy
+_POLICY_OPTIONS = {'VerboseMoveStats': True, 'PolicyTemperature': 1.0}
 
 # Engine performance tracking
 _engine_stats = {
@@ -57,6 +79,7 @@ _engine_stats = {
     'move_counts': {},    # level -> number of moves computed
     'total_compute_time': {},  # level -> total computation time
     'last_used': {},      # level -> last usage timestamp
+    'engine_failures': {},  # level -> number of dead/hung engines replaced
 }
 
 # Configure logging
@@ -73,19 +96,18 @@ def _get_weights_path(level: int) -> str:
     raise FileNotFoundError(f"Model file not found for level {level}: {filename}")
 
 
-def _get_engine(level: int) -> chess.engine.SimpleEngine:
-    """Return a cached lc0 engine initialised with the correct Maia weights."""
-    if level in _engine_cache:
-        # Update last used timestamp
-        _engine_stats['last_used'][level] = time.time()
-        logger.debug(f"Engine cache hit for level {level}")
-        return _engine_cache[level]
-
-    logger.info(f"Creating new engine for level {level}")
-    startup_start = time.time()
-
+def _start_engine(level: int) -> chess.engine.SimpleEngine:
+    """Start a new lc0 engine initialised with the correct Maia weights."""
     weights_path = _get_weights_path(level)
 
+    # Load from the shared decompressed copy so lc0 doesn't gunzip the
+    # network on every start; fall back to the .pb.gz if the cache can't be
+    # written (e.g. read-only filesystem).
+    try:
+        weights_path = prepare_weights(weights_path)
+    except (OSError, WeightsValidationError) as exc:
+        logger.warning(f"Could not prepare cached weights for level {level}: {exc}")
+
     # lc0 must be available in PATH. Render/Dockerfile installs it via apt.
     lc0_path = os.environ.get("LC0_PATH", "lc0")
 
@@ -109,22 +131,119 @@ def _get_engine(level: int) -> chess.engine.SimpleEngine:
             def quit(self):  # noqa: D401,N802
                 pass
 
-        engine = _RandomEngine()
+            def close(self):  # noqa: D401,N802
+                pass
 
-    startup_time = time.time() - startup_start
-    
-    # Record engine statistics
-    _engine_stats['startup_times'][level] = startup_time
-    _engine_stats['move_counts'][level] = 0
-    _engine_stats['total_compute_time'][level] = 0.0
-    _engine_stats['last_used'][level] = time.time()
-    
-    logger.info(f"Engine for level {level} started in {startup_time*1000:.2f}ms")
+        engine = _RandomEngine()
 
-    _engine_cache[level] = engine
     return engine
 
 
+def _get_engine_pool(level: int) -> EnginePool:
+    """Return the cached engine pool for *level*, starting it if needed."""
+    with _engine_cache_lock:
+        if level in _engine_cache:
+            # Update last used timestamp
+            _engine_stats['last_used'][level] = time.time()
+            logger.debug(f"Engine cache hit for level {level}")
+            return _engine_cache[level]
+
+        logger.info(f"Creating new engine for level {level}")
+        startup_start = time.time()
+
+        pool = EnginePool(f"maia-{level}", lambda: _start_engine(level), size=ENGINES_PER_LEVEL)
+        pool.start()
+
+        startup_time = time.time() - startup_start
+        
+        # Record engine statistics
+        _engine_stats['startup_times'][level] = startup_time
+        _engine_stats['move_counts'][level] = 0
+        _engine_stats['total_compute_time'][level] = 0.0
+        _engine_stats['last_used'][level] = time.time()
+        _engine_stats['engine_failures'][level] = 0
+        
+        logger.info(f"Engine for level {level} started in {startup_time*1000:.2f}ms")
+
+        _engine_cache[level] = pool
+        return pool
+
+
+def reload_weights(level: int = None) -> list:
+    """Restart engines on the current weight files without dropping requests.
+
+    Replacement engines are started before the old ones are retired, and old
+    engines finish their in-flight searches first.  Reloads every running
+    level when *level* is None; returns the levels reloaded.
+    """
+    with _engine_cache_lock:
+        levels = [level] if level is not None else list(_engine_cache.keys())
+    reloaded = []
+    for lvl in levels:
+        pool = _engine_cache.get(lvl)
+        if pool is None:
+            continue
+        pool.reload()
+        reloaded.append(lvl)
+    return reloaded
+
+
+def _run_with_engine(pool: EnginePool, level: int, func):
+    """Call *func* with an engine leased from *pool* and return its result.
+
+    A dead or hung engine is evicted (and restarted in the background) and
+    the call is retried once on another pool member.
+    """
+    for attempt in range(2):
+        with pool.lease() as engine:
+            try:
+                return func(engine)
+            except (chess.engine.EngineTerminatedError, TimeoutError, asyncio.TimeoutError) as exc:
+                reason = str(exc) or type(exc).__name__
+                logger.error(f"Engine for level {level} failed: {reason}")
+                pool.evict(engine, reason)
+                _engine_stats['engine_failures'][level] = _engine_stats['engine_failures'].get(level, 0) + 1
+                if attempt:
+                    raise RuntimeError(f"lc0 engine error: {reason}") from exc
+            except chess.engine.EngineError as exc:
+                logger.error(f"Engine error for level {level}: {exc}")
+                raise RuntimeError(f"lc0 engine error: {exc}") from exc
+
+
+def _policy_from_engine(engine, board: chess.Board, nodes: int) -> Dict[str, float]:
+    if not hasattr(engine, 'analysis'):
+        # Random fallback engine: every legal move is equally likely
+        moves = [m.uci() for m in board.legal_moves]
+        return {m: 1.0 / len(moves) for m in moves}
+
+    probs = {}
+    limit = chess.engine.Limit(nodes=nodes, time=ENGINE_MOVE_TIMEOUT)
+    with engine.analysis(board, limit, options=_POLICY_OPTIONS) as analysis:
+        for info in analysis:
+            match = _VERBOSE_STATS_RE.match(info.get('string', ''))
+            if match is None or match.group(1) == 'node':
+                continue
+            # Older lc0 versions print castling as king-takes-rook (e1h1)
+            try:
+                move = board.parse_uci(match.group(1))
+            except ValueError:
+                continue
+            probs[move.uci()] = float(match.group(2)) / 100
+    return probs
+
+
+def score_moves(board: chess.Board, level: int = 1500, nodes: int = 1) -> Dict[str, float]:
+    """Return the probability Maia at *level* assigns to each legal move.
+
+    These are lc0's policy priors for the root moves.  *board* should carry
+    the game's move stack so the network sees the position history.
+    """
+    pool = _get_engine_pool(level)
+    probs = _run_with_engine(pool, level, lambda engine: _policy_from_engine(engine, board, nodes))
+    _engine_stats['last_used'][level] = time.time()
+    return probs
+
+
 def predict_move(fen_string: str, level: int = 1500, nodes: int = 1) -> str:  # noqa: D401
     """Return Maia's best move for *fen_string* at the given Elo *level*.
 
@@ -145,7 +264,7 @@ def predict_move(fen_string: str, level: int = 1500, nodes: int = 1) -> str:  #
     except ValueError as exc:
         raise ValueError(f"Invalid FEN string: {fen_string}") from exc
 
-    if board.is_game_over():
+    if is_terminal(board):
         raise ValueError("No legal moves available in the given position")
 
     # Validate nodes parameter
@@ -155,16 +274,13 @@ def predict_move(fen_string: str, level: int = 1500, nodes: int = 1) -> str:  #
     # Log move request
     logger.debug(f"Computing move for level {level}, nodes {nodes}, position: {fen_string[:30]}...")
 
-    engine = _get_engine(level)
+    pool = _get_engine_pool(level)
     
     move_computation_start = time.time()
 
-    try:
-        # Use configurable nodes instead of hardcoded 1
-        result = engine.play(board, chess.engine.Limit(nodes=nodes))
-    except chess.engine.EngineError as exc:
-        logger.error(f"Engine error for level {level}: {exc}")
-        raise RuntimeError(f"lc0 engine error: {exc}") from exc
+    # Use configurable nodes instead of hardcoded 1
+    limit = chess.engine.Limit(nodes=nodes, time=ENGINE_MOVE_TIMEOUT)
+    result = _run_with_engine(pool, level, lambda engine: engine.play(board, limit))
 
     if result.move is None:
         logger.error(f"Engine returned no move for level {level}")
@@ -201,7 +317,9 @@ def get_engine_stats() -> dict:
             'total_compute_time_ms': round(total_time * 1000, 2),
             'average_move_time_ms': round((total_time / move_count * 1000) if move_count > 0 else 0, 2),
             'last_used_ago_seconds': round(time.time() - _engine_stats['last_used'].get(level, 0), 2),
-            'is_cached': True
+            'engine_failures': _engine_stats['engine_failures'].get(level, 0),
+            'is_cached': True,
+            **_engine_cache[level].stats(),
         }
     
     return {
@@ -214,12 +332,24 @@ def get_engine_stats() -> dict:
 
 def _shutdown_engines():
     """Terminate all cached lc0 subprocesses – useful for tests."""
-    for eng in _engine_cache.values():
-        try:
-            eng.quit()
-        except Exception:  # pragma: no cover
-            pass
-    _engine_cache.clear()
+    with _engine_cache_lock:
+        for pool in _engine_cache.values():
+            try:
+                pool.shutdown()
+            except Exception:  # pragma: no cover
+                pass
+        _engine_cache.clear()
+
+
+_lc0_available = None
+
+
+def get_engine_type() -> str:
+    """Return "LC0" or "RANDOM_FALLBACK", checking for lc0 only once."""
+    global _lc0_available
+    if _lc0_available is None:
+        _lc0_available = _check_lc0_availability()
+    return "LC0" if _lc0_available else "RANDOM_FALLBACK"
 
 
 def _check_lc0_availability() -> bool:
@@ -242,7 +372,7 @@ def predict_move_with_validation_logging(fen_string: str, level: int = 1500, nod
     start_time = time.time()
     
     # Log engine availability check
-    engine_type = "LC0" if _check_lc0_availability() else "RANDOM_FALLBACK"
+    engine_type = get_engine_type()
     validation_logger.info(f"ENGINE_CHECK: Level={level}, Type={engine_type}, Nodes={nodes}")
     
     # Track move quality indicators
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Move Request Validation
+
+Validates ``/get_move`` style payloads with cheap checks before any
+python-chess work is done, and provides a terminal-position test that
+generates at most one legal move.
+"""
+
+import re
+from typing import Any, NamedTuple
+
+import chess
+
+DEFAULT_LEVEL = 1500
+DEFAULT_NODES = 1
+MIN_NODES = 1
+MAX_NODES = 10000
+
+# A FEN is at most ~90 characters; anything much longer is not worth parsing
+MAX_FEN_LENGTH = 128
+
+# Structural pre-check of the piece placement field.  python-chess still does
+# the full validation, this only rejects obvious garbage at C speed.
+_BOARD_FIELD_RE = re.compile(r'[1-8pnbrqkPNBRQK~]{1,16}(?:/[1-8pnbrqkPNBRQK~]{1,16}){7}')
+
+
+class RequestValidationError(ValueError):
+    """Raised when a move request payload is invalid."""
+
+
+class MoveRequest(NamedTuple):
+    fen: str
+    level: int
+    nodes: int
+
+
+def _as_int(value: Any, name: str) -> int:
+    # Skip int() for the common case of a JSON integer
+    if type(value) is int:
+        return value
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        raise RequestValidationError(f'{name} must be an integer') from None
+
+
+def check_fen_syntax(fen: Any) -> str:
+    """Cheap syntax check of a FEN string, returns the stripped FEN."""
+    if not isinstance(fen, str) or len(fen) > MAX_FEN_LENGTH:
+        raise RequestValidationError(f'Invalid FEN string: {str(fen)[:MAX_FEN_LENGTH]}')
+    fen = fen.strip()
+    board_field = fen.split(' ', 1)[0]
+    if _BOARD_FIELD_RE.fullmatch(board_field) is None:
+        raise RequestValidationError(f'Invalid FEN string: {fen}')
+    return fen
+
+
+def parse_move_request(data: Any, check_nodes: bool = False) -> MoveRequest:
+    """Validate a decoded JSON payload and return a :class:`MoveRequest`.
+
+    Error messages match the ones the API has always returned.  Node range
+    checks are left to ``predict_move`` unless *check_nodes* is set.
+    """
+    if not data or not isinstance(data, dict):
+        raise RequestValidationError('No JSON data provided')
+
+    fen = data.get('fen')
+    if not fen:
+        raise RequestValidationError('FEN string is required')
+
+    level = _as_int(data.get('level', DEFAULT_LEVEL), 'Level')
+    nodes = _as_int(data.get('nodes', DEFAULT_NODES), 'Nodes')
+
+    if check_nodes and not MIN_NODES <= nodes <= MAX_NODES:
+        raise RequestValidationError(f'Nodes must be an integer between {MIN_NODES} and {MAX_NODES}')
+
+    return MoveRequest(check_fen_syntax(fen), level, nodes)
+
+
+def is_terminal(board: chess.Board) -> bool:
+    """Equivalent to ``board.is_game_over()`` for a board built from a FEN.
+
+    ``is_game_over`` may generate the legal moves up to three times (mate,
+    stalemate and seventy-five move checks) and looks for repetitions, which
+    can't exist without a move stack.  Here the move generator is only run
+    once and stops at the first legal move.
+    """
+    if board.is_insufficient_material():
+        return True
+    if not any(board.generate_legal_moves()):
+        return True
+    if board.halfmove_clock >= 150:
+        return True
+    return bool(board.move_stack) and board.is_fivefold_repetition()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Tests for the supervised engine pool
+"""
+
+import os
+import time
+import types
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest.mock import patch
+
+import chess
+import chess.engine
+
+import engine_pool
+import maia_engine
+from app import app
+from engine_pool import EnginePool
+
+
+class FakeEngine(object):
+    """Engine stand-in whose process can be killed."""
+
+    def __init__(self):
+        self.protocol = types.SimpleNamespace(returncode=Future())
+        self.quit_called = threading.Event()
+        self.closed = threading.Event()
+
+    def kill(self):
+        self.protocol.returncode.set_result(1)
+
+    def play(self, board, limit):
+        if self.protocol.returncode.done():
+            raise chess.engine.EngineTerminatedError('engine process died unexpectedly')
+        return types.SimpleNamespace(move=next(iter(board.legal_moves)))
+
+    def quit(self):
+        self.quit_called.set()
+
+    def close(self):
+        self.closed.set()
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestEnginePool(unittest.TestCase):
+    """Test cases for EnginePool."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.started = []
+        self.fail_starts = False
+
+    def start_engine(self):
+        if self.fail_starts:
+            raise OSError('lc0 failed to start')
+        engine = FakeEngine()
+        self.started.append(engine)
+        return engine
+
+    def test_pool_starts_requested_size(self):
+        """The first engine starts immediately, the rest in the background."""
+        pool = EnginePool('test', self.start_engine, size=3)
+        pool.start()
+        self.assertTrue(wait_for(lambda: pool.stats()['healthy_engines'] == 3))
+        pool.shutdown()
+        self.assertTrue(all(e.quit_called.is_set() for e in self.started))
+
+    def test_dead_engine_is_replaced(self):
+        """A crashed process is evicted and restarted on the next lease."""
+        pool = EnginePool('test', self.start_engine)
+        pool.start()
+        first = self.started[0]
+        first.kill()
+
+        with pool.lease() as engine:
+            self.assertIsNot(engine, first)
+        self.assertTrue(wait_for(first.closed.is_set))
+        self.assertEqual(pool.stats()['restarts'], 1)
+        pool.shutdown()
+
+    def test_evict_waits_for_replacement(self):
+        """Requests block until the replacement for an evicted engine is ready."""
+        pool = EnginePool('test', self.start_engine)
+        pool.start()
+        with pool.lease() as engine:
+            pool.evict(engine, 'hung')
+            # Not closed while still leased
+            self.assertFalse(engine.closed.is_set())
+        self.assertTrue(wait_for(engine.closed.is_set))
+
+        with pool.lease() as replacement:
+            self.assertIsNot(replacement, engine)
+        pool.shutdown()
+
+    def test_failed_restart_is_reported(self):
+        """If no engine can be started the lease raises instead of hanging."""
+        pool = EnginePool('test', self.start_engine)
+        pool.start()
+        self.fail_starts = True
+        self.started[0].kill()
+        with patch.object(engine_pool, 'RESTART_BACKOFF_SECONDS', 0):
+            with self.assertRaises(RuntimeError):
+                with pool.lease(timeout=5):
+                    pass
+        pool.shutdown()
+
+    def test_reload_keeps_in_flight_engine_until_done(self):
+        """Reload swaps engines but lets the old one finish its search."""
+        pool = EnginePool('test', self.start_engine)
+        pool.start()
+        with pool.lease() as old:
+            pool.reload()
+            self.assertFalse(old.quit_called.is_set())
+            with pool.lease() as new:
+                self.assertIsNot(new, old)
+        self.assertTrue(wait_for(old.quit_called.is_set))
+        self.assertEqual(pool.stats()['reloads'], 1)
+        self.assertEqual(pool.stats()['restarts'], 0)
+        pool.shutdown()
+
+    def test_failed_reload_keeps_old_engines(self):
+        """Old engines keep serving if the new ones fail to start."""
+        pool = EnginePool('test', self.start_engine)
+        pool.start()
+        self.fail_starts = True
+        with self.assertRaises(OSError):
+            pool.reload()
+        with pool.lease() as engine:
+            self.assertIs(engine, self.started[0])
+        pool.shutdown()
+
+    def test_failed_reload_closes_started_engines(self):
+        """Engines started before a reload fails are shut down."""
+        pool = EnginePool('test', self.start_engine, size=3)
+        pool.start()
+        self.assertTrue(wait_for(lambda: pool.stats()['healthy_engines'] == 3))
+        new_engines = []
+
+        def start_two():
+            if len(new_engines) == 2:
+                raise OSError('lc0 failed to start')
+            new_engines.append(FakeEngine())
+            return new_engines[-1]
+
+        with self.assertRaises(OSError):
+            pool.reload(start_two)
+        self.assertTrue(all(e.quit_called.is_set() for e in new_engines))
+        self.assertEqual(pool.stats()['healthy_engines'], 3)
+        pool.shutdown()
+
+    def test_replacement_started_before_reload_is_dropped(self):
+        """A restart that finishes after a reload doesn't add an old weights engine."""
+        release = threading.Event()
+        slow = []
+
+        def slow_start():
+            if not self.started:
+                return self.start_engine()
+            release.wait(5)
+            slow.append(FakeEngine())
+            return slow[-1]
+
+        pool = EnginePool('test', slow_start)
+        pool.start()
+        pool.evict(self.started[0], 'hung')
+        pool.reload(self.start_engine)
+        release.set()
+        self.assertTrue(wait_for(lambda: slow and slow[0].quit_called.is_set()))
+        self.assertEqual(pool.stats()['healthy_engines'], 1)
+        with pool.lease() as engine:
+            self.assertIs(engine, self.started[-1])
+        pool.shutdown()
+
+
+class TestEngineSupervision(unittest.TestCase):
+    """Test cases for predict_move with failing engines."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        maia_engine._shutdown_engines()
+        self.started = []
+        self.valid_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+    def tearDown(self):
+        """Clean up after tests."""
+        maia_engine._shutdown_engines()
+
+    def start_engine(self, level):
+        engine = FakeEngine()
+        self.started.append(engine)
+        return engine
+
+    def test_predict_move_retries_on_dead_engine(self):
+        """A move request survives the engine dying mid-search."""
+        with patch.object(maia_engine, '_start_engine', self.start_engine):
+            maia_engine.predict_move(self.valid_fen, 1500)
+            self.started[0].kill()
+            with patch.object(engine_pool, 'engine_is_alive', lambda e: True):
+                move = maia_engine.predict_move(self.valid_fen, 1500)
+
+        self.assertIn(chess.Move.from_uci(move), chess.Board(self.valid_fen).legal_moves)
+        self.assertEqual(len(self.started), 2)
+        stats = maia_engine.get_engine_stats()['engine_details'][1500]
+        self.assertEqual(stats['engine_failures'], 1)
+        self.assertEqual(stats['restarts'], 1)
+
+    def test_reload_endpoint(self):
+        """The reload endpoint is token protected and swaps engines."""
+        client = app.test_client()
+        with patch.object(maia_engine, '_start_engine', self.start_engine):
+            maia_engine.predict_move(self.valid_fen, 1500)
+
+            with patch.dict(os.environ, {}, clear=False):
+                os.environ.pop('MAIA_ADMIN_TOKEN', None)
+                self.assertEqual(client.post('/engines/reload').status_code, 404)
+
+            with patch.dict(os.environ, {'MAIA_ADMIN_TOKEN': 'secret'}):
+                response = client.post('/engines/reload', headers={'X-Admin-Token': 'wrong'})
+                self.assertEqual(response.status_code, 403)
+
+                response = client.post('/engines/reload', headers={'X-Admin-Token': 'secret'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json()['reloaded_levels'], [1500])
+
+        self.assertEqual(len(self.started), 2)
+        self.assertTrue(wait_for(self.started[0].quit_called.is_set))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for human move probability scoring
+"""
+
+import unittest
+from contextlib import contextmanager
+
+import chess
+
+import maia_engine
+from app import app
+from game_scoring import parse_score_request, read_game, move_rank, score_game
+from move_request import RequestValidationError
+
+PGN = '[Event "Test"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 4. O-O *'
+
+
+class TestGameScoring(unittest.TestCase):
+    """Test cases for game_scoring."""
+
+    def test_parse_score_request(self):
+        """Levels default to 1500 and are deduplicated."""
+        self.assertEqual(parse_score_request({'pgn': PGN}).levels, [1500])
+        req = parse_score_request({'pgn': PGN, 'levels': [1900, '1100', 1900], 'nodes': 2})
+        self.assertEqual((req.levels, req.nodes), ([1100, 1900], 2))
+
+        for data in [None, {}, {'pgn': 5}, {'pgn': PGN, 'levels': []},
+                     {'pgn': PGN, 'levels': ['x']}, {'pgn': PGN, 'nodes': 0}]:
+            with self.subTest(data=data):
+                with self.assertRaises(RequestValidationError):
+                    parse_score_request(data)
+
+    def test_read_game_rejects_bad_pgn(self):
+        """Illegal moves and empty games are rejected."""
+        board, moves = read_game(PGN)
+        self.assertEqual(len(moves), 7)
+        for pgn in ['1. e4 e4 *', '*', '[Event "x"]\n\n*']:
+            with self.subTest(pgn=pgn):
+                with self.assertRaises(RequestValidationError):
+                    read_game(pgn)
+
+    def test_move_rank(self):
+        """Ranks are 1-based and ties share the better rank."""
+        probs = {'a': 0.5, 'b': 0.2, 'c': 0.2, 'd': 0.1}
+        self.assertEqual([move_rank(probs, m) for m in 'abcd'], [1, 2, 2, 4])
+        self.assertIsNone(move_rank(probs, 'e'))
+
+    def test_score_game(self):
+        """Every ply is scored at every level with history attached."""
+        calls = []
+
+        def score_moves(board, level, nodes):
+            calls.append((board.fen(), level))
+            # Prefer moves in alphabetical order, stronger for higher levels
+            moves = sorted(m.uci() for m in board.legal_moves)
+            weights = [1.0 / (i + 1) ** (level / 1000) for i in range(len(moves))]
+            return {m: w / sum(weights) for m, w in zip(moves, weights)}
+
+        result = score_game(PGN, [1100, 1900], score_moves=score_moves)
+
+        self.assertEqual(len(calls), 14)
+        self.assertEqual([p['san'] for p in result['plies']], ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Nf6', 'O-O'])
+        first = result['plies'][0]
+        self.assertEqual(first['fen'], chess.STARTING_FEN)
+        self.assertEqual(first['scores'][1100]['rank'], 12)  # e2e4 is 12th alphabetically
+        self.assertGreater(first['scores'][1100]['probability'], first['scores'][1900]['probability'])
+        self.assertEqual(set(result['summary']), {1100, 1900})
+
+    def test_lc0_verbose_stats_parsing(self):
+        """Policy priors are read from lc0's verbose move stats."""
+        board = chess.Board('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+        lines = [
+            'e1h1  (1 ) N:       0 (+ 0) (P: 60.00%) (WL:  -.-----) (D: -.---)',
+            'a1a8  (2 ) N:       0 (+ 0) (P: 40.00%) (WL:  -.-----) (D: -.---)',
+            'node  (  20) N:       1 (+ 0) (P: 100.00%) (WL: 0.00000)',
+        ]
+
+        class FakeLc0(object):
+            @contextmanager
+            def analysis(self, board, limit, options):
+                assert options == {'VerboseMoveStats': True, 'PolicyTemperature': 1.0}
+                yield iter([{'depth': 1}] + [{'string': line} for line in lines])
+
+        probs = maia_engine._policy_from_engine(FakeLc0(), board, 1)
+        self.assertEqual(probs, {'e1g1': 0.6, 'a1a8': 0.4})
+
+    def test_score_game_endpoint(self):
+        """The endpoint scores a game with the available engine."""
+        client = app.test_client()
+        response = client.post('/score_game', json={'pgn': PGN, 'levels': [1500]})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(len(data['plies']), 7)
+        for ply in data['plies']:
+            self.assertIn('1500', ply['scores'])
+            self.assertGreater(ply['scores']['1500']['probability'], 0)
+
+        response = client.post('/score_game', json={'pgn': '1. e4 e4 *'})
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post('/score_game', json={'pgn': PGN, 'levels': [1234]})
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
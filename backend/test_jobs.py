@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Tests for the background analysis job queue and its API endpoints
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+import chess
+
+import app as app_module
+from app import app
+from job_queue import JobQueue, JobStore, job_to_json, STALE_RUNNING_SECONDS
+
+
+class TestJobStore(unittest.TestCase):
+    """Test cases for the SQLite job store."""
+
+    def setUp(self):
+        """Create a store in a temporary directory."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.tmp_dir, 'jobs.sqlite3'))
+        self.fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+    def tearDown(self):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.tmp_dir)
+
+    def test_job_lifecycle(self):
+        """Jobs move from queued to running to done."""
+        job_id = self.store.create(self.fen, 1500, 100)
+        self.assertEqual(self.store.get(job_id)['status'], 'queued')
+
+        self.store.mark_running(job_id)
+        self.assertEqual(self.store.get(job_id)['status'], 'running')
+
+        self.store.mark_done(job_id, 'e2e4')
+        job = job_to_json(self.store.get(job_id))
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['move'], 'e2e4')
+        self.assertIn('computation_time_ms', job)
+
+    def test_failure_does_not_overwrite_result(self):
+        """A late failure report doesn't clobber a finished job."""
+        job_id = self.store.create(self.fen, 1500, 100)
+        self.store.mark_done(job_id, 'e2e4')
+        self.store.mark_failed(job_id, 'worker died')
+        self.assertEqual(self.store.get(job_id)['status'], 'done')
+
+    def test_unknown_job(self):
+        """Unknown ids return None."""
+        self.assertIsNone(self.store.get('missing'))
+
+    def test_prune_finished_jobs(self):
+        """Only finished jobs are pruned."""
+        done_id = self.store.create(self.fen, 1500, 100)
+        self.store.mark_done(done_id, 'e2e4')
+        queued_id = self.store.create(self.fen, 1500, 100)
+        self.assertEqual(self.store.prune(max_age=-1), 1)
+        self.assertIsNone(self.store.get(done_id))
+        self.assertIsNotNone(self.store.get(queued_id))
+
+    def test_stale_jobs_fail(self):
+        """Jobs whose worker died are failed, recent ones are left alone."""
+        lost_id = self.store.create(self.fen, 1500, 100)
+        self.store.mark_running(lost_id)
+        running_id = self.store.create(self.fen, 1500, 100)
+        self.store.mark_running(running_id)
+        queued_id = self.store.create(self.fen, 1500, 100)
+        with self.store._connect() as conn:
+            conn.execute("UPDATE jobs SET started = started - ? WHERE id = ?", (STALE_RUNNING_SECONDS + 1, lost_id))
+
+        self.assertEqual(self.store.prune(), 0)
+        self.assertEqual(self.store.get(lost_id)['status'], 'failed')
+        self.assertEqual(self.store.get(running_id)['status'], 'running')
+        self.assertEqual(self.store.get(queued_id)['status'], 'queued')
+        self.assertEqual(self.store.prune(max_age=-1), 1)
+        self.assertIsNone(self.store.get(lost_id))
+
+
+class TestJobsAPI(unittest.TestCase):
+    """Test cases for the /jobs endpoints."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start a job queue backed by a temporary database."""
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.queue = JobQueue(db_path=os.path.join(cls.tmp_dir, 'jobs.sqlite3'), max_workers=1)
+        app_module._job_queue = cls.queue
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the workers and remove the database."""
+        app_module._job_queue = None
+        cls.queue.shutdown()
+        shutil.rmtree(cls.tmp_dir)
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.app = app.test_client()
+        self.app.testing = True
+        self.valid_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+    def test_submit_and_poll_job(self):
+        """A submitted job eventually returns a legal move."""
+        response = self.app.post('/jobs', json={'fen': self.valid_fen, 'level': 1500, 'nodes': 100})
+        self.assertEqual(response.status_code, 202)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['status'], 'queued')
+        self.assertEqual(response.headers['Location'], f"/jobs/{data['job_id']}")
+
+        response = self.app.get(f"/jobs/{data['job_id']}?wait=30")
+        self.assertEqual(response.status_code, 200)
+        job = json.loads(response.data.decode())
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['nodes'], 100)
+        self.assertIn(chess.Move.from_uci(job['move']), chess.Board(self.valid_fen).legal_moves)
+
+    def test_unknown_job_returns_404(self):
+        """Polling an unknown job id returns 404."""
+        response = self.app.get('/jobs/does-not-exist')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_wait_returns_400(self):
+        """A non-numeric wait parameter is rejected."""
+        response = self.app.get('/jobs/does-not-exist?wait=soon')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_fen_rejected_before_queueing(self):
+        """Bad positions are rejected synchronously."""
+        response = self.app.post('/jobs', json={'fen': 'invalid_fen', 'nodes': 100})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', json.loads(response.data.decode()))
+
+    def test_invalid_nodes_rejected(self):
+        """Out of range node counts are rejected."""
+        for nodes in [0, 10001, 'many']:
+            with self.subTest(nodes=nodes):
+                response = self.app.post('/jobs', json={'fen': self.valid_fen, 'nodes': nodes})
+                self.assertEqual(response.status_code, 400)
+
+    def test_missing_fen_rejected(self):
+        """Requests without a FEN are rejected."""
+        response = self.app.post('/jobs', json={'level': 1500})
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
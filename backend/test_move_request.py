@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for move request validation and the JSON codec
+"""
+
+import json
+import unittest
+
+import chess
+
+from app import app
+from json_provider import orjson
+from move_request import (
+    parse_move_request,
+    check_fen_syntax,
+    is_terminal,
+    RequestValidationError,
+)
+
+
+class TestMoveRequest(unittest.TestCase):
+    """Test cases for parse_move_request and friends."""
+
+    def setUp(self):
+        """Set up test fixtures."""
+        self.valid_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+    def test_defaults(self):
+        """Level and nodes default to 1500 and 1."""
+        req = parse_move_request({'fen': self.valid_fen})
+        self.assertEqual(req.fen, self.valid_fen)
+        self.assertEqual(req.level, 1500)
+        self.assertEqual(req.nodes, 1)
+
+    def test_string_numbers_are_coerced(self):
+        """Numeric strings are still accepted, as before."""
+        req = parse_move_request({'fen': self.valid_fen, 'level': '1100', 'nodes': '10'})
+        self.assertEqual((req.level, req.nodes), (1100, 10))
+
+    def test_error_messages(self):
+        """Error messages match the API's existing responses."""
+        cases = [
+            (None, 'No JSON data provided'),
+            ({}, 'No JSON data provided'),
+            ([1, 2], 'No JSON data provided'),
+            ({'level': 1500}, 'FEN string is required'),
+            ({'fen': self.valid_fen, 'level': 'abc'}, 'Level must be an integer'),
+            ({'fen': self.valid_fen, 'nodes': None}, 'Nodes must be an integer'),
+        ]
+        for data, message in cases:
+            with self.subTest(data=data):
+                with self.assertRaises(RequestValidationError) as ctx:
+                    parse_move_request(data)
+                self.assertEqual(str(ctx.exception), message)
+
+    def test_node_range_only_checked_when_requested(self):
+        """Node ranges are checked only with check_nodes."""
+        self.assertEqual(parse_move_request({'fen': self.valid_fen, 'nodes': 0}).nodes, 0)
+        with self.assertRaises(RequestValidationError):
+            parse_move_request({'fen': self.valid_fen, 'nodes': 0}, check_nodes=True)
+
+    def test_fen_syntax_precheck(self):
+        """Obviously broken FENs are rejected before python-chess sees them."""
+        for fen in ['invalid_fen', 'x' * 1000, 12345, '8/8/8 w - - 0 1', 'rnbqkbnr/ppppxppp/8/8/8/8/PPPPPPPP/RNBQKBNR w']:
+            with self.subTest(fen=fen):
+                with self.assertRaises(RequestValidationError):
+                    check_fen_syntax(fen)
+
+    def test_precheck_accepts_what_python_chess_accepts(self):
+        """The pre-check never rejects a FEN python-chess would load."""
+        for fen in [
+            self.valid_fen,
+            '8/8/8/8/8/8/6KP/7k w - - 0 1',
+            '8/8/8/8/8/8/6KP/7k',
+            'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w HAha - 0 1',
+            '  rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1  ',
+        ]:
+            with self.subTest(fen=fen):
+                chess.Board(check_fen_syntax(fen))
+
+    def test_is_terminal_matches_is_game_over(self):
+        """is_terminal agrees with python-chess on FEN positions."""
+        for fen in [
+            self.valid_fen,
+            'rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3',  # mate
+            '7k/5Q2/6K1/8/8/8/8/8 b - - 0 1',  # stalemate
+            '8/8/8/8/8/8/6K1/7k w - - 0 1',  # insufficient material
+            '8/8/8/8/8/8/6KP/7k w - - 150 200',  # seventy-five moves
+            '8/8/8/8/8/8/6KP/7k w - - 149 200',
+        ]:
+            board = chess.Board(fen)
+            with self.subTest(fen=fen):
+                self.assertEqual(is_terminal(board), board.is_game_over())
+
+
+@unittest.skipIf(orjson is None, 'orjson not installed')
+class TestJSONProvider(unittest.TestCase):
+    """Test cases for the orjson backed Flask JSON provider."""
+
+    def test_app_uses_orjson(self):
+        """The app round-trips JSON through orjson, including int keys."""
+        with app.app_context():
+            self.assertEqual(json.loads(app.json.dumps({1500: 'ok'})), {'1500': 'ok'})
+            self.assertEqual(app.json.loads(b'{"fen": "x"}'), {'fen': 'x'})
+
+    def test_malformed_json_rejected(self):
+        """Malformed bodies are still rejected."""
+        client = app.test_client()
+        response = client.post('/get_move', data='{"fen": ', content_type='application/json')
+        self.assertGreaterEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the Maia weights cache
+"""
+
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+
+from weights_cache import (
+    prepare_weights,
+    prepare_all_weights,
+    verify_prepared,
+    WeightsValidationError,
+    _prepared_paths,
+    _WEIGHTS_MAGIC,
+)
+
+
+class TestWeightsCache(unittest.TestCase):
+    """Test cases for decompressing and validating cached weights."""
+
+    def setUp(self):
+        """Create a fake network and an empty cache directory."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.weights_dir = os.path.join(self.tmp_dir, 'weights')
+        os.makedirs(self.weights_dir)
+        self.payload = _WEIGHTS_MAGIC + os.urandom(4096)
+        self.source = os.path.join(self.weights_dir, 'maia-1500.pb.gz')
+        with gzip.open(self.source, 'wb') as f:
+            f.write(self.payload)
+        _prepared_paths.clear()
+
+    def tearDown(self):
+        """Remove temporary files."""
+        shutil.rmtree(self.tmp_dir)
+        _prepared_paths.clear()
+
+    def test_prepare_decompresses_once(self):
+        """The prepared file holds the decompressed network."""
+        path = prepare_weights(self.source, cache_dir=self.cache_dir)
+        self.assertTrue(path.startswith(self.cache_dir))
+        self.assertTrue(path.endswith('maia-1500.pb'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.payload)
+        self.assertTrue(verify_prepared(path, full=True))
+
+        mtime = os.path.getmtime(path)
+        _prepared_paths.clear()
+        self.assertEqual(prepare_weights(self.source, cache_dir=self.cache_dir), path)
+        self.assertEqual(os.path.getmtime(path), mtime)
+
+    def test_changed_source_gets_new_entry(self):
+        """Different network contents never share a cache entry."""
+        first = prepare_weights(self.source, cache_dir=self.cache_dir)
+        with gzip.open(self.source, 'wb') as f:
+            f.write(_WEIGHTS_MAGIC + b'\x01' * 128)
+        os.utime(self.source, (0, 0))
+        second = prepare_weights(self.source, cache_dir=self.cache_dir)
+        self.assertNotEqual(first, second)
+
+    def test_truncated_cache_is_rebuilt(self):
+        """A partially written cache file is detected and replaced."""
+        path = prepare_weights(self.source, cache_dir=self.cache_dir)
+        with open(path, 'r+b') as f:
+            f.truncate(100)
+        self.assertFalse(verify_prepared(path))
+
+        _prepared_paths.clear()
+        self.assertEqual(prepare_weights(self.source, cache_dir=self.cache_dir), path)
+        self.assertTrue(verify_prepared(path, full=True))
+
+    def test_invalid_network_rejected(self):
+        """Archives that don't contain an lc0 network are rejected."""
+        with gzip.open(self.source, 'wb') as f:
+            f.write(b'not a network')
+        with self.assertRaises(WeightsValidationError):
+            prepare_weights(self.source, cache_dir=self.cache_dir)
+
+    def test_corrupt_archive_rejected(self):
+        """Corrupt gzip data is rejected and leaves no temporary files."""
+        with open(self.source, 'wb') as f:
+            f.write(b'\x1f\x8b\x08\x00garbage')
+        with self.assertRaises(WeightsValidationError):
+            prepare_weights(self.source, cache_dir=self.cache_dir)
+        for _, _, files in os.walk(self.cache_dir):
+            self.assertEqual([f for f in files if f.endswith('.tmp')], [])
+
+    def test_uncompressed_path_passthrough(self):
+        """Already decompressed networks are used as-is."""
+        raw = os.path.join(self.weights_dir, 'maia-1500.pb')
+        with open(raw, 'wb') as f:
+            f.write(self.payload)
+        self.assertEqual(prepare_weights(raw, cache_dir=self.cache_dir), raw)
+
+    def test_prepare_all_weights(self):
+        """Every maia network in the directories is prepared."""
+        shutil.copy(self.source, os.path.join(self.weights_dir, 'maia-1100.pb.gz'))
+        prepared = prepare_all_weights([self.weights_dir, '/nonexistent'], cache_dir=self.cache_dir)
+        self.assertEqual(
+            sorted(os.path.basename(p) for p in prepared),
+            ['maia-1100.pb', 'maia-1500.pb'],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
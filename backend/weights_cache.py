@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Maia Weights Cache
+
+Decompresses the shipped ``maia-*.pb.gz`` networks once into a shared,
+content-addressed cache directory.  Every lc0 process (and every Gunicorn
+worker) then loads the same prepared ``.pb`` file instead of gunzipping the
+weights again on each engine start, and the OS page cache holds a single
+copy of each network.
+
+Run ``python weights_cache.py`` to prepare all available networks ahead of
+time (the Dockerfile does this at build time).
+"""
+
+import os
+import gzip
+import zlib
+import json
+import hashlib
+import logging
+import tempfile
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Every lc0 network protobuf starts with the fixed32 ``magic`` field (0x1c0)
+_WEIGHTS_MAGIC = b'\x0d\xc0\x01\x00\x00'
+
+_CHUNK_SIZE = 1 << 20
+
+# Source file (path, size, mtime) -> prepared path, so repeated engine starts
+# in the same process don't rehash the compressed file.
+_prepared_paths: Dict[Tuple[str, int, float], str] = {}
+_prepare_lock = Lock()
+
+
+class WeightsValidationError(ValueError):
+    """Raised when a weights file fails its integrity checks."""
+
+
+def get_cache_dir() -> str:
+    """Return the directory holding the decompressed networks.
+
+    Can be overridden with the ``MAIA_WEIGHTS_CACHE`` environment variable.
+    """
+    return os.environ.get(
+        "MAIA_WEIGHTS_CACHE",
+        os.path.join(tempfile.gettempdir(), "maia-weights-cache"),
+    )
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(prepared_path: str) -> str:
+    return prepared_path + ".json"
+
+
+def _prepared_name(source_path: str) -> str:
+    name = os.path.basename(source_path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return name
+
+
+def verify_prepared(prepared_path: str, full: bool = False) -> bool:
+    """Check a prepared file against its manifest.
+
+    The default check compares the file size and the network magic, which is
+    enough to catch truncated or partially written files.  ``full=True`` also
+    recomputes the SHA-256 of the decompressed data.
+    """
+    try:
+        with open(_manifest_path(prepared_path)) as f:
+            manifest = json.load(f)
+        if os.path.getsize(prepared_path) != manifest["size"]:
+            return False
+        with open(prepared_path, "rb") as f:
+            if f.read(len(_WEIGHTS_MAGIC)) != _WEIGHTS_MAGIC:
+                return False
+        if full and _sha256_file(prepared_path) != manifest["sha256"]:
+            return False
+    except (OSError, ValueError, KeyError):
+        return False
+    return True
+
+
+def _decompress(source_path: str, target_dir: str, prepared_path: str, source_sha256: str) -> None:
+    """Decompress *source_path* into *prepared_path* atomically."""
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out, gzip.open(source_path, "rb") as src:
+            # gzip raises on CRC mismatches, so a corrupt archive never
+            # makes it into the cache.
+            for chunk in iter(lambda: src.read(_CHUNK_SIZE), b""):
+                if size == 0 and not chunk.startswith(_WEIGHTS_MAGIC):
+                    raise WeightsValidationError(
+                        f"{source_path} does not contain an lc0 network"
+                    )
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise WeightsValidationError(f"{source_path} is empty")
+
+        manifest = {
+            "source": os.path.basename(source_path),
+            "source_sha256": source_sha256,
+            "sha256": digest.hexdigest(),
+            "size": size,
+        }
+        with open(_manifest_path(tmp_path), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Publish the data before the manifest so a reader never sees a
+        # manifest describing a missing file.  Concurrent workers race to
+        # write identical content, so last-writer-wins is fine.
+        os.replace(tmp_path, prepared_path)
+        os.replace(_manifest_path(tmp_path), _manifest_path(prepared_path))
+    except (OSError, EOFError, zlib.error) as exc:
+        raise WeightsValidationError(f"Failed to decompress {source_path}: {exc}") from exc
+    finally:
+        for p in (tmp_path, _manifest_path(tmp_path)):
+            if os.path.exists(p):
+                os.remove(p)
+
+
+def prepare_weights(source_path: str, cache_dir: str = None) -> str:
+    """Return the path of a decompressed, validated copy of *source_path*.
+
+    The copy lives under ``<cache_dir>/<sha256 of source>/`` so different
+    versions of a network never collide, and it is only created once no
+    matter how many processes ask for it.
+    """
+    source_path = os.path.abspath(source_path)
+    if not source_path.endswith(".gz"):
+        return source_path
+
+    st = os.stat(source_path)
+    key = (source_path, st.st_size, st.st_mtime)
+    with _prepare_lock:
+        cached = _prepared_paths.get(key)
+        if cached is not None and os.path.exists(cached):
+            return cached
+
+        source_sha256 = _sha256_file(source_path)
+        target_dir = os.path.join(cache_dir or get_cache_dir(), source_sha256[:16])
+        prepared_path = os.path.join(target_dir, _prepared_name(source_path))
+
+        if not verify_prepared(prepared_path):
+            os.makedirs(target_dir, exist_ok=True)
+            logger.info(f"Decompressing {os.path.basename(source_path)} into {target_dir}")
+            _decompress(source_path, target_dir, prepared_path, source_sha256)
+
+        _prepared_paths[key] = prepared_path
+        return prepared_path
+
+
+def prepare_all_weights(weights_dirs: Iterable[str], cache_dir: str = None) -> List[str]:
+    """Prepare every ``maia-*.pb.gz`` found in *weights_dirs*."""
+    prepared = []
+    seen = set()
+    for d in weights_dirs:
+        if not os.path.isdir(d):
+            continue
+        for fname in sorted(os.listdir(d)):
+            if not (fname.startswith("maia-") and fname.endswith(".pb.gz")) or fname in seen:
+                continue
+            seen.add(fname)
+            prepared.append(prepare_weights(os.path.join(d, fname), cache_dir=cache_dir))
+    return prepared
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from maia_engine import _WEIGHTS_DIRS
+
+    for path in prepare_all_weights(_WEIGHTS_DIRS):
+        print(path)
@@ -1,3 +1,5 @@
+import numpy as np
+
 cpLookup = {
     "-10.0": 0.16874792794783955,
     "-9.9": 0.16985049833887045,
@@ -204,6 +206,12 @@ cpLookup = {
 
 cpLookup = {float(k) : wr for k, wr in cpLookup.items()}
 
+#Dense version of cpLookup indexed by tenths of a pawn, nan where there's no key
+cpLookup_start = int(round(min(cpLookup) * 10))
+cpLookup_array = np.full(int(round(max(cpLookup) * 10)) - cpLookup_start + 1, np.nan)
+for k, wr in cpLookup.items():
+    cpLookup_array[int(round(k * 10)) - cpLookup_start] = wr
+
 def cp_to_winrate(cp, allow_nan = False):
     try:
         cp = int(float(cp) * 10) / 10
@@ -219,3 +227,15 @@ def cp_to_winrate(cp, allow_nan = False):
         return cpLookup[cp]
     except KeyError:
         return float("nan")
+
+def cp_to_winrate_array(cps, allow_nan = False):
+    """cp_to_winrate() of every value of cps, as a float64 array"""
+    cps = np.asarray(cps, dtype = np.float64)
+    if not allow_nan and np.isnan(cps).any():
+        raise ValueError("cannot convert float NaN to integer")
+    #int(float(cp) * 10), nan and inf are never in range
+    i = np.trunc(cps * 10) - cpLookup_start
+    found = (i >= 0) & (i < len(cpLookup_array))
+    ret = np.full(cps.shape, np.nan)
+    ret[found] = cpLookup_array[i[found].astype(np.int64)]
+    return ret
@@ -0,0 +1,44 @@
+import maia_chess_backend
+import maia_chess_backend.torch
+
+import argparse
+import time
+
+import torch
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the training batches of the mmaps with and without PrefetchLoader, and with MmapShuffleLoaderMap', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('input', help='mmaps dir, like the input_train of a config')
+    parser.add_argument('--batch_size', type=int, help='batch size', default = 2000)
+    parser.add_argument('--steps', type=int, help='number of batches to time', default = 500)
+    parser.add_argument('--workers', type=int, help='number of PrefetchLoader workers', default = 4)
+    parser.add_argument('--device', help='device to put the batches on, like cpu, cuda or pinned, the default is cuda if there is a GPU', default = None)
+    parser.add_argument('--compute_ms', type=float, help='time to wait after each batch, like a training step would take', default = 0)
+    parser.add_argument('--y_names', nargs = '+', help='y values to load', default = ['is_blunder_wr'])
+    parser.add_argument('--block_sizes', type=int, nargs = '*', help='MmapShuffleLoaderMap block sizes to time, with PrefetchLoader', default = [1, 16, 64, 256, 4096])
+    parser.add_argument('--window_size', type=int, help='MmapShuffleLoaderMap window size', default = maia_chess_backend.shuffle_window_size)
+
+    args = parser.parse_args()
+
+    for name in ['direct', 'prefetch'] + [f"shuffle block_size {b}" for b in args.block_sizes]:
+        if name.startswith('shuffle'):
+            loader = maia_chess_backend.torch.MmapShuffleLoaderMap(args.input, args.y_names, args.batch_size, block_size = int(name.split()[-1]), window_size = args.window_size, device = args.device)
+        else:
+            loader = maia_chess_backend.torch.MmapIterLoaderMap(args.input, args.y_names, args.batch_size, device = args.device)
+        if name != 'direct':
+            loader = maia_chess_backend.torch.PrefetchLoader(loader, num_workers = args.workers)
+        #The first batches include starting the workers
+        for _ in range(10):
+            next(loader)
+        tstart = time.time()
+        for _ in range(args.steps):
+            x, y = next(loader)
+            if args.compute_ms > 0:
+                time.sleep(args.compute_ms / 1000)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        maia_chess_backend.printWithDate(f"{name}: {args.steps / (time.time() - tstart):.2f} steps/second, {args.steps * args.batch_size / (time.time() - tstart):.0f} boards/second")
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,7 @@ import random
 import multiprocessing
 import bz2
 
-from .fen_to_vec import fenToVec
+from .fen_to_vec import fens_to_array
 
 class CSVLoader(object):
     def __init__(self, blunders_fname, non_blunders_fname, y_names, mini_batch_size = 500, nrows = None):
@@ -34,7 +34,7 @@ class CSVLoader(object):
         return len(self.df_blunders) + len(self.df_nonblunders)
 
     def process_rows(self, df_sub):
-        x = list(df_sub['board'].apply(fenToVec))
+        x = list(fens_to_array(df_sub['board'].values))
         y_vals = {}
         for n in self.y_names:
             y_vals[n] = list(df_sub[n])
@@ -0,0 +1,137 @@
+import os
+import os.path
+import shutil
+import time
+
+import humanize
+import numpy as np
+
+from .fen_to_vec import move_to_index, fens_to_array, vecs_to_packed, packed_board_dtype
+from .game_mmaps import blunder_mmap_columns, MmapArraysWriter
+from .parquet_io import iter_per_move_chunks
+from .utils import printWithDate
+
+#Makes the blunder models' mmaps from a per move dataset (CSV or Parquet) a
+#chunk at a time, so only a chunk and one bucket are ever in memory instead
+#of the whole month. The rows that pass the filters are given uniform random
+#keys and appended to the bucket file of their key's range, once the dataset
+#is read the buckets are read back in key order and sorted. Rows sorted by
+#random keys are shuffled, and the first k are a uniform sample of k, so the
+#non blunders are sampled and both sets shuffled by writing the buckets out
+#until there are enough rows.
+
+mmap_csv_columns = blunder_mmap_columns + ['game_id', 'low_time', 'board', 'move']
+
+csv_chunk_size = 100000
+csv_num_buckets = 64
+csv_logging_delay = 30 # in seconds
+board_encode_chunk = 16384
+game_id_width = 32
+
+spill_dtype = np.dtype([
+    ('key', '<f8'),
+    ('vals', '<f4', (len(blunder_mmap_columns),)),
+    ('game_id', f"S{game_id_width}"),
+    ('move', '<i8'),
+    ('board', packed_board_dtype),
+    ])
+
+def mmap_row_filters(min_ply = 6, min_elo = 1000, max_elo = 4000, allow_low_time = False, allow_negative_loss = False):
+    """The filters mmap_csv.py applies, as read_per_move() filters"""
+    filters = [
+        ('move_ply', '>=', min_ply),
+        ('active_elo', '>', min_elo),
+        ('active_elo', '<', max_elo),
+        ]
+    if not allow_low_time:
+        filters.append(('low_time', '==', False))
+    if not allow_negative_loss:
+        filters.append(('winrate_loss', '>', 0))
+    return filters
+
+def _chunk_records(df, rng):
+    records = np.empty(len(df), dtype = spill_dtype)
+    records['key'] = rng.random(len(df))
+    records['vals'] = df[blunder_mmap_columns].to_numpy(dtype = np.float32)
+    game_ids = np.char.encode(df['game_id'].astype(str).to_numpy().astype(str), 'utf8')
+    if game_ids.dtype.itemsize > game_id_width:
+        raise ValueError(f"game ids can't be longer than {game_id_width} bytes of UTF-8, found: {game_ids[np.char.str_len(game_ids).argmax()].decode('utf8')}")
+    records['game_id'] = game_ids
+    records['move'] = np.fromiter((move_to_index(m) for m in df['move']), dtype = np.int64, count = len(df))
+    fens = df['board'].to_numpy()
+    for start in range(0, len(df), board_encode_chunk):
+        records['board'][start:start + board_encode_chunk] = vecs_to_packed(fens_to_array(fens[start:start + board_encode_chunk]))
+    return records
+
+class _BucketSpill(object):
+    def __init__(self, spill_dir, name, num_buckets):
+        self.paths = [os.path.join(spill_dir, f"{name}-{i}.spill") for i in range(num_buckets)]
+        for p in self.paths:
+            open(p, 'wb').close()
+        self.count = 0
+
+    def add(self, records):
+        buckets = (records['key'] * len(self.paths)).astype(np.intp)
+        order = np.argsort(buckets, kind = 'stable')
+        starts = np.searchsorted(buckets[order], np.arange(len(self.paths) + 1))
+        for i, p in enumerate(self.paths):
+            if starts[i + 1] > starts[i]:
+                with open(p, 'ab') as f:
+                    f.write(records[order[starts[i]:starts[i + 1]]].tobytes())
+        self.count += len(records)
+
+    def write_first(self, writer, n):
+        """Writes the n rows with the smallest keys to writer in key order"""
+        remaining = n
+        for p in self.paths:
+            if remaining < 1:
+                break
+            records = np.fromfile(p, dtype = spill_dtype)
+            records = records[np.argsort(records['key'])][:remaining]
+            writer.write(records['vals'], np.char.decode(records['game_id'], 'utf8'), records['move'], records['board'])
+            remaining -= len(records)
+
+def csv_to_mmaps(input_path, output_dir, nb_to_b_ratio = 1.5, packed_boards = True, seed = None, nrows = None, chunk_size = csv_chunk_size, num_buckets = csv_num_buckets, **filter_args):
+    """Makes output_dir/name/blunder and output_dir/name/nonblunder from a per move dataset, like mmap_csv.py but a chunk at a time
+
+    filter_args are mmap_row_filters()'s. Rows with missing values are
+    dropped, then all the blunders and nb_to_b_ratio times as many non
+    blunders are written, shuffled. Memory use is about a chunk_size chunk
+    plus 1/num_buckets of the rows kept, which are spilled to disk in
+    output_dir/name/spill until the end. Returns the number of blunders and
+    of non blunders written.
+    """
+    name = os.path.basename(input_path).split('.')[0]
+    spill_dir = os.path.join(output_dir, name, 'spill')
+    if os.path.exists(spill_dir):
+        shutil.rmtree(spill_dir)
+    os.makedirs(spill_dir)
+    tstart = time.time()
+    tLast = time.time()
+    rng = np.random.default_rng(seed)
+    spills = {'blunder' : _BucketSpill(spill_dir, 'blunder', num_buckets), 'nonblunder' : _BucketSpill(spill_dir, 'nonblunder', num_buckets)}
+    num_rows = 0
+
+    try:
+        for df in iter_per_move_chunks(input_path, columns = mmap_csv_columns, filters = mmap_row_filters(**filter_args), chunk_size = chunk_size, nrows = nrows):
+            df = df.dropna()
+            num_rows += len(df)
+            is_blunder = df['is_blunder_wr'].astype(bool).to_numpy()
+            spills['blunder'].add(_chunk_records(df[is_blunder], rng))
+            spills['nonblunder'].add(_chunk_records(df[~is_blunder], rng))
+            if time.time() - tLast > csv_logging_delay:
+                tLast = time.time()
+                printWithDate(f"{name} Kept {num_rows} rows in {humanize.naturaldelta(time.time() - tstart)}", flush = True)
+
+        num_blunders = spills['blunder'].count
+        num_non_blunders = min(spills['nonblunder'].count, int(num_blunders * nb_to_b_ratio))
+        printWithDate(f"{name} Found {num_blunders} blunders and {spills['nonblunder'].count} non blunders, reduced to {num_non_blunders} non blunders, writing mmaps", flush = True)
+
+        for split, n in [('blunder', num_blunders), ('nonblunder', num_non_blunders)]:
+            writer = MmapArraysWriter(os.path.join(output_dir, name, split), n, packed_boards = packed_boards)
+            spills[split].write_first(writer, n)
+            writer.close()
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors = True)
+    printWithDate(f"{name} Done in {humanize.naturaldelta(time.time() - tstart)}")
+    return num_blunders, num_non_blunders
@@ -124,6 +124,69 @@ def array_to_fen(a_target):
 def array_to_board(a_target):
     return chess.Board(fen = array_to_fen(a_target))
 
+#arrays_to_fens() lookup tables: the FEN byte of each plane + 1 (0 for empty)
+#and for each rank's 8 bit empty squares mask the digits at the start of
+#each run of empty squares, 0 for the rest of the rank
+plane_fen_bytes = np.array([0] + [ord(piece_reverse_lookup[i]) for i in range(12)], dtype = np.uint8)
+empty_run_bytes = np.zeros((256, 8), dtype = np.uint8)
+for mask in range(256):
+    run_start = None
+    for f in range(9):
+        if f < 8 and mask & (1 << f):
+            if run_start is None:
+                run_start = f
+        elif run_start is not None:
+            empty_run_bytes[mask, run_start] = ord(str(f - run_start))
+            run_start = None
+
+def arrays_to_fens(a_targets):
+    """array_to_fen() of each board of an (n, 17, 8, 8) array or tensor, as a list
+
+    The pieces are found with a max over the planes and the empty squares from
+    a table of each rank's run lengths, so there's no Python loop per board.
+    """
+    if not isinstance(a_targets, np.ndarray):
+        #check if toch Tensor without importing torch
+        a_targets = a_targets.cpu().numpy()
+    a = np.asarray(a_targets, dtype = np.bool_).reshape(-1, 17, 64)
+    n = len(a)
+    if n < 1:
+        return []
+    #The highest set plane + 1, 0 if there are none, the last plane wins if
+    #there are more than one like in array_to_preproc(). This is faster than
+    #an argmax over the planes
+    codes = (a[:, :12].view(np.uint8) * np.arange(1, 13, dtype = np.uint8)[:, None]).max(axis = 1)
+    is_white = a[:, 12, 0]
+    castling = a[:, 13:, 0].copy()
+    is_black = ~is_white
+    if is_black.any():
+        #Undoes the flip of black to move boards
+        codes[is_black] = black_piece_codes[codes[is_black, ::-1]]
+        castling[is_black] = castling[is_black][:, [2, 3, 0, 1]]
+
+    #Each rank is its 8 squares and a / (a space for the last), with 0s
+    #where there's nothing to write, which are removed at the end
+    ranks = np.zeros((n, 8, 9), dtype = np.uint8)
+    ranks[:, :, :8] = plane_fen_bytes[codes].reshape(n, 8, 8)
+    empty_masks = np.packbits(codes.reshape(n, 8, 8) == 0, axis = 2, bitorder = 'little')[:, :, 0]
+    ranks[:, :, :8] += empty_run_bytes[empty_masks]
+    ranks[:, :7, 8] = ord('/')
+    ranks[:, 7, 8] = ord(' ')
+
+    rest = np.zeros((n, 12), dtype = np.uint8)
+    rest[:, 0] = np.where(is_white, ord('w'), ord('b'))
+    rest[:, 1] = ord(' ')
+    rest[:, 2:6] = castling * np.frombuffer(castling_vals.encode(), dtype = np.uint8)
+    rest[:, 2] = np.where(castling.any(axis = 1), rest[:, 2], ord('-'))
+    rest[:, 6:] = np.frombuffer(b' - 0 1', dtype = np.uint8)
+
+    fen_bytes = np.concatenate([ranks.reshape(n, -1), rest, np.full((n, 1), ord('\n'), dtype = np.uint8)], axis = 1)
+    return fen_bytes.tobytes().replace(b'\0', b'').decode().split('\n')[:-1]
+
+def arrays_to_boards(a_targets):
+    """array_to_board() of each board of an (n, 17, 8, 8) array or tensor, as a list"""
+    return [chess.Board(fen = f) for f in arrays_to_fens(a_targets)]
+
 def simple_fen_vec(boardStr, is_white, castling):
     castles = [np.frombuffer(castlesMap[c], dtype='bool').reshape(1, 8, 8) for c in castling]
     board_buff_map = map(toBin, boardStr)
@@ -162,6 +225,173 @@ def preproc_fen(fenstr):
 def fenToVec(fenstr):
     return simple_fen_vec(*preproc_fen(fenstr))
 
+castling_squares = (chess.BB_H1, chess.BB_A1, chess.BB_H8, chess.BB_A8)
+full_mask = 0xFFFFFFFFFFFFFFFF
+
+def board_to_masks(board):
+    """The 17 planes of fenToVec(board.fen()) as ints, bit i of each is square i of the plane, made from the board's bitboards"""
+    if board.uci_variant != 'chess' or board.chess960:
+        bits = np.packbits(fenToVec(board.fen()).reshape(17, 64), axis = 1, bitorder = 'little')
+        return np.ascontiguousarray(bits).view('<u8').ravel().tolist()
+    castling_rights = board.clean_castling_rights()
+    castling = [full_mask if castling_rights & bb else 0 for bb in castling_squares]
+    #Bit i of a bitboard is square i (a1, b1, ..., h8), fenToVec() starts at a8
+    #for white to move and at h1 for black, as if black was white
+    if board.turn == chess.WHITE:
+        colours = (chess.WHITE, chess.BLACK)
+        flip = chess.flip_vertical
+        colour_plane = full_mask
+    else:
+        colours = (chess.BLACK, chess.WHITE)
+        flip = chess.flip_horizontal
+        colour_plane = 0
+        castling = castling[2:] + castling[:2]
+    return [flip(board.pieces_mask(p, c)) for c in colours for p in chess.PIECE_TYPES] + [colour_plane] + castling
+
+def masks_to_vecs(masks):
+    """board_to_masks() of n boards, as a list or (n, 17) uint64 array, to an (n, 17, 8, 8) array of their fenToVec()s"""
+    a = np.ascontiguousarray(masks, dtype = '<u8').reshape(-1, 17)
+    return np.unpackbits(a.view(np.uint8), axis = 1, bitorder = 'little').reshape(-1, 17, 8, 8).view(np.bool_)
+
+def board_to_vec(board):
+    """fenToVec(board.fen()) without making or parsing the FEN"""
+    return masks_to_vecs([board_to_masks(board)])[0]
+
+#The boards as the mmaps store them, 97 bytes instead of 1088: the 12 piece
+#planes as board_to_masks() ints and the colour and castling planes, which
+#are all 1s or all 0s, as bits 0 to 4 of flags
+packed_board_dtype = np.dtype([('pieces', '<u8', (12,)), ('flags', np.uint8)])
+packed_flag_bits = np.left_shift(1, np.arange(5, dtype = np.uint8), dtype = np.uint8)
+
+def masks_to_packed(masks):
+    """board_to_masks() of n boards to an (n,) array of packed_board_dtype"""
+    a = np.ascontiguousarray(masks, dtype = '<u8').reshape(-1, 17)
+    packed = np.empty(len(a), dtype = packed_board_dtype)
+    packed['pieces'] = a[:, :12]
+    packed['flags'] = ((a[:, 12:] != 0) * packed_flag_bits).sum(axis = 1)
+    return packed
+
+def vecs_to_packed(vecs):
+    """fenToVec()s of n boards, as an (n, 17, 8, 8) array, to an (n,) array of packed_board_dtype"""
+    a = np.asarray(vecs, dtype = np.bool_).reshape(-1, 17, 64)
+    packed = np.empty(len(a), dtype = packed_board_dtype)
+    pieces = np.packbits(a[:, :12], axis = 2, bitorder = 'little')
+    packed['pieces'] = np.ascontiguousarray(pieces).view('<u8').reshape(-1, 12)
+    packed['flags'] = (a[:, 12:, 0] * packed_flag_bits).sum(axis = 1)
+    return packed
+
+def packed_to_vecs(packed):
+    """An array of packed_board_dtype, like a slice of a board_packed mmap, to an (n, 17, 8, 8) array of the fenToVec()s"""
+    packed = np.asarray(packed)
+    n = len(packed)
+    vecs = np.empty((n, 17, 64), dtype = np.bool_)
+    #The fields of a structured array aren't contiguous
+    pieces = np.ascontiguousarray(packed['pieces'], dtype = '<u8')
+    vecs[:, :12] = np.unpackbits(pieces.view(np.uint8), axis = 1, bitorder = 'little').reshape(n, 12, 64).view(np.bool_)
+    vecs[:, 12:] = (packed['flags'][:, None] & packed_flag_bits)[:, :, None] != 0
+    return vecs.reshape(n, 17, 8, 8)
+
+#fens_to_array() lookup tables, indexed by the bytes of the FENs: the number
+#of squares each covers in the board field, the plane + 1 of each piece with
+#white to move and the same for a plane + 1 with black to move
+fen_square_widths = np.zeros(256, dtype = np.intp)
+fen_piece_codes = np.zeros(256, dtype = np.uint8)
+for i, p in enumerate(all_pieces):
+    fen_square_widths[ord(p)] = 1
+    fen_square_widths[ord(p.lower())] = 1
+    fen_piece_codes[ord(p)] = i + 1
+    fen_piece_codes[ord(p.lower())] = i + len(all_pieces) + 1
+for i in range(1, 9):
+    fen_square_widths[ord(str(i))] = i
+black_piece_codes = np.zeros(256, dtype = np.uint8)
+black_piece_codes[1:13] = np.roll(np.arange(1, 13), len(all_pieces))
+
+#Sums to valid_board_check over the bytes of a valid board field
+fen_board_checks = fen_square_widths.astype(np.int64)
+fen_board_checks[ord('/')] = 2**20
+fen_board_checks[(fen_square_widths == 0) & (np.arange(256) != ord('/'))] = 2**40
+fen_board_checks[0] = 0
+valid_board_check = 64 + 7 * 2**20
+
+fens_chunk_size = 16384
+
+def fens_to_array(fens, out = None):
+    """fenToVec() of each FEN, as an (N, 17, 8, 8) bool array
+
+    The FENs are encoded a chunk at a time with lookup tables on their bytes
+    instead of one at a time, out can be a preallocated array (or memmap) of
+    that shape to write into. Raises ValueError for strings that aren't FENs
+    with at least the side to move and castling fields, like fenToVec().
+    """
+    if not isinstance(fens, (list, np.ndarray)):
+        #Series, generators, etc.
+        fens = list(fens)
+    n = len(fens)
+    if out is None:
+        out = np.empty((n, 17, 8, 8), dtype = np.bool_)
+    elif out.shape != (n, 17, 8, 8) or out.dtype != np.bool_:
+        raise ValueError(f"out must be a bool array of shape {(n, 17, 8, 8)}, not {out.dtype} {out.shape}")
+    for start in range(0, n, fens_chunk_size):
+        target = out[start:start + fens_chunk_size]
+        if target.flags.c_contiguous:
+            _encode_fens(fens[start:start + fens_chunk_size], target)
+        else:
+            target[:] = _encode_fens(fens[start:start + fens_chunk_size], np.empty(target.shape, dtype = np.bool_))
+    return out
+
+def _encode_fens(fens, out):
+    n = len(fens)
+    if n < 1:
+        return out
+    #One row of bytes per FEN, padded with 0s
+    a = np.array(fens, dtype = 'S')
+    a = a.view(np.uint8).reshape(n, a.dtype.itemsize)
+    rows = np.arange(n)
+
+    is_space = a == ord(' ')
+    board_len = is_space.argmax(axis = 1)
+    board = a[:, :board_len.max()]
+    board = board * (np.arange(board.shape[1]) < board_len[:, None])
+    #np.take is fastest with intp indices
+    board_indices = board.astype(np.intp)
+    bad = ~is_space[rows, board_len]
+    bad |= np.take(fen_board_checks, board_indices).sum(axis = 1) != valid_board_check
+
+    def field_byte(offset):
+        #The byte offset bytes after the board, 0 past the end
+        i = board_len + offset
+        return np.where(i < a.shape[1], a[rows, np.minimum(i, a.shape[1] - 1)], 0)
+
+    side = field_byte(1)
+    bad |= (side != ord('w')) & (side != ord('b'))
+    bad |= (field_byte(2) != ord(' ')) | (field_byte(3) == ord(' ')) | (field_byte(3) == 0)
+    if bad.any():
+        raise ValueError(f"Not a FEN: {fens[int(bad.argmax())]}")
+    is_white = side == ord('w')
+
+    castling = np.zeros((n, 4), dtype = np.bool_)
+    in_field = np.ones(n, dtype = np.bool_)
+    for i in range(4):
+        c = field_byte(3 + i)
+        in_field &= (c != ord(' ')) & (c != 0)
+        for j, v in enumerate(castling_vals):
+            castling[:, j] |= in_field & (c == ord(v))
+
+    #Repeating each byte by the number of squares it covers gives the 64
+    #squares from a8, with digits as empty squares
+    squares = np.repeat(board.reshape(-1), np.take(fen_square_widths, board_indices).reshape(-1)).reshape(n, 64)
+    codes = np.take(fen_piece_codes, squares)
+    #Black to move is flipped to look like white to move
+    is_black = ~is_white
+    if is_black.any():
+        codes[is_black] = np.take(black_piece_codes, codes[is_black, ::-1])
+
+    planes = out.reshape(n, 17, 64)
+    np.equal(codes[:, None, :], np.arange(1, 13, dtype = np.uint8)[None, :, None], out = planes[:, :12])
+    planes[:, 12] = is_white[:, None]
+    planes[:, 13:] = np.where(is_white[:, None], castling, castling[:, [2, 3, 0, 1]])[:, :, None]
+    return out
+
 def fenToVec_old(fenstr):
     r = boardRE.match(fenstr)
     if r.group(11):
@@ -0,0 +1,504 @@
+import collections
+import glob
+import json
+import math
+import os
+import os.path
+import time
+import traceback
+
+import humanize
+import numpy as np
+
+from .fen_to_vec import move_to_index, masks_to_packed, packed_to_vecs, packed_board_dtype
+from .games import LightGamesFile
+from .parquet_io import per_move_column_types
+from .utils import gameToRows, NoStockfishEvals, printWithDate
+
+#Makes the blunder models' mmaps, the same files mmap_csv.py makes from the
+#CSVs, straight from the PGNs. Each game is replayed once and the arrays of
+#its boards come from the bitboards, instead of the boards being written as
+#FENs and parsed back. The rows are filtered as they're made and kept, with
+#their boards as the 17 ints of board_to_masks(), until the file is done, then
+#they're sampled and written like mmap_csv.py does.
+
+blunder_mmap_columns = [
+    'move_ply',
+    'cp_rel',
+    'cp_loss',
+    'is_blunder_cp',
+    'winrate',
+    'winrate_elo',
+    'winrate_loss',
+    'is_blunder_wr',
+    'opp_winrate',
+    'white_active',
+    'active_elo',
+    'opponent_elo',
+    'clock_percent',
+    'opp_clock_percent',
+    'is_capture',
+    'is_check',
+    'active_won',
+    'no_winner',
+    'num_ply'
+]
+
+#These are bools in the CSVs, so mmap_csv.py saves them as ints
+blunder_mmap_int_columns = {c for c in blunder_mmap_columns if per_move_column_types.get(c) == 'bool'}
+
+#What gameToRows() needs to make for the mmaps and filters, is_check is
+#made on its own so the rest of the board stats can be skipped
+mmap_game_vals = ['game_id', 'no_winner', 'num_ply']
+mmap_move_vals = [c for c in blunder_mmap_columns if c not in mmap_game_vals] + ['low_time', 'move', 'board_masks']
+
+_row_names = mmap_game_vals + mmap_move_vals
+_column_indices = [_row_names.index(c) for c in blunder_mmap_columns]
+_row_index = {n : i for i, n in enumerate(_row_names)}
+
+board_shape = (17, 8, 8)
+board_write_chunk = 100000
+mmap_logging_delay = 30 # in seconds
+
+#Each directory of mmaps has a manifest of its columns' files, dtypes and
+#shapes so the loaders don't need to glob for the files and parse their names
+mmap_manifest_name = 'mmap_manifest.json'
+
+#The manifests and opened mmaps, by directory, they're only read once per process
+_mmap_manifests = {}
+_mmap_columns = {}
+_string_tables = {}
+
+#The game ids are stored as a string table, the bytes of all the unique ids
+#in one file and the offsets of each in another, and the game_id column is
+#the index of each row's id in it. Older datasets have a JSON of the ids instead
+
+def _to_float(v):
+    #The same values pandas would read from the CSV, unreadable ones (like Elos of ?) are dropped as NaNs
+    try:
+        return float(v)
+    except ValueError:
+        return float('nan')
+
+def game_mmap_rows(game_str, min_ply = 6, min_elo = 1000, max_elo = 4000, allow_low_time = False, allow_negative_loss = False, allow_non_sf = False):
+    """The rows of a game mmap_csv.py would keep, as (values of blunder_mmap_columns, game_id, move index, board masks, is_blunder)"""
+    rows = []
+    for r in gameToRows(game_str, per_game_vals = mmap_game_vals, per_move_vals = mmap_move_vals, with_board_stats = False, allow_non_sf = allow_non_sf):
+        low_time = r[_row_index['low_time']]
+        #'' when the game has no clock, which the CSVs' dropna() removes
+        if low_time == '' or (low_time and not allow_low_time):
+            continue
+        vals = [_to_float(r[i]) for i in _column_indices]
+        if any(math.isnan(v) for v in vals):
+            continue
+        v = dict(zip(blunder_mmap_columns, vals))
+        if v['move_ply'] < min_ply or not (min_elo < v['active_elo'] < max_elo):
+            continue
+        if not allow_negative_loss and not v['winrate_loss'] > 0:
+            continue
+        rows.append((vals, r[_row_index['game_id']], move_to_index(str(r[_row_index['move']])), r[_row_index['board_masks']], v['is_blunder_wr'] > 0))
+    return rows
+
+def _rows_to_arrays(rows):
+    return {
+        'vals' : np.array([r[0] for r in rows], dtype = np.float32).reshape(len(rows), len(blunder_mmap_columns)),
+        'game_id' : np.array([r[1] for r in rows], dtype = str),
+        'move' : np.array([r[2] for r in rows], dtype = np.int64),
+        'board' : np.array([r[3] for r in rows], dtype = '<u8').reshape(len(rows), board_shape[0]),
+    }
+
+def games_to_mmap_arrays(games, **filter_args):
+    """The rows of the game strings that pass the filters (see game_mmap_rows()) as arrays, split into blunders and non blunders
+
+    Returns {'blunder' : arrays, 'nonblunder' : arrays}, each being a dict of
+    'vals' (a column per blunder_mmap_columns), 'game_id', 'move' and 'board'
+    with the boards' board_to_masks().
+    """
+    rows = {True : [], False : []}
+    for game_str in games:
+        try:
+            for r in game_mmap_rows(game_str, **filter_args):
+                rows[r[-1]].append(r)
+        except NoStockfishEvals:
+            pass
+        except:
+            printWithDate('error:')
+            printWithDate(game_str)
+            printWithDate(traceback.format_exc())
+            raise
+    return {'blunder' : _rows_to_arrays(rows[True]), 'nonblunder' : _rows_to_arrays(rows[False])}
+
+def concat_mmap_arrays(parts):
+    if len(parts) < 1:
+        return _rows_to_arrays([])
+    return {k : np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+def take_mmap_arrays(arrays, indices):
+    return {k : v[indices] for k, v in arrays.items()}
+
+def _write_mmap(path, a):
+    if len(a) < 1:
+        #np.memmap can't make empty files
+        open(path, 'wb').close()
+        return
+    mmap = np.memmap(path, dtype = a.dtype, mode = 'w+', shape = a.shape)
+    mmap[:] = a[:]
+    mmap.flush()
+
+def _open_mmap(path, dtype, shape):
+    if shape[0] < 1:
+        open(path, 'wb').close()
+        return None
+    return np.memmap(path, dtype = dtype, mode = 'w+', shape = shape)
+
+def mmap_column_name(path):
+    return os.path.basename(path).split('+')[0]
+
+def _manifest_entry(path, dtype, shape):
+    return {
+        'file' : os.path.basename(path),
+        'dtype' : np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        'shape' : [int(i) for i in shape],
+        'offset' : 0,
+        }
+
+def _read_manifest_entry(entry):
+    entry['dtype'] = np.lib.format.descr_to_dtype(entry['dtype'])
+    entry['shape'] = tuple(entry['shape'])
+
+def write_mmap_manifest(output_dir, num_rows, columns, string_tables = None):
+    """Writes the manifest of the mmaps in output_dir, columns is a list of (path, dtype, shape)
+
+    string_tables are {column name : (offsets, bytes)} of write_string_table()'s
+    (path, dtype, shape), for the columns that are indices into them.
+    """
+    manifest = {
+        'num_rows' : num_rows,
+        'columns' : {mmap_column_name(p) : _manifest_entry(p, dtype, shape) for p, dtype, shape in columns},
+        'string_tables' : {
+            name : {
+                'offsets' : _manifest_entry(*offsets),
+                'bytes' : _manifest_entry(*data),
+                } for name, (offsets, data) in (string_tables or {}).items()},
+    }
+    _write_manifest_file(output_dir, manifest)
+
+def _write_manifest_file(output_dir, manifest):
+    path = os.path.join(output_dir, mmap_manifest_name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 2)
+    os.replace(path + '.tmp', path)
+
+def add_mmap_column(target_dir, path, dtype, shape):
+    """Adds the mmap at path, like a model's predictions, to the manifest of the mmaps in target_dir as a column, replacing any of the same name
+
+    Directories without a manifest find their columns from the file names,
+    so path has to be named like the others are.
+    """
+    target_dir = os.path.abspath(target_dir)
+    name = mmap_column_name(path)
+    try:
+        with open(os.path.join(target_dir, mmap_manifest_name)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        pass
+    else:
+        if shape[0] != manifest['num_rows']:
+            raise ValueError(f"{path} has {shape[0]} rows but the mmaps in {target_dir} have {manifest['num_rows']}")
+        manifest['columns'][name] = _manifest_entry(path, dtype, shape)
+        _write_manifest_file(target_dir, manifest)
+    _mmap_manifests.pop(target_dir, None)
+    _mmap_columns.pop((target_dir, name), None)
+
+def _manifest_from_file_names(target_dir):
+    #For the mmaps made before there were manifests, the type and length are in the names
+    columns = []
+    string_tables = {}
+    for p in sorted(glob.glob(os.path.join(target_dir, '*.mm'))):
+        s_split = os.path.basename(p).split('.')[0].split('+')
+        if s_split[0].endswith('_offsets') and len(s_split) == 1:
+            name = s_split[0][:-len('_offsets')]
+            bytes_path = os.path.join(target_dir, f"{name}_bytes.mm")
+            string_tables[name] = {
+                'offsets' : {'file' : os.path.basename(p), 'dtype' : np.dtype(np.int64), 'shape' : (os.path.getsize(p) // 8,), 'offset' : 0},
+                'bytes' : {'file' : os.path.basename(bytes_path), 'dtype' : np.dtype(np.uint8), 'shape' : (os.path.getsize(bytes_path),), 'offset' : 0},
+                }
+        elif s_split[0].endswith('_bytes') and len(s_split) == 1:
+            pass
+        elif len(s_split) == 3:
+            columns.append((p, s_split[1], (int(s_split[2]),)))
+        elif s_split[0] == 'board':
+            columns.append((p, np.bool_, (int(s_split[1]),) + board_shape))
+        elif s_split[0] == 'board_packed':
+            columns.append((p, packed_board_dtype, (int(s_split[1]),)))
+        elif s_split[0] in ['move', 'top_nonblunder', 'top_blunder']:
+            columns.append((p, np.int64, (int(s_split[1]),)))
+        else:
+            raise RuntimeError(f'Invalid mmap path name: {p}')
+    if len(columns) < 1:
+        raise FileNotFoundError(f"No mmaps found in {target_dir}")
+    return {
+        'num_rows' : columns[0][2][0],
+        'columns' : {mmap_column_name(p) : {'file' : os.path.basename(p), 'dtype' : np.dtype(dtype), 'shape' : shape, 'offset' : 0} for p, dtype, shape in columns},
+        'string_tables' : string_tables,
+    }
+
+def read_mmap_manifest(target_dir):
+    """The manifest of the mmaps in target_dir, made from the file names if it has none
+
+    Returns {'num_rows' : n, 'columns' : {name : {'file', 'dtype', 'shape', 'offset'}},
+    'string_tables' : {name : {'offsets' : {...}, 'bytes' : {...}}}},
+    manifests are cached so a directory's is only read once.
+    """
+    target_dir = os.path.abspath(target_dir)
+    try:
+        return _mmap_manifests[target_dir]
+    except KeyError:
+        pass
+    try:
+        with open(os.path.join(target_dir, mmap_manifest_name)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = _manifest_from_file_names(target_dir)
+    else:
+        for c in manifest['columns'].values():
+            _read_manifest_entry(c)
+        #Manifests from before the string tables don't have them
+        manifest.setdefault('string_tables', {})
+        for t in manifest['string_tables'].values():
+            _read_manifest_entry(t['offsets'])
+            _read_manifest_entry(t['bytes'])
+    _mmap_manifests[target_dir] = manifest
+    return manifest
+
+def open_mmap_column(target_dir, name):
+    """The read only mmap of a column of the mmaps in target_dir, raises KeyError if there isn't one
+
+    These are cached like read_mmap_manifest().
+    """
+    target_dir = os.path.abspath(target_dir)
+    try:
+        return _mmap_columns[target_dir, name]
+    except KeyError:
+        pass
+    mmap = _open_manifest_entry(target_dir, read_mmap_manifest(target_dir)['columns'][name])
+    _mmap_columns[target_dir, name] = mmap
+    return mmap
+
+def _open_manifest_entry(target_dir, c):
+    if c['shape'][0] < 1:
+        return np.empty(c['shape'], dtype = c['dtype'])
+    return np.memmap(os.path.join(target_dir, c['file']), dtype = c['dtype'], mode = 'r', shape = c['shape'], offset = c['offset'])
+
+class StringTable(object):
+    """Strings stored as one buffer of their UTF-8 bytes and the offsets of each, so they can be memory-mapped
+
+    lookup() gets the strings of an array of indices at once, which is much
+    faster than indexing a list or dict for each.
+    """
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+        self._is_ascii = None
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [s.encode('utf8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype = np.int64)
+        np.cumsum([len(s) for s in encoded], out = offsets[1:])
+        return cls(offsets, np.frombuffer(b''.join(encoded), dtype = np.uint8))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return f"<StringTable {len(self)} strings {len(self.data)} bytes>"
+
+    def __getitem__(self, index):
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode('utf8')
+
+    @property
+    def is_ascii(self):
+        if self._is_ascii is None:
+            self._is_ascii = len(self.data) < 1 or int(self.data.max()) < 128
+        return self._is_ascii
+
+    def lookup(self, indices):
+        """The strings of indices as a numpy str array of the same shape"""
+        indices = np.asarray(indices, dtype = np.intp)
+        if len(self.data) < 1:
+            return np.full(indices.shape, '', dtype = str)
+        starts = self.offsets[indices.ravel()]
+        lengths = self.offsets[indices.ravel() + 1] - starts
+        width = max(int(lengths.max(initial = 0)), 1)
+        #Positions past each string's end are made nulls, which numpy's strings drop
+        chars = np.take(self.data, starts[:, None] + np.arange(width), mode = 'clip')
+        chars *= np.arange(width) < lengths[:, None]
+        if self.is_ascii:
+            #ASCII bytes are their code points, so they can be made a str array without decoding each
+            strings = chars.astype(np.uint32).view(f"U{width}")
+        else:
+            strings = np.char.decode(chars.view(f"S{width}"), 'utf8')
+        return strings.reshape(indices.shape)
+
+def write_string_table(output_dir, name, strings):
+    """Writes the strings as a StringTable, returns the (path, dtype, shape) of its offsets and bytes for write_mmap_manifest()"""
+    table = StringTable.from_strings(strings)
+    offsets_path = os.path.join(output_dir, f"{name}_offsets.mm")
+    bytes_path = os.path.join(output_dir, f"{name}_bytes.mm")
+    _write_mmap(offsets_path, table.offsets)
+    _write_mmap(bytes_path, table.data)
+    return (offsets_path, table.offsets.dtype, table.offsets.shape), (bytes_path, table.data.dtype, table.data.shape)
+
+def open_string_table(target_dir, name = 'game_id'):
+    """The StringTable of the values of column name of the mmaps in target_dir, raises KeyError if there isn't one
+
+    Datasets from before the tables were written have a JSON lookup instead,
+    it's read into a table. These are cached like read_mmap_manifest().
+    """
+    target_dir = os.path.abspath(target_dir)
+    try:
+        return _string_tables[target_dir, name]
+    except KeyError:
+        pass
+    tables = read_mmap_manifest(target_dir)['string_tables']
+    if name in tables:
+        table = StringTable(_open_manifest_entry(target_dir, tables[name]['offsets']), _open_manifest_entry(target_dir, tables[name]['bytes']))
+    else:
+        try:
+            with open(os.path.join(target_dir, f"{name}_lookup.json")) as f:
+                lookup = json.load(f)
+        except FileNotFoundError:
+            raise KeyError(name)
+        #Numeric ids were saved as numbers
+        table = StringTable.from_strings([str(lookup[str(i)]) for i in range(len(lookup))])
+    _string_tables[target_dir, name] = table
+    return table
+
+class MmapArraysWriter(object):
+    """Writes the mmaps mmap_csv.py makes, for dataset_loader.load_mmap_np(), a part at a time
+
+    The number of rows, n, has to be known when it's made, the rows are then
+    written in order with write() and close() writes the game ids, as a
+    StringTable, and the manifest. The boards are written as
+    board_packed+n.mm unless packed_boards is False.
+    """
+    def __init__(self, output_dir, n, packed_boards = True):
+        os.makedirs(output_dir, exist_ok = True)
+        self.output_dir = output_dir
+        self.n = n
+        self.packed_boards = packed_boards
+        self.index = 0
+        self.game_ids = []
+        self.mmaps = {}
+        #(path, dtype, shape) of each for the manifest
+        self.columns = []
+        for c in blunder_mmap_columns:
+            dtype = np.dtype(np.int64 if c in blunder_mmap_int_columns else np.float32)
+            self.mmaps[c] = self._open(f"{c}+{dtype}+{n}.mm", dtype, (n,))
+        self.mmaps['move'] = self._open(f"move+{n}.mm", np.int64, (n,))
+        if packed_boards:
+            self.mmaps['board'] = self._open(f"board_packed+{n}.mm", packed_board_dtype, (n,))
+        else:
+            self.mmaps['board'] = self._open(f"board+{n}.mm", np.bool_, (n,) + board_shape)
+
+    def _open(self, name, dtype, shape):
+        path = os.path.join(self.output_dir, name)
+        self.columns.append((path, dtype, shape))
+        return _open_mmap(path, dtype, shape)
+
+    def write(self, vals, game_ids, moves, boards):
+        """Writes the next rows, vals has a column per blunder_mmap_columns and boards are packed_board_dtype"""
+        start = self.index
+        end = start + len(moves)
+        if end > self.n:
+            raise ValueError(f"Can't write {end} rows to the {self.n} row mmaps in {self.output_dir}")
+        if end == start:
+            return
+        for i, c in enumerate(blunder_mmap_columns):
+            self.mmaps[c][start:end] = vals[:, i]
+        self.mmaps['move'][start:end] = moves
+        if self.packed_boards:
+            self.mmaps['board'][start:end] = boards
+        else:
+            #Unpacked a chunk at a time, they're 11 times larger
+            for i in range(0, end - start, board_write_chunk):
+                vecs = packed_to_vecs(boards[i:i + board_write_chunk])
+                self.mmaps['board'][start + i:start + i + len(vecs)] = vecs
+        self.game_ids.append(np.asarray(game_ids, dtype = str))
+        self.index = end
+
+    def close(self):
+        if self.index != self.n:
+            raise ValueError(f"Only {self.index} of {self.n} rows were written to {self.output_dir}")
+        for mmap in self.mmaps.values():
+            if mmap is not None:
+                mmap.flush()
+        self.mmaps = {}
+        game_ids, game_id_indices = np.unique(np.concatenate(self.game_ids + [np.array([], dtype = str)]), return_inverse = True)
+        self.game_ids = []
+        game_id_table = write_string_table(self.output_dir, 'game_id', game_ids.tolist())
+        game_id_path = os.path.join(self.output_dir, f"game_id+int64+{self.n}.mm")
+        _write_mmap(game_id_path, game_id_indices.astype(np.int64))
+        self.columns.append((game_id_path, np.int64, (self.n,)))
+        write_mmap_manifest(self.output_dir, self.n, self.columns, string_tables = {'game_id' : game_id_table})
+
+def write_mmap_arrays(arrays, output_dir, packed_boards = True):
+    """Writes arrays (see games_to_mmap_arrays()) as the mmaps mmap_csv.py makes, for dataset_loader.load_mmap_np()
+
+    The boards are written as board_packed+n.mm unless packed_boards is False.
+    """
+    n = len(arrays['move'])
+    writer = MmapArraysWriter(output_dir, n, packed_boards = packed_boards)
+    for start in range(0, n, board_write_chunk):
+        end = start + board_write_chunk
+        writer.write(arrays['vals'][start:end], arrays['game_id'][start:end], arrays['move'][start:end], masks_to_packed(arrays['board'][start:end]))
+    writer.close()
+
+def pgn_to_mmaps(input_path, output_dir, pool, pool_size, games_per_batch = 200, nb_to_b_ratio = 1.5, seed = None, bz2_workers = None, packed_boards = True, **filter_args):
+    """Makes output_dir/name/blunder and output_dir/name/nonblunder from the PGN like mmap_csv.py does from its CSV
+
+    The games are converted in batches of games_per_batch on pool, with at
+    most 4 batches per process waiting. filter_args are game_mmap_rows()'s.
+    Returns the number of blunders and of non blunders written.
+    """
+    name = os.path.basename(input_path).split('.')[0]
+    tstart = time.time()
+    tLast = time.time()
+    parts = {'blunder' : [], 'nonblunder' : []}
+    pending = collections.deque()
+    num_games = 0
+
+    def collect():
+        for k, arrays in pending.popleft().get().items():
+            parts[k].append(arrays)
+
+    games_file = LightGamesFile(input_path, just_games = True, bz2_workers = bz2_workers)
+    while True:
+        games = [g for _, g in games_file.readBatch(games_per_batch)]
+        if len(games) < 1:
+            break
+        num_games += len(games)
+        pending.append(pool.apply_async(games_to_mmap_arrays, (games,), filter_args))
+        if len(pending) >= 4 * pool_size:
+            collect()
+        if time.time() - tLast > mmap_logging_delay:
+            tLast = time.time()
+            printWithDate(f"{name} Read {num_games} games in {humanize.naturaldelta(time.time() - tstart)}", flush = True)
+    while len(pending) > 0:
+        collect()
+
+    blunders = concat_mmap_arrays(parts['blunder'])
+    non_blunders = concat_mmap_arrays(parts['nonblunder'])
+    del parts
+    printWithDate(f"{name} Found {len(blunders['move'])} blunders and {len(non_blunders['move'])} non blunders in {num_games} games", flush = True)
+
+    rng = np.random.default_rng(seed)
+    blunders = take_mmap_arrays(blunders, rng.permutation(len(blunders['move'])))
+    non_blunders = take_mmap_arrays(non_blunders, rng.permutation(len(non_blunders['move']))[:int(len(blunders['move']) * nb_to_b_ratio)])
+    printWithDate(f"{name} Reduced to {len(non_blunders['move'])} non blunders, writing mmaps", flush = True)
+
+    write_mmap_arrays(blunders, os.path.join(output_dir, name, 'blunder'), packed_boards = packed_boards)
+    write_mmap_arrays(non_blunders, os.path.join(output_dir, name, 'nonblunder'), packed_boards = packed_boards)
+    printWithDate(f"{name} Done in {humanize.naturaldelta(time.time() - tstart)}")
+    return len(blunders['move']), len(non_blunders['move'])
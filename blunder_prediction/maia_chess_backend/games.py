@@ -1,10 +1,14 @@
 import bz2
 import collections.abc
+import io
 import re
 
 
 import chess.pgn
 
+from .parallel_bz2 import open_parallel_bz2
+from .game_index import GameIndex
+
 moveRegex = re.compile(r'\d+[.][ \.](\S+) (?:{[^}]*} )?(\S+)')
 
 
@@ -55,8 +59,14 @@ class GamesFile(collections.abc.Iterable):
             pass
 
 class LightGamesFile(object):
-    def __init__(self, path, parseMoves = True, just_games = False):
-        if path.endswith('bz2'):
+    def __init__(self, path, parseMoves = True, just_games = False, bz2_workers = None):
+        #bz2_workers > 1 decompresses blocks of .bz2 files in parallel threads
+        self.path = path
+        self.bz2_workers = bz2_workers
+        self._index = None
+        if path.endswith('bz2') and bz2_workers is not None and bz2_workers > 1:
+            self.f = open_parallel_bz2(path, workers = bz2_workers)
+        elif path.endswith('bz2'):
             self.f = bz2.open(path, 'rt')
         else:
             self.f = open(path, 'r')
@@ -113,6 +123,49 @@ class LightGamesFile(object):
             raise StopIteration
         return ret, lines
 
+    def parseGame(self, lines):
+        #Same output as readNextGame() for a single game's string
+        ret = {}
+        if not self.just_games:
+            header, _, rest = lines.partition('\n\n')
+            for l in header.split('\n'):
+                k, v, _ = l.split('"')
+                ret[k[1:-1]] = v
+            if self.parseMoves:
+                ret['moves'] = re.findall(moveRegex, rest.split('\n', 1)[0])
+        return ret, lines
+
+    def loadIndex(self, build = True):
+        """Returns the GameIndex of the file, building the sidecar file first if it is missing and build is True"""
+        if self._index is None:
+            if build:
+                self._index = GameIndex.load_or_build(self.path, bz2_workers = self.bz2_workers)
+            else:
+                self._index = GameIndex(self.path)
+        return self._index
+
+    def filterGames(self, selection = None, **filters):
+        """Yields the games matching the index filters (see GameIndex.filter) or a mask/list of game numbers, only reading those games"""
+        index = self.loadIndex()
+        if selection is None:
+            selection = index.filter(**filters)
+        for _, raw in index.iter_games(selection):
+            yield self.parseGame(raw.decode('utf8'))
+
+    def seekGame(self, i):
+        """Moves the file so the next game read is game number i of the index"""
+        index = self.loadIndex()
+        self._peek = None
+        self.f.close()
+        if len(index.blocks) > 0:
+            segments, skip = index.seek_segments(i)
+            f = open_parallel_bz2(self.path, workers = self.bz2_workers or 1, mode = 'rb', segments = segments)
+            f.read(skip)
+        else:
+            f = open(self.path, 'rb')
+            f.seek(int(index.offset[i]))
+        self.f = io.TextIOWrapper(f)
+
     def readBatch(self, n):
         ret = []
         for i in range(n):
@@ -0,0 +1,171 @@
+import re
+
+import chess
+import chess.pgn
+
+#Lean reading of single PGN games for making the CSVs: the headers and the
+#mainline's moves and comments are pulled out with regexes and the moves are
+#replayed on a plain chess.Board, no chess.pgn game tree is built. Anything
+#the lean reader can't handle exactly like chess.pgn.read_game() (variations,
+#other starting positions, line comments, illegal moves, ...) raises
+#UnsupportedMovetext so the caller can fall back to chess.pgn.
+
+class UnsupportedMovetext(Exception):
+    pass
+
+header_defaults = dict(chess.pgn.Headers())
+
+_comment_re = re.compile(r'\{([^}]*)\}')
+_blank_line_re = re.compile(r'\n\s*\n')
+
+#The groups of chess.pgn.MOVETEXT_REGEX
+_san_group = 1
+_ignored_groups = {4, 7, 8} # NAGs, results and move annotations
+
+_empty_runs = [('1' * n, str(n)) for n in range(8, 1, -1)]
+
+def read_lean_headers(header_str):
+    headers = dict(header_defaults)
+    for line in header_str.split('\n'):
+        if not line.startswith('['):
+            raise UnsupportedMovetext(f"Not a header: {line}")
+        tag_match = chess.pgn.TAG_REGEX.match(line)
+        #chess.pgn ignores malformed headers too
+        if tag_match:
+            headers[tag_match.group(1)] = tag_match.group(2)
+    if 'FEN' in headers or 'Variant' in headers:
+        raise UnsupportedMovetext("Only standard games from the starting position are supported")
+    return headers
+
+def read_lean_movetext(movetext):
+    """Returns the mainline's SAN tokens and the comment after each, comments are joined like chess.pgn does"""
+    if '\r' in movetext or movetext.startswith('%') or '\n%' in movetext or _blank_line_re.search(movetext):
+        raise UnsupportedMovetext("Movetext layout not supported")
+    sans = []
+    comments = []
+    #Alternates between the text outside of comments and the comments
+    parts = _comment_re.split(movetext)
+    for i in range(0, len(parts), 2):
+        for match in chess.pgn.MOVETEXT_REGEX.finditer(parts[i]):
+            if match.lastindex == _san_group:
+                if '@' in match.group(0) or match.group(0) in ('--', 'Z0', '0000'):
+                    raise UnsupportedMovetext(f"Null move or drop: {match.group(0)}")
+                sans.append(match.group(0))
+                comments.append('')
+            elif match.lastindex not in _ignored_groups:
+                #Includes comments that aren't closed
+                raise UnsupportedMovetext(f"Unsupported token: {match.group(0)}")
+        if i + 1 >= len(parts):
+            break
+        #chess.pgn drops one space of padding on each side
+        comment = parts[i + 1]
+        if comment.startswith(' '):
+            comment = comment[1:]
+        if comment.endswith(' '):
+            comment = comment[:-1]
+        #Comments before the first move are the game's, which we don't need
+        if sans and comment:
+            comments[-1] = f"{comments[-1]} {comment}" if comments[-1] else comment
+    return sans, comments
+
+class LeanGame(object):
+    """The headers and mainline of a PGN game string, without a game tree
+
+    Iterating gives (move, comment) for each ply with board at the position
+    before the move, board is advanced when the next ply is requested.
+    """
+    def __init__(self, pgn_str):
+        if not pgn_str.startswith('['):
+            raise UnsupportedMovetext("Game doesn't start with its headers")
+        header_str, _, movetext = pgn_str.partition('\n\n')
+        self.headers = read_lean_headers(header_str)
+        self.sans, self.comments = read_lean_movetext(movetext.rstrip())
+        self.board = chess.Board()
+        self._plies = self._iter_plies()
+
+    @property
+    def num_ply(self):
+        return len(self.sans)
+
+    def _iter_plies(self):
+        board = self.board
+        for san, comment in zip(self.sans, self.comments):
+            try:
+                move = board.parse_san(san)
+            except ValueError as e:
+                #chess.pgn truncates the mainline here
+                raise UnsupportedMovetext(f"Bad move: {san}") from e
+            yield move, comment
+            board.push(move)
+
+    def __iter__(self):
+        return self._plies
+
+    def finish(self):
+        """Replays the remaining moves, so the whole mainline is known to be legal"""
+        for _ in self._plies:
+            pass
+
+def fast_fen(board):
+    """board.fen() for standard chess, built directly from the bitboards"""
+    if board.uci_variant != 'chess' or board.chess960:
+        return board.fen()
+    squares = ['1'] * 64
+    for color, symbols in ((chess.WHITE, 'PNBRQK'), (chess.BLACK, 'pnbrqk')):
+        occupied = board.occupied_co[color]
+        for mask, symbol in zip((board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings), symbols):
+            for sq in chess.scan_forward(mask & occupied):
+                #FENs start at a8
+                squares[sq ^ 56] = symbol
+    board_fen = '/'.join([''.join(squares[i:i + 8]) for i in range(0, 64, 8)])
+    for run, n in _empty_runs:
+        board_fen = board_fen.replace(run, n)
+
+    castling_rights = board.clean_castling_rights()
+    castling = ''.join([c for bb, c in ((chess.BB_H1, 'K'), (chess.BB_A1, 'Q'), (chess.BB_H8, 'k'), (chess.BB_A8, 'q')) if castling_rights & bb])
+    if board.ep_square is not None and board.has_legal_en_passant():
+        ep = chess.SQUARE_NAMES[board.ep_square]
+    else:
+        ep = '-'
+    return f"{board_fen} {'w' if board.turn else 'b'} {castling or '-'} {ep} {board.halfmove_clock} {board.fullmove_number}"
+
+def count_legal_moves(board):
+    """len(list(board.legal_moves)) without making the moves, positions in check still use python-chess"""
+    king = board.king(board.turn)
+    if king is None or board.uci_variant != 'chess' or board.chess960 or board.is_check():
+        return len(list(board.legal_moves))
+    turn = board.turn
+    ours = board.occupied_co[turn]
+    theirs = board.occupied_co[not turn]
+    #Pinned pieces can only move along the line to the king
+    pinned = board._slider_blockers(king)
+    count = 0
+
+    for sq in chess.scan_reversed(ours & ~board.pawns):
+        targets = board.attacks_mask(sq) & ~ours
+        if sq == king:
+            count += sum(1 for to_sq in chess.scan_reversed(targets) if not board.is_attacked_by(not turn, to_sq))
+        else:
+            if pinned & chess.BB_SQUARES[sq]:
+                targets &= chess.ray(king, sq)
+            count += chess.popcount(targets)
+    count += sum(1 for _ in board.generate_castling_moves())
+
+    forward = 8 if turn else -8
+    start_rank = chess.BB_RANK_2 if turn else chess.BB_RANK_7
+    last_rank = chess.BB_RANK_8 if turn else chess.BB_RANK_1
+    empty = ~board.occupied
+    for sq in chess.scan_reversed(ours & board.pawns):
+        targets = chess.BB_PAWN_ATTACKS[turn][sq] & theirs
+        single = chess.BB_SQUARES[sq + forward]
+        if single & empty:
+            targets |= single
+            if chess.BB_SQUARES[sq] & start_rank and chess.BB_SQUARES[sq + 2 * forward] & empty:
+                targets |= chess.BB_SQUARES[sq + 2 * forward]
+        if pinned & chess.BB_SQUARES[sq]:
+            targets &= chess.ray(king, sq)
+        #Each promotion piece is its own move
+        count += chess.popcount(targets & ~last_rank) + 4 * chess.popcount(targets & last_rank)
+    if board.ep_square is not None:
+        count += sum(1 for _ in board.generate_legal_ep())
+    return count
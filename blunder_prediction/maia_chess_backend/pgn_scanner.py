@@ -0,0 +1,150 @@
+import bz2
+import re
+
+import numpy as np
+
+from .parallel_bz2 import open_parallel_bz2
+
+#Header only PGN scanning: games are split and their headers extracted with
+#regexes over large byte chunks, so nothing is decoded and no movetext is
+#parsed. Filters get numpy columns of the headers for a whole chunk of games
+#at a time and only the games they select are turned into dicts.
+
+scan_chunk_size = 8 * 1024 * 1024
+
+
+def _header_re(key, value_pattern):
+    #Starting with a literal lets re skip ahead with a fast substring search,
+    #chunks are searched with a newline prepended so the first line matches
+    return re.compile(rb'\n\[' + re.escape(key.encode()) + rb' "(' + value_pattern + rb')"\]')
+
+def open_pgn_bytes(path, bz2_workers = None):
+    """Opens a .pgn or .pgn.bz2 file in binary mode"""
+    if path.endswith('bz2'):
+        if bz2_workers is not None and bz2_workers > 1:
+            return open_parallel_bz2(path, workers = bz2_workers, mode = 'rb')
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+def parse_headers(raw_game):
+    """Returns the header dict of a game's bytes, as str like LightGamesFile"""
+    ret = {}
+    header = raw_game.split(b'\n\n', 1)[0]
+    for l in header.split(b'\n'):
+        k, v, _ = l.decode('utf8').split('"', 2)
+        ret[k[1:-1]] = v
+    return ret
+
+def iter_game_chunks(f, chunk_size = scan_chunk_size):
+    """Yields byte chunks of f that each hold a whole number of games"""
+    leftover = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        buf = leftover + chunk
+        cut = buf.rfind(b'\n\n[')
+        if cut < 0:
+            leftover = buf
+            continue
+        leftover = buf[cut + 2:]
+        yield buf[:cut + 2].lstrip()
+    leftover = leftover.strip()
+    if leftover:
+        yield leftover + b'\n\n'
+
+def split_games(buf):
+    """Returns the start offsets of the games in buf and the ends of their header sections"""
+    starts = []
+    header_ends = []
+    find = buf.find
+    pos = 0
+    while pos >= 0:
+        starts.append(pos)
+        header_end = find(b'\n\n', pos)
+        if header_end < 0:
+            header_end = len(buf)
+        header_ends.append(header_end)
+        pos = find(b'\n\n[', header_end)
+        if pos >= 0:
+            pos += 2
+    return starts, header_ends
+
+class PGNScanner(object):
+    """Streams (header dict, raw game bytes) from a binary PGN file
+
+    int_keys and str_keys are the headers extracted as columns for the
+    predicate, which is called with a dict of numpy arrays (int64 with -1
+    when missing or not a number, or bytes with b'' when missing), one entry
+    per game of a chunk, and returns a boolean mask of the games to keep.
+    """
+    def __init__(self, f, int_keys = ('WhiteElo', 'BlackElo'), str_keys = ('Result', 'Event'), predicate = None, with_headers = True, chunk_size = scan_chunk_size):
+        self.f = f
+        self.predicate = predicate
+        self.with_headers = with_headers
+        self.chunk_size = chunk_size
+        self.int_res = {k : _header_re(k, rb'\d+') for k in int_keys}
+        self.str_res = {k : _header_re(k, rb'[^"]*') for k in str_keys}
+        self.num_scanned = 0
+
+    def _columns(self, headers, starts):
+        cols = {}
+        for k, r in self.int_res.items():
+            cols[k] = self._column(r, headers, starts, -1, np.int64)
+        for k, r in self.str_res.items():
+            cols[k] = self._column(r, headers, starts, b'', bytes)
+        return cols
+
+    @staticmethod
+    def _column(r, headers, starts, missing, dtype):
+        vals = r.findall(headers)
+        if len(vals) == len(starts):
+            #Every game has the header (a header can't repeat in a game)
+            return np.array(vals).astype(dtype)
+        #Otherwise place the values by their position
+        col = np.full(len(starts), missing, dtype = object)
+        if vals:
+            pos = [m.start() for m in r.finditer(headers)]
+            col[np.searchsorted(starts, pos, side = 'right') - 1] = vals
+        return col.astype(dtype)
+
+    def __iter__(self):
+        for buf in iter_game_chunks(self.f, self.chunk_size):
+            starts, header_ends = split_games(buf)
+            self.num_scanned += len(starts)
+            if self.predicate is None:
+                selected = range(len(starts))
+            else:
+                #The regexes only run over the header sections, joined by
+                #newlines and each preceded by one
+                header_sections = [buf[s:e] for s, e in zip(starts, header_ends)]
+                lens = np.array([len(h) + 1 for h in header_sections], dtype = np.int64)
+                section_starts = np.cumsum(lens) - lens
+                headers = b'\n' + b'\n'.join(header_sections)
+                selected = np.flatnonzero(self.predicate(self._columns(headers, section_starts)))
+            ends = starts[1:] + [len(buf)]
+            for i in selected:
+                raw = buf[starts[i]:ends[i]]
+                yield (parse_headers(raw) if self.with_headers else None), raw
+
+def elo_range_filter(min_elo = None, max_elo = None, results = None, exclude_event = None):
+    """Predicate keeping games where both Elos are in (min_elo, max_elo], with a Result in results and no exclude_event in their Event"""
+    results = None if results is None else np.array([r.encode() for r in results])
+    def predicate(cols):
+        w, b = cols['WhiteElo'], cols['BlackElo']
+        mask = (w >= 0) & (b >= 0)
+        if min_elo is not None:
+            mask &= (w > min_elo) & (b > min_elo)
+        if max_elo is not None:
+            mask &= (w <= max_elo) & (b <= max_elo)
+        if results is not None:
+            mask &= np.isin(cols['Result'], results)
+        if exclude_event is not None:
+            mask &= np.char.find(cols['Event'], exclude_event.encode()) < 0
+        return mask
+    return predicate
+
+def scan_pgn(path, predicate = None, bz2_workers = None, **kwargs):
+    """Yields (header dict, raw game bytes) of the games of path the predicate selects, see PGNScanner"""
+    with open_pgn_bytes(path, bz2_workers = bz2_workers) as f:
+        yield from PGNScanner(f, predicate = predicate, **kwargs)
@@ -6,4 +6,5 @@ from .dataset_loader_old import MmapIterLoaderMap_old
 from .tensorboard_wrapper import TB_wrapper
 from .utils import *
 from .wrapper import *
+from .batch_inference import *
 from .model_loader import *
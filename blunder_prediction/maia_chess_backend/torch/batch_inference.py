@@ -0,0 +1,165 @@
+import os
+import os.path
+import time
+
+import humanize
+import numpy as np
+import torch
+import torch.utils.data
+
+from ..fen_to_vec import fens_to_array, packed_to_vecs
+from ..game_mmaps import read_mmap_manifest, open_mmap_column, add_mmap_column, mmap_manifest_name
+from ..parquet_io import iter_per_move_chunks
+from ..utils import printWithDate, fen_extend
+from .utils import tensor_to_device, is_cuda_device
+
+#Runs a blunder model over a whole dataset, a month of mmaps or a per move
+#CSV/Parquet, in large batches. DataLoader workers read and decode the boards
+#in the background, into pinned memory when the model is on a GPU, while the
+#model runs. On a GPU each batch's predictions are copied back to pinned
+#memory without waiting, and they're only written once the next batch has been
+#started, so the GPU keeps working while they are. The predictions are written
+#in the rows' order as a float32 file named like the mmaps' columns.
+
+inference_batch_size = 8192
+inference_logging_delay = 30 # in seconds
+
+class MmapBoardBatches(torch.utils.data.IterableDataset):
+    """The boards of a directory of mmaps in order, batch_size at a time, as (n, 17, 8, 8) bool tensors
+
+    With DataLoader workers each takes every num_workers'th batch, the
+    DataLoader takes a batch from each worker in turn so they stay in order.
+    """
+    def __init__(self, target_dir, batch_size = inference_batch_size):
+        super().__init__()
+        self.target_dir = target_dir
+        self.batch_size = batch_size
+        manifest = read_mmap_manifest(target_dir)
+        self.num_rows = manifest['num_rows']
+        self.packed_boards = 'board_packed' in manifest['columns']
+
+    def __len__(self):
+        return (self.num_rows + self.batch_size - 1) // self.batch_size
+
+    def __repr__(self):
+        return f"<MmapBoardBatches {self.target_dir} {self.num_rows} boards>"
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        boards = open_mmap_column(self.target_dir, 'board_packed' if self.packed_boards else 'board')
+        for i in range(worker_id, len(self), num_workers):
+            b = boards[i * self.batch_size:(i + 1) * self.batch_size]
+            yield torch.from_numpy(packed_to_vecs(b) if self.packed_boards else np.array(b))
+
+class PerMoveBoardBatches(torch.utils.data.IterableDataset):
+    """The boards of a per move dataset (CSV or Parquet) in order, batch_size at a time, as (n, 17, 8, 8) bool tensors
+
+    The file can only be read in order, so this must have at most one DataLoader worker.
+    """
+    def __init__(self, path, batch_size = inference_batch_size, nrows = None):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.nrows = nrows
+
+    def __repr__(self):
+        return f"<PerMoveBoardBatches {self.path}>"
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is not None and worker_info.num_workers > 1:
+            raise RuntimeError(f"{self.path} can only be read by one worker")
+        for df in iter_per_move_chunks(self.path, columns = ['board'], chunk_size = self.batch_size, nrows = self.nrows):
+            fens = df['board'].astype(str).tolist()
+            try:
+                boards = fens_to_array(fens)
+            except ValueError:
+                boards = fens_to_array([fen_extend(f) for f in fens])
+            yield torch.from_numpy(boards)
+
+def run_model_on_batches(model, dataset, output_file, num_workers = 4, prefetch_factor = 4, name = None):
+    """Runs model, a ModelWrapper, on the board batches of dataset and writes its predictions to output_file as float32s
+
+    Returns the number of boards.
+    """
+    if name is None:
+        name = repr(dataset)
+    loader_args = {}
+    if num_workers > 0:
+        loader_args = {'prefetch_factor' : prefetch_factor}
+    loader = torch.utils.data.DataLoader(
+                        dataset,
+                        batch_size = None,
+                        num_workers = num_workers,
+                        pin_memory = is_cuda_device(model.device),
+                        **loader_args,
+                        )
+    tstart = time.time()
+    tLast = time.time()
+    num_boards = 0
+    is_cuda = is_cuda_device(model.device)
+    pending = None
+    for boards in loader:
+        preds = _copy_predictions(model.run_boards(tensor_to_device(boards, device = model.device, dtype = torch.float32)), is_cuda)
+        #Waits for the last batch's copy, not this batch
+        if pending is not None:
+            num_boards += _write_predictions(output_file, pending)
+        pending = preds
+        if time.time() - tLast > inference_logging_delay:
+            tLast = time.time()
+            printWithDate(f"{name} {num_boards} boards in {humanize.naturaldelta(time.time() - tstart)}, {num_boards / (time.time() - tstart):.0f} boards/second", flush = True)
+    if pending is not None:
+        num_boards += _write_predictions(output_file, pending)
+    printWithDate(f"{name} Done {num_boards} boards in {humanize.naturaldelta(time.time() - tstart)}, {num_boards / max(time.time() - tstart, 1e-6):.0f} boards/second", flush = True)
+    return num_boards
+
+def _copy_predictions(preds, is_cuda):
+    #Returns the CPU tensor the predictions will be in and, on a GPU, the event of when they are
+    if not is_cuda:
+        return preds, None
+    with torch.inference_mode():
+        buffer = torch.empty(preds.shape, dtype = preds.dtype, pin_memory = True)
+        buffer.copy_(preds, non_blocking = True)
+    copied = torch.cuda.Event()
+    copied.record()
+    return buffer, copied
+
+def _write_predictions(output_file, pending):
+    buffer, copied = pending
+    if copied is not None:
+        copied.synchronize()
+    a = buffer.numpy().astype('<f4')
+    output_file.write(a.tobytes())
+    return len(a)
+
+def mmap_dirs(path):
+    """path, or the directories under it, like the blunder and nonblunder of each month, that have mmaps"""
+    return sorted(root for root, dirs, files in os.walk(path) if mmap_manifest_name in files or any(f.endswith('.mm') for f in files))
+
+def predict_mmaps(model, target_dir, output_name, batch_size = inference_batch_size, num_workers = 4, prefetch_factor = 4):
+    """Writes model's predictions for the boards of the mmaps in target_dir as their output_name column, returns the number of boards"""
+    dataset = MmapBoardBatches(target_dir, batch_size = batch_size)
+    path = os.path.join(target_dir, f"{output_name}+float32+{dataset.num_rows}.mm")
+    with open(path + '.tmp', 'wb') as f:
+        num_boards = run_model_on_batches(model, dataset, f, num_workers = num_workers, prefetch_factor = prefetch_factor, name = target_dir)
+    os.replace(path + '.tmp', path)
+    add_mmap_column(target_dir, path, np.float32, (num_boards,))
+    return num_boards
+
+def predict_per_move(model, input_path, output_name, output_dir = None, batch_size = inference_batch_size, nrows = None, prefetch_factor = 4):
+    """Writes model's predictions for the boards of a per move dataset (CSV or Parquet), one for each row in order
+
+    They're written to output_dir, or next to the input, as
+    name-output_name+float32+n.mm. Returns the number of boards.
+    """
+    if output_dir is None:
+        output_dir = os.path.dirname(input_path)
+    name = os.path.basename(input_path).split('.')[0]
+    tmp_path = os.path.join(output_dir, f"{name}-{output_name}.mm.tmp")
+    with open(tmp_path, 'wb') as f:
+        num_boards = run_model_on_batches(model, PerMoveBoardBatches(input_path, batch_size = batch_size, nrows = nrows), f, num_workers = 1, prefetch_factor = prefetch_factor, name = name)
+    path = os.path.join(output_dir, f"{name}-{output_name}+float32+{num_boards}.mm")
+    os.replace(tmp_path, path)
+    printWithDate(f"{name} Wrote {path}")
+    return num_boards
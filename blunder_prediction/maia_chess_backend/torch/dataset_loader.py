@@ -1,15 +1,19 @@
 import torch
 import torch.utils.data
 
+import contextlib
 import os
 import os.path
 import glob
-import json
 
 import numpy as np
 import pandas
 
 from ..utils import profile_helper
+from ..fen_to_vec import packed_board_dtype, packed_to_vecs
+from ..game_mmaps import read_mmap_manifest, open_mmap_column, open_string_table
+from ..mmap_sampler import ShuffledMmapRows, shuffle_block_size, shuffle_window_size
+from .utils import default_device, is_cuda_device, tensor_to_device, boards_to_tensor
 
 def load_mmap_np(mmap_name):
     mmap_name = os.path.abspath(mmap_name)
@@ -27,6 +31,11 @@ def load_mmap_np(mmap_name):
                    dtype = np.bool,
                    mode = 'r',
                    shape = (int(a_len), 17, 8, 8))
+    elif mmapType == 'board_packed':
+        return np.memmap(mmap_name,
+                   dtype = packed_board_dtype,
+                   mode = 'r',
+                   shape = (int(a_len),))
     elif mmapType in ['move', 'top_nonblunder', 'top_blunder']:
         return np.memmap(mmap_name,
                    dtype = np.int,
@@ -36,31 +45,47 @@ def load_mmap_np(mmap_name):
         raise RuntimeError(f'Invalid mmap path name: {mmap_name}')
 
 class MmapSingleLoader(object):
+    """The batches of one directory of mmaps
+
+    If y_names has game_id the ids are strings, looked up a batch at a time
+    in the directory's game id StringTable, unless game_id_ints is True,
+    then they're its indices, which are per directory, and
+    self.game_id_table.lookup() gets the strings.
+    """
     @profile_helper
-    def __init__(self, target_name, y_names, batch_size, max_rows = None,  max_samples = None, linear_mode = False):
+    def __init__(self, target_name, y_names, batch_size, max_rows = None,  max_samples = None, linear_mode = False, game_id_ints = False):
         self.target_name = target_name
         self.max_samples = max_samples
         self.max_rows = max_rows
         self.linear_mode = linear_mode
+        self.game_id_ints = game_id_ints
         self.y_names = y_names.copy()
         if 'game_id' in self.y_names:
             self.y_names.remove('game_id')
             self.with_game_id = True
-            with open(self.make_rel_path('game_id_lookup.json')) as f:
-                self.ids_map = json.load(f)
+            try:
+                self.game_id_table = open_string_table(self.target_name, 'game_id')
+            except KeyError:
+                raise FileNotFoundError(f"{target_name} has no game ids table")
         else:
             self.with_game_id = False
         self.batch_size = batch_size
 
-        self.board_array = load_mmap_np(self.make_rel_path("board+*.mm"))
+        #The files are found with the manifest, which is only read once per
+        #directory, instead of globbing for each column
+        self.manifest = read_mmap_manifest(self.target_name)
+
+        #Older datasets have the boards unpacked
+        self.packed_boards = 'board_packed' in self.manifest['columns']
+        self.board_array = open_mmap_column(self.target_name, 'board_packed' if self.packed_boards else 'board')
 
         self.y_vals = {}
         try:
             for name in self.y_names:
-                self.y_vals[name] = load_mmap_np(self.make_rel_path(f"{name}+*.mm"))
+                self.y_vals[name] = open_mmap_column(self.target_name, name)
             if self.with_game_id:
-                self.y_vals['game_id'] = load_mmap_np(self.make_rel_path("game_id+*.mm"))
-        except IndexError:
+                self.y_vals['game_id'] = open_mmap_column(self.target_name, 'game_id')
+        except KeyError:
             raise FileNotFoundError(f"{target_name} is missing {name} value")
         if max_rows is not None:
             self.board_array = self.board_array[:max_rows]
@@ -84,6 +109,8 @@ class MmapSingleLoader(object):
     @profile_helper
     def get_index(self, index):
         ret_board = self.board_array[self.batch_size * index: self.batch_size * (index + 1)]
+        if self.packed_boards:
+            ret_board = packed_to_vecs(ret_board)
         #ret_board = torch.from_numpy(ret_board)
         #ret_board = ret_board.pin_memory()
         ret_ys = {}
@@ -92,8 +119,10 @@ class MmapSingleLoader(object):
             ret_ys[name] = a_mm#torch.from_numpy(a_mm)
         if self.with_game_id:
             a_mm = self.y_vals['game_id'][self.batch_size * index: self.batch_size * (index + 1)]
-            ret_ids = [self.ids_map[str(i)] for i in a_mm]
-            ret_ys['game_id'] = ret_ids
+            if self.game_id_ints:
+                ret_ys['game_id'] = a_mm
+            else:
+                ret_ys['game_id'] = self.game_id_table.lookup(a_mm)
         return ret_board, ret_ys
 
     @profile_helper
@@ -104,18 +133,46 @@ class MmapSingleLoader(object):
             raise StopIteration(f"out of batches in {self.target_name}")
         return self.get_index(batch_num)
 
-class MmapIterLoaderMap(torch.utils.data.IterableDataset):
-    def __init__(self, target_dir, y_names, mini_batch_size, max_rows = None, max_samples = None, linear_mode = False):
+def all_y_names(target_name):
+    y_names = []
+    for name in read_mmap_manifest(target_name)['columns']:
+        if name not in ['game_id', 'board', 'board_packed']:
+            y_names.append(name)
+    return y_names
+
+class MmapBatchesDataset(torch.utils.data.IterableDataset):
+    """The batches of next_arrays() as tensors on device with next(), or CPU tensors when iterated over, like by a DataLoader
+
+    device is as in tensor_to_device(), None is CUDA if there is a GPU.
+    Subclasses define next_arrays() and shard_for_worker(worker_id, num_workers, seed).
+    """
+    def __init__(self, device = None):
         super().__init__()
+        self.device = default_device() if device is None else device
+
+    @profile_helper
+    def __iter__(self):
+        """Yields next_arrays() as CPU tensors, for torch.utils.data.DataLoader (see PrefetchLoader)"""
+        worker_info = torch.utils.data.get_worker_info()
+        if worker_info is not None:
+            self.shard_for_worker(worker_info.id, worker_info.num_workers, worker_info.seed)
+        while True:
+            ret_x, ret_y = self.next_arrays()
+            yield torch.from_numpy(ret_x), {k : torch.from_numpy(v) for k, v in ret_y.items()}
+
+    @profile_helper
+    def __next__(self):
+        ret_x, ret_y = self.next_arrays()
+        ret_x = boards_to_tensor(ret_x, device = self.device)
+        return ret_x, {k : tensor_to_device(torch.from_numpy(v), device = self.device) for k, v in ret_y.items()}
+
+class MmapIterLoaderMap(MmapBatchesDataset):
+    def __init__(self, target_dir, y_names, mini_batch_size, max_rows = None, max_samples = None, linear_mode = False, device = None):
+        super().__init__(device = device)
         self.target_dir = target_dir
         self.target_names = os.listdir(target_dir)
         if y_names == 'all':
-            vals = os.listdir(os.path.join(target_dir, self.target_names[0], 'blunder'))
-            y_names = []
-            for v in (n for n in vals if n.endswith('mm')):
-                name = v.split('+')[0]
-                if name not in ['game_id', 'board']:
-                    y_names.append(name)
+            y_names = all_y_names(os.path.join(target_dir, self.target_names[0], 'blunder'))
         self.y_names = y_names.copy()
         self.max_rows = max_rows
         self.max_samples = max_samples
@@ -152,12 +209,7 @@ class MmapIterLoaderMap(torch.utils.data.IterableDataset):
             self.num_nonblunders += self.get_len(os.path.join(nb_name, 'nonblunder'))
 
     def get_len(self, target):
-        p = glob.glob(os.path.join(
-                        self.target_dir,
-                        target,
-                        "board+*.mm"
-                        ))[0]
-        return int(p.split('+')[-1].split('.')[0])
+        return read_mmap_manifest(os.path.join(self.target_dir, target))['num_rows']
 
     def __len__(self):
         return self.num_nonblunders + self.num_nonblunders
@@ -229,26 +281,29 @@ class MmapIterLoaderMap(torch.utils.data.IterableDataset):
             self.init_next_nonblunder_loader()
             return self.get_next_nb()
 
-    @profile_helper
-    def __iter__(self):
-        while True:
-            yield next(self)
+    def shard_for_worker(self, worker_id, num_workers, seed):
+        #The workers' copies of the loader all start with the same numpy
+        #state, so each gets its own seed and, when there are enough, its own months
+        np.random.seed(seed % 2**32)
+        if len(self.blunder_names) >= num_workers:
+            self.blunder_names = self.blunder_names[worker_id::num_workers]
+            self.nonblunder_names = self.nonblunder_names[worker_id::num_workers]
+        self.current_blunders = []
+        self.current_nonblunders = []
+        self.init_next_blunder_loader()
+        self.init_next_nonblunder_loader()
 
     @profile_helper
-    def __next__(self):
+    def next_arrays(self):
+        """The next batch, half blunders and half non blunders, as (mini_batch_size, 17, 8, 8) bool boards and a dict of y values"""
         x_blunder, y_blunder = self.get_next_b()
         x_nonblunder, y_nonblunder = self.get_next_nb()
 
         ret_x = np.stack([x_blunder, x_nonblunder], axis = 0)
-        ret_x = torch.from_numpy(ret_x)
-        ret_x = ret_x.cuda()
         ret_x = ret_x.reshape(-1, 17, 8, 8)
-        ret_x = ret_x.float()
         ret_y = {}
         for k, y_b in y_blunder.items():
-            k_a = np.stack([y_b, y_nonblunder[k]])
-            ret_y[k] = torch.from_numpy(k_a).cuda().reshape(-1)
-
+            ret_y[k] = np.stack([y_b, y_nonblunder[k]]).reshape(-1)
         return ret_x, ret_y
 
     def gen_big_batch_df(self, mini_batches_per, include_board = False):
@@ -273,3 +328,115 @@ class MmapIterLoaderMap(torch.utils.data.IterableDataset):
         return pandas.DataFrame(np.concatenate(vals),
                  columns = self.y_names + ([f"board_{i:04.0f}" for i in range(r.shape[1] - len(self.y_names))] if include_board else [])
                 )
+
+class MmapShuffleLoaderMap(MmapBatchesDataset):
+    """Like MmapIterLoaderMap, but each batch's rows are sampled from all the months instead of being a slice of one
+
+    The blunders and non blunders are each a ShuffledMmapRows over all the
+    months, see it for block_size and window_size, which trade how random
+    the order is for how sequential the reads are. max_samples limits the
+    rows of each month to what MmapIterLoaderMap would use.
+    """
+    def __init__(self, target_dir, y_names, mini_batch_size, max_rows = None, max_samples = None, block_size = shuffle_block_size, window_size = shuffle_window_size, seed = None, device = None):
+        super().__init__(device = device)
+        self.target_dir = target_dir
+        self.target_names = sorted(os.listdir(target_dir))
+        if y_names == 'all':
+            y_names = all_y_names(os.path.join(target_dir, self.target_names[0], 'blunder'))
+        if 'game_id' in y_names:
+            raise ValueError("game_id can't be sampled across months, its values are per month")
+        self.y_names = y_names.copy()
+        self.mini_batch_size = mini_batch_size
+        if max_samples:
+            sample_rows = max_samples * (mini_batch_size // 2)
+            max_rows = sample_rows if max_rows is None else min(max_rows, sample_rows)
+        if seed is None:
+            seed = np.random.randint(2**32)
+
+        self.blunders = ShuffledMmapRows([os.path.join(target_dir, n, 'blunder') for n in self.target_names], self.y_names, block_size = block_size, window_size = window_size, max_rows = max_rows, seed = seed)
+        self.nonblunders = ShuffledMmapRows([os.path.join(target_dir, n, 'nonblunder') for n in self.target_names], self.y_names, block_size = block_size, window_size = window_size, max_rows = max_rows, seed = seed + 1)
+        self.num_blunders = len(self.blunders)
+        self.num_nonblunders = len(self.nonblunders)
+
+    def __len__(self):
+        return self.num_blunders + self.num_nonblunders
+
+    def __repr__(self):
+        return f"<MmapShuffleLoaderMap {len(self.target_names)} months {len(self)} samples block_size {self.blunders.block_size}>"
+
+    def shard_for_worker(self, worker_id, num_workers, seed):
+        #The order of the blocks is shared, each worker takes its own blocks from it
+        self.blunders.set_worker(worker_id, num_workers)
+        self.nonblunders.set_worker(worker_id, num_workers)
+
+    @profile_helper
+    def next_arrays(self):
+        """The next batch, half blunders and half non blunders, as (mini_batch_size, 17, 8, 8) bool boards and a dict of y values"""
+        x_blunder, y_blunder = self.blunders.take(self.mini_batch_size // 2)
+        x_nonblunder, y_nonblunder = self.nonblunders.take(self.mini_batch_size // 2)
+        ret_x = np.concatenate([x_blunder, x_nonblunder])
+        ret_y = {k : np.concatenate([y_b, y_nonblunder[k]]) for k, y_b in y_blunder.items()}
+        return ret_x, ret_y
+
+class PrefetchLoader(object):
+    """Makes the batches of an MmapIterLoaderMap in DataLoader worker processes, with the same next()
+
+    The workers make the batches while the model runs and put them in pinned
+    memory, the next batch is then copied to device on its own CUDA stream
+    while the current one is being used. Without CUDA the batches are left
+    on the CPU and the workers still load them in the background.
+    device defaults to the dataset's. Attributes not found are the
+    dataset's, like num_blunders.
+    """
+    def __init__(self, dataset, num_workers = 4, prefetch_factor = 4, device = None):
+        self.dataset = dataset
+        if device is None:
+            device = getattr(dataset, 'device', None) or default_device()
+        self.device = device
+        self.is_cuda = is_cuda_device(self.device)
+        loader_args = {}
+        if num_workers > 0:
+            loader_args = {'prefetch_factor' : prefetch_factor, 'persistent_workers' : True}
+        self.loader = torch.utils.data.DataLoader(
+                            dataset,
+                            batch_size = None,
+                            num_workers = num_workers,
+                            pin_memory = self.is_cuda or self.device == 'pinned',
+                            **loader_args,
+                            )
+        self.iterator = iter(self.loader)
+        self.stream = torch.cuda.Stream(device = torch.device(self.device)) if self.is_cuda else None
+        self.next_batch = self.load_next()
+
+    def __getattr__(self, name):
+        if name == 'dataset':
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __repr__(self):
+        return f"<PrefetchLoader {self.loader.num_workers} workers {self.dataset!r}>"
+
+    @profile_helper
+    def load_next(self):
+        x, y = next(self.iterator)
+        with torch.cuda.stream(self.stream) if self.is_cuda else contextlib.nullcontext():
+            x = tensor_to_device(x, device = self.device, dtype = torch.float32)
+            if self.is_cuda:
+                y = {k : tensor_to_device(v, device = self.device) for k, v in y.items()}
+        return x, y
+
+    def __iter__(self):
+        return self
+
+    @profile_helper
+    def __next__(self):
+        x, y = self.next_batch
+        if self.is_cuda:
+            current_stream = torch.cuda.current_stream(torch.device(self.device))
+            current_stream.wait_stream(self.stream)
+            #They were allocated on the copy stream but are used on this one
+            x.record_stream(current_stream)
+            for v in y.values():
+                v.record_stream(current_stream)
+        self.next_batch = self.load_next()
+        return x, y
@@ -5,6 +5,8 @@ import pickle
 
 import torch
 
+from .utils import load_saved_net
+
 def load_blunder_model_config(config_dir_path):
     with open(os.path.join(config_dir_path, 'config.yaml')) as f:
         config = yaml.safe_load(f.read())
@@ -14,7 +16,7 @@ def load_blunder_model_config(config_dir_path):
             model = pickle.load(f)
     elif config['engine'] == 'torch':
         weightsPath = os.path.join(config_dir_path, config['options']['weightsPath'])
-        model = torch.load(weightsPath)
+        model = load_saved_net(weightsPath)
     else:
         raise NotImplementedError(f"{config['engine']} is not a known engine type")
     return model, config
@@ -1,13 +1,64 @@
+import inspect
+
 import torch
 
-from ..fen_to_vec import fenToVec
+from ..fen_to_vec import fenToVec, fens_to_array
 from ..utils import fen_extend
 
-def fenToTensor(fenstr):
+#Where the batches go is a device, which can be anything torch.device()
+#takes, or 'pinned' for page locked CPU memory that can later be copied to a
+#GPU without blocking. None is CUDA when there is a GPU, otherwise the CPU.
+
+def default_device():
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+def is_cuda_device(device):
+    return device != 'pinned' and torch.device(device).type == 'cuda'
+
+def config_device(device = None):
+    """The device of a config's device value, an int is a GPU index like in the older configs"""
+    if device is None:
+        device = default_device()
+    elif isinstance(device, int):
+        device = f"cuda:{device}"
+    if device != 'pinned':
+        device = torch.device(device)
+        if device.type == 'cuda' and not torch.cuda.is_available():
+            raise RuntimeError(f"device is {device} but CUDA isn't available, use cpu")
+    return device
+
+def load_saved_net(path, map_location = None):
+    """A net saved with torch.save(net), newer torch only loads tensors unless weights_only is False, older torch doesn't have it"""
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        return torch.load(path, map_location = map_location, weights_only = False)
+    return torch.load(path, map_location = map_location)
+
+def tensor_to_device(t, device = None, dtype = None):
+    """t on device and of dtype, with one copy, so the bool boards are made floats as they're copied"""
+    if device is None:
+        device = default_device()
+    if dtype is None:
+        dtype = t.dtype
+    if device == 'pinned':
+        return torch.empty(t.shape, dtype = dtype, pin_memory = True).copy_(t)
+    return t.to(device = device, dtype = dtype, non_blocking = True)
+
+def boards_to_tensor(boards, device = None):
+    """(n, 17, 8, 8) bool numpy boards as a float tensor on device"""
+    return tensor_to_device(torch.from_numpy(boards), device = device, dtype = torch.float32)
+
+def fensToTensor(fens, device = None):
+    """The boards of many FENs as one (n, 17, 8, 8) float tensor on device"""
+    fens = list(fens)
+    try:
+        boards = fens_to_array(fens)
+    except ValueError:
+        boards = fens_to_array([fen_extend(f) for f in fens])
+    return boards_to_tensor(boards, device = device)
+
+def fenToTensor(fenstr, device = None):
     try:
         t = torch.from_numpy(fenToVec(fenstr))
     except AttributeError:
         t = torch.from_numpy(fenToVec(fen_extend(fenstr)))
-    if torch.cuda.is_available():
-        t = t.cuda()
-    return t.float()
+    return tensor_to_device(t, device = device, dtype = torch.float32)
@@ -5,7 +5,7 @@ import re
 import io
 import torch
 
-from .utils import fenToTensor
+from .utils import fensToTensor, config_device, load_saved_net
 
 line_parse_re = re.compile(r"tensor\(([0-9.]+), .+?\)")
 
@@ -26,7 +26,14 @@ def parse_tensor(t):
     return t.group(1)
 
 class ModelWrapper(object):
-    def __init__(self, path, default_vals = None):
+    """The newest save of the blunder model in path, for predicting from boards
+
+    device is as in config_device(), None is CUDA if there is a GPU. The
+    saves are in training mode, so the net is put in eval mode, the batch
+    norms then use their running statistics and a board's prediction
+    doesn't depend on the rest of its batch like it used to.
+    """
+    def __init__(self, path, default_vals = None, device = None):
         self.path = path.rstrip('/')
         model_paths = [fname for fname in os.listdir(self.path) if fname.startswith('net')]
         self.model_paths = sorted(model_paths,
@@ -34,11 +41,15 @@ class ModelWrapper(object):
                                           if 'final' not in x else float('-inf'))
         self.newest_save = self.find_best_save()
         self.name = os.path.basename(self.path)
-        self.net = torch.load(self.newest_save)
-        if torch.cuda.is_available():
-            self.net = self.net.cuda()
+        self.device = config_device(device)
+        self.net = load_saved_net(self.newest_save, map_location = self.device)
+        if self.device.type == 'cuda':
+            self.net = self.net.cuda(self.device)
         else:
             self.net = self.net.cpu()
+        self.net.eval()
+        #What the boards are run through, compile() can replace it
+        self.forward = self.net
 
         self.has_extras = False
         self.extras = None
@@ -63,32 +74,53 @@ class ModelWrapper(object):
     def __repr__(self):
         return f"<ModelWrapper {self.name}>"
 
-    def run_batch(self, input_fens,  new_defaults = None):
-        input_tensors = torch.stack([fenToTensor(fen) for fen in input_fens])
+    def compile(self, mode = 'compile'):
+        """Runs the boards through the net compiled with torch.compile(), or traced to TorchScript with mode 'trace'
+
+        Tracing only works for models without extra inputs.
+        """
+        if mode == 'compile':
+            self.forward = torch.compile(self.net)
+        elif mode == 'trace':
+            if self.has_extras:
+                raise ValueError(f"{self.name} has extra inputs, it can't be traced")
+            with torch.inference_mode():
+                self.forward = torch.jit.trace(self.net, torch.zeros((1, 17, 8, 8), dtype = torch.float32, device = self.device))
+        elif mode is None or mode == 'none':
+            self.forward = self.net
+        else:
+            raise ValueError(f"{mode} is not a known compile mode, use compile, trace or none")
+
+    def run_boards(self, input_tensors,  new_defaults = None):
+        """The predictions of an (n, 17, 8, 8) float tensor of boards on self.device, as a tensor of n on self.device"""
         extra_x = None
         if self.has_extras:
             extra_x = {}
-            if new_defaults is None:
-                for n in self.extras:
-                    extra_x[n] = self.defaults_dict[n] * torch.ones([input_tensors.shape[0]], dtype = torch.float32)
+            for n in self.extras:
+                if new_defaults is None:
+                    v = self.defaults_dict[n]
+                else:
+                    v = new_defaults.get(n, self.defaults_dict[n])
+                extra_x[n] = torch.as_tensor(v, dtype = torch.float32).to(self.device) * torch.ones([input_tensors.shape[0]], dtype = torch.float32, device = self.device)
+        with torch.inference_mode():
+            if extra_x is None:
+                y_vals = self.forward(input_tensors)
             else:
-                for n in self.extras:
-                    extra_x[n] = new_defaults.get(n, self.defaults_dict[n]) * torch.ones([input_tensors.shape[0]], dtype = torch.float32)
-        if torch.cuda.is_available():
-            input_tensors = input_tensors.cuda()
-            if extra_x is not None:
-                for n in self.extras:
-                    extra_x[n] = extra_x[n].cuda()
-        ret_dat = self.net.dict_forward(input_tensors, extra_x = extra_x)
-
-        for n in ['is_blunder_wr', 'is_blunder_mean']:
-            try:
-                return ret_dat[n].detach().cpu().numpy()
-            except KeyError:
-                pass
-        for n in ['winrate_loss', 'is_blunder_wr_mean']:
-            try:
-                return ret_dat[n].detach().cpu().numpy()  * 5
-            except KeyError:
-                pass
+                y_vals = self.forward(input_tensors, extra_x = extra_x)
+            ret_dat = {k : v for k, v in zip(self.net.outputs, y_vals)}
+
+            for n in ['is_blunder_wr', 'is_blunder_mean']:
+                try:
+                    return ret_dat[n].reshape(-1)
+                except KeyError:
+                    pass
+            for n in ['winrate_loss', 'is_blunder_wr_mean']:
+                try:
+                    return ret_dat[n].reshape(-1) * 5
+                except KeyError:
+                    pass
         raise KeyError(f"No known output types found in: {ret_dat.keys()}")
+
+    def run_batch(self, input_fens,  new_defaults = None):
+        input_tensors = fensToTensor(input_fens, device = self.device)
+        return self.run_boards(input_tensors, new_defaults = new_defaults).cpu().numpy().reshape(-1, 1)
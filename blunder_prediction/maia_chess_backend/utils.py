@@ -9,8 +9,13 @@ import bz2
 import multiprocessing
 import functools
 
+import numpy as np
 import pandas
 import pytz
+
+from .movetext import LeanGame, UnsupportedMovetext, fast_fen, count_legal_moves
+from .fen_to_vec import board_to_masks
+
 tz = pytz.timezone('Canada/Eastern')
 
 low_time_threshold = 30
@@ -57,6 +62,8 @@ fenComps = 'rrqn2k1/8/pPp4p/2Pp1pp1/3Pp3/4P1P1/R2NB1PP/1Q4K1 w KQkq - 0 1'.split
 
 cpLookup = None
 cpLookup_simple = None
+cpLookup_array = None
+cpLookup_simple_array = None
 
 def profile_helper(target):
     try:
@@ -87,8 +94,25 @@ def remove_low_time(g_str):
     end = g_str[-20:].split(' ')[-1]
     return g_str[:r.span()[0]] + end
 
-def cp_to_winrate(cp, lookup_file = os.path.join(os.path.dirname(__file__), '../data/cp_winrate_lookup_simple.json'), allow_nan = False):
+def _load_cp_lookup_simple(lookup_file):
     global cpLookup_simple
+    if cpLookup_simple is None:
+        with open(lookup_file) as f:
+            cpLookup_str = json.load(f)
+            cpLookup_simple = {float(k) : wr for k, wr in cpLookup_str.items()}
+    return cpLookup_simple
+
+def _load_cp_lookup(lookup_file):
+    global cpLookup
+    if cpLookup is None:
+        with open(lookup_file) as f:
+            cpLookup_str = json.load(f)
+            cpLookup = {}
+            for k, v in cpLookup_str.items():
+                cpLookup[int(k)] = {float(k) : wr for k, wr in v.items()}
+    return cpLookup
+
+def cp_to_winrate(cp, lookup_file = os.path.join(os.path.dirname(__file__), '../data/cp_winrate_lookup_simple.json'), allow_nan = False):
     try:
         cp = int(float(cp) * 10) / 10
     except OverflowError:
@@ -99,17 +123,12 @@ def cp_to_winrate(cp, lookup_file = os.path.join(os.path.dirname(__file__), '../
             return float("nan")
         else:
             raise
-    if cpLookup_simple is None:
-        with open(lookup_file) as f:
-            cpLookup_str = json.load(f)
-            cpLookup_simple = {float(k) : wr for k, wr in cpLookup_str.items()}
     try:
-        return cpLookup_simple[cp]
+        return _load_cp_lookup_simple(lookup_file)[cp]
     except KeyError:
         return float("nan")
 
 def cp_to_winrate_elo(cp, elo = 1500, lookup_file = os.path.join(os.path.dirname(__file__), '../data/cp_winrate_lookup.json'), allow_nan = False):
-    global cpLookup
     try:
         cp = int(float(cp) * 10) / 10
         elo = int(float(elo)//100) * 100
@@ -121,17 +140,90 @@ def cp_to_winrate_elo(cp, elo = 1500, lookup_file = os.path.join(os.path.dirname
             return float("nan")
         else:
             raise
-    if cpLookup is None:
-        with open(lookup_file) as f:
-            cpLookup_str = json.load(f)
-            cpLookup = {}
-            for k, v in cpLookup_str.items():
-                cpLookup[int(k)] = {float(k) : wr for k, wr in v.items()}
     try:
-        return cpLookup[elo][cp]
+        return _load_cp_lookup(lookup_file)[elo][cp]
     except KeyError:
         return float("nan")
 
+#The array versions give the same values as the scalar ones for whole arrays
+#at once: the lookups become dense arrays indexed by tenths of a pawn (and
+#hundreds of Elo), with nan where the dicts have no key
+
+def _cp_tenths_array(lookup):
+    tenths = {int(round(cp * 10)) : wr for cp, wr in lookup.items()}
+    start = min(tenths)
+    a = np.full(max(tenths) - start + 1, np.nan)
+    for t, wr in tenths.items():
+        a[t - start] = wr
+    return start, a
+
+def _to_float_array(vals, allow_nan):
+    try:
+        return np.asarray(vals, dtype = np.float64)
+    except ValueError:
+        pass
+    a = np.empty(np.shape(vals))
+    for i, v in np.ndenumerate(np.asarray(vals, dtype = object)):
+        try:
+            a[i] = float(v)
+        except ValueError:
+            if not allow_nan:
+                raise
+            a[i] = np.nan
+    return a
+
+def _cp_tenths(cps, allow_nan):
+    #int(float(cp) * 10) for each cp, as floats so nothing overflows
+    cps = _to_float_array(cps, allow_nan)
+    if not allow_nan and np.isnan(cps).any():
+        raise ValueError("cannot convert float NaN to integer")
+    return np.trunc(cps * 10), np.isinf(cps)
+
+def cp_to_winrate_array(cps, lookup_file = os.path.join(os.path.dirname(__file__), '../data/cp_winrate_lookup_simple.json'), allow_nan = False):
+    """cp_to_winrate() of every value of cps, returns a float64 array of the same shape"""
+    global cpLookup_simple_array
+    if cpLookup_simple_array is None:
+        cpLookup_simple_array = _cp_tenths_array(_load_cp_lookup_simple(lookup_file))
+    start, table = cpLookup_simple_array
+    tenths, _ = _cp_tenths(cps, allow_nan)
+    i = tenths - start
+    #nan and inf are never in range
+    found = (i >= 0) & (i < len(table))
+    ret = np.full(tenths.shape, np.nan)
+    ret[found] = table[i[found].astype(np.int64)]
+    return ret
+
+def cp_to_winrate_elo_array(cps, elos = 1500, lookup_file = os.path.join(os.path.dirname(__file__), '../data/cp_winrate_lookup.json'), allow_nan = False):
+    """cp_to_winrate_elo() of every value of cps with the matching value of elos (or one Elo for all of them)"""
+    global cpLookup_array
+    if cpLookup_array is None:
+        lookup = _load_cp_lookup(lookup_file)
+        tables = {elo // 100 : _cp_tenths_array(v) for elo, v in lookup.items() if elo % 100 == 0}
+        start = min(s for s, _ in tables.values())
+        end = max(s + len(t) for s, t in tables.values())
+        elo_start = min(tables)
+        a = np.full((max(tables) - elo_start + 1, end - start), np.nan)
+        for e, (s, t) in tables.items():
+            a[e - elo_start, s - start:s - start + len(t)] = t
+        cpLookup_array = (elo_start, start, a)
+    elo_start, start, table = cpLookup_array
+
+    tenths, cp_inf = _cp_tenths(cps, allow_nan)
+    with np.errstate(invalid = 'ignore'):
+        elo_hundreds = np.broadcast_to(np.floor_divide(_to_float_array(elos, True), 100), tenths.shape)
+    #An Elo that isn't a number is a ValueError in cp_to_winrate_elo(), unless the cp was inf
+    bad_elos = ~np.isfinite(elo_hundreds) & ~cp_inf
+    if not allow_nan and bad_elos.any():
+        elo = np.broadcast_to(np.asarray(elos, dtype = object), tenths.shape)[bad_elos][0]
+        #Raises the same error
+        int(float(elo)//100)
+    i = tenths - start
+    j = elo_hundreds - elo_start
+    found = (i >= 0) & (i < table.shape[1]) & (j >= 0) & (j < table.shape[0])
+    ret = np.full(tenths.shape, np.nan)
+    ret[found] = table[j[found].astype(np.int64), i[found].astype(np.int64)]
+    return ret
+
 def board_stats(input_board, board_fen = None):
     if isinstance(input_board, str):
         board = chess.Board(fen=input_board)
@@ -139,10 +231,10 @@ def board_stats(input_board, board_fen = None):
     else:
         board = input_board
         if board_fen is None:
-            board_fen = input_board.fen()
+            board_fen = fast_fen(input_board)
     board_str = board_fen.split(' ')[0]
     dat = {
-        'num_legal_moves' : len(list(board.legal_moves)),
+        'num_legal_moves' : count_legal_moves(board),
         'is_check' : int(board.is_check())
     }
     for name, p in pieces.items():
@@ -296,7 +388,7 @@ all_per_move_vals = [
 
 per_move_funcs = {
     'move_ply' : lambda x : x['i'],
-    'move' : lambda x : x['node'].move,
+    'move' : lambda x : x['move'],
     'cp' : lambda x : x['cp_str_last'],
     'cp_rel' : lambda x : x['cp_rel_str_last'],
     'cp_loss' : lambda x : f"{x['cp_loss']:.2f}",
@@ -311,15 +403,21 @@ per_move_funcs = {
     'active_elo' : lambda x : x['act_elo'],
     'opponent_elo' : lambda x : x['opp_elo'],
     'active_won' : lambda x : x['act_won'],
-    'is_capture' : lambda x : x['board'].is_capture(x['node'].move),
+    'is_capture' : lambda x : x['board'].is_capture(x['move']),
     'clock' : lambda x : x['clock_seconds'],
     'opp_clock' : lambda x : x['last_clock_seconds'],
     'clock_percent' : lambda x : '' if x['no_time'] else f"{1 - x['clock_seconds']/x['time_per_player']:.3f}",
     'opp_clock_percent' : lambda x : '' if x['no_time'] else f"{1 - x['last_clock_seconds']/x['time_per_player']:.3f}",
     'low_time' : lambda x : '' if x['no_time'] else x['clock_seconds'] < low_time_threshold,
     'board' : lambda x : x['fen'],
+    #Not in the CSVs, for gameToRows()
+    'board_masks' : lambda x : board_to_masks(x['board']),
+    'is_check' : lambda x : int(x['board'].is_check()),
 }
 
+#These need the winrates, which are only calculated once the whole game has been read
+winrate_per_move_vals = {'winrate', 'winrate_elo', 'winrate_loss', 'is_blunder_wr', 'opp_winrate'}
+
 full_csv_header = all_per_game_vals + all_per_move_vals + board_stats_header
 
 def gameToDF(input_game, per_game_vals = None, per_move_vals = None, with_board_stats = True, allow_non_sf = False):
@@ -334,54 +432,91 @@ def gameToDF(input_game, per_game_vals = None, per_move_vals = None, with_board_
     # a hack, but makes things consistant
     return pandas.read_csv(io.StringIO('\n'.join(csv_lines)), names = csv_header)
 
-def gameToCSVlines(input_game, per_game_vals = None, per_move_vals = None, with_board_stats = True, allow_non_sf = False):
+def gameToCSVlines(input_game, per_game_vals = None, per_move_vals = None, with_board_stats = True, allow_non_sf = False, lean = True):
     """Main function in created the datasets
 
     There's per game and per board stuff that needs to be calculated, with_board_stats is just a bunch of material counts.
 
     The different functions that are applied are simple and mostly stored in two dicts: per_game_funcs and per_move_funcs. per_move_funcs are more complicated and can depend on a bunch of stuff so they just get locals() as an input which is a hack, but it works. They all used to be in the local namespace this was just much simpler than rewriting all of them.
+
+    Games given as strings are read with LeanGame unless lean is False, games it can't read exactly like chess.pgn are parsed with chess.pgn instead, so the lines are the same either way.
+    """
+    return _gameToLines(input_game, per_game_vals, per_move_vals, with_board_stats, allow_non_sf, lean, False)
+
+def gameToRows(input_game, per_game_vals = None, per_move_vals = None, with_board_stats = True, allow_non_sf = False, lean = True):
+    """gameToCSVlines() but each line is a list of the values before they're made into text
+
+    This is for values that can't go in a CSV, like 'board_masks', the planes of the board's fenToVec() as ints.
     """
+    return _gameToLines(input_game, per_game_vals, per_move_vals, with_board_stats, allow_non_sf, lean, True)
+
+def _gameToLines(input_game, per_game_vals, per_move_vals, with_board_stats, allow_non_sf, lean, as_rows):
     #defaults to everything
+    if per_game_vals is None:
+        per_game_vals = all_per_game_vals
+    if per_move_vals is None:
+        per_move_vals = all_per_move_vals
+
     if isinstance(input_game, str):
+        if lean:
+            try:
+                game = LeanGame(input_game)
+                retVals = _pliesToCSVlines(game.headers, game, game.board, lambda : game.num_ply, per_game_vals, per_move_vals, with_board_stats, allow_non_sf, as_rows)
+                #The lines can stop before the end of the game, but num_ply needs the whole mainline to be legal
+                game.finish()
+                return retVals
+            except UnsupportedMovetext:
+                pass
         game = chess.pgn.read_game(io.StringIO(input_game))
     else:
         game = input_game
 
-    if per_game_vals is None:
-        per_game_vals = all_per_game_vals
-    if per_move_vals is None:
-        per_move_vals = all_per_move_vals
+    board = game.board()
+    return _pliesToCSVlines(game.headers, _mainlinePlies(game, board), board, lambda : len(list(game.mainline())), per_game_vals, per_move_vals, with_board_stats, allow_non_sf, as_rows)
+
+def _mainlinePlies(game, board):
+    #Same as iterating over a LeanGame
+    for node in game.mainline():
+        yield node.move, node.comment
+        board.push(node.move)
 
+def _pliesToCSVlines(headers, plies, board, num_ply, per_game_vals, per_move_vals, with_board_stats, allow_non_sf, as_rows = False):
     gameVals = []
     retVals = []
 
     for n in per_game_vals:
         try:
-            gameVals.append(per_game_funcs[n](game.headers))
+            gameVals.append(per_game_funcs[n](headers))
         except KeyError:
             if n == 'num_ply':
-                gameVals.append(len(list(game.mainline())))
+                gameVals.append(num_ply())
             else:
                 raise
 
-    gameVals = [str(v) for v in gameVals]
+    if not as_rows:
+        gameVals = [str(v) for v in gameVals]
 
-    white_won = game.headers['Result'] == '1-0'
-    no_winner = game.headers['Result'] not in  ['1-0', '0-1']
+    white_won = headers['Result'] == '1-0'
+    no_winner = headers['Result'] not in  ['1-0', '0-1']
 
-    time_per_player = time_control_to_secs(game.headers['TimeControl'])
+    time_per_player = time_control_to_secs(headers['TimeControl'])
 
-    board = game.board()
     cp_board = .1
     cp_str_last = '0.1'
     cp_rel_str_last = '0.1'
     no_time = False
     last_clock_seconds = -1
 
-    for i, node in enumerate(game.mainline()):
-        comment = node.comment.replace('\n', ' ')
+    plies_vals = []
+    cp_boards = []
+    cp_afters = []
+    act_elos = []
+
+    #plies pushes each move onto board when the next one is requested
+    for i, (move, comment) in enumerate(plies):
+        comment = comment.replace('\n', ' ')
         moveVals = []
-        fen = str(board.fen())
+        fen = fast_fen(board)
         is_white = fen.split(' ')[1] == 'w'
 
         try:
@@ -402,7 +537,7 @@ def gameToCSVlines(input_game, per_game_vals = None, per_move_vals = None, with_
                 else:
                     cp_str = 'nan'
                     cp_after = float('nan')
-                #raise AttributeError(f"weird comment found: {node.comment}")
+                #raise AttributeError(f"weird comment found: {comment}")
         else:
             if cp_str is not None:
                 try:
@@ -434,8 +569,8 @@ def gameToCSVlines(input_game, per_game_vals = None, per_move_vals = None, with_
             if last_clock_seconds < 0:
                 last_clock_seconds = clock_seconds
 
-        act_elo = game.headers['WhiteElo'] if is_white else game.headers['BlackElo']
-        opp_elo = game.headers['BlackElo'] if is_white else game.headers['WhiteElo']
+        act_elo = headers['WhiteElo'] if is_white else headers['BlackElo']
+        opp_elo = headers['BlackElo'] if is_white else headers['WhiteElo']
         if no_winner:
             act_won = False
         elif is_white:
@@ -445,28 +580,40 @@ def gameToCSVlines(input_game, per_game_vals = None, per_move_vals = None, with_
 
         cp_loss = cp_board - cp_after # CPs are all relative
 
-        winrate_current_elo = cp_to_winrate_elo(cp_board, elo = act_elo, allow_nan = allow_non_sf)
-        winrate_current = cp_to_winrate(cp_board, allow_nan = allow_non_sf)
-
-        winrate_loss = winrate_current -cp_to_winrate(cp_after, allow_nan = allow_non_sf)
-
-        winrate_opp = cp_to_winrate(-cp_board, allow_nan = allow_non_sf)
+        cp_boards.append(cp_board)
+        cp_afters.append(cp_after)
+        act_elos.append(act_elo)
 
+        #The winrate values are filled in after the loop
+        ply_locals = locals()
         for n in per_move_vals:
-            moveVals.append(per_move_funcs[n](locals()))
+            moveVals.append(None if n in winrate_per_move_vals else per_move_funcs[n](ply_locals))
 
         if with_board_stats:
             moveVals += [str(v) for k,v in sorted(board_stats(board, fen).items(), key = lambda x : x[0])]
 
-        board.push(node.move)
-
-        moveVals = [str(v) for v in moveVals]
-
-        retVals.append(','.join(gameVals + moveVals))
+        plies_vals.append(moveVals)
         cp_board = -1 * cp_after
         cp_str_last = cp_str
         cp_rel_str_last = cp_rel_str
         last_clock_seconds = clock_seconds
-    if len(retVals) < 1:
+    if len(plies_vals) < 1:
         raise NoStockfishEvals("No evals found in game")
+
+    #All the plies' winrates in one go
+    cp_boards = np.array(cp_boards)
+    winrates_current_elo = cp_to_winrate_elo_array(cp_boards, act_elos, allow_nan = allow_non_sf)
+    winrates_current, winrates_after, winrates_opp = cp_to_winrate_array([cp_boards, cp_afters, -cp_boards], allow_nan = allow_non_sf)
+    winrates_loss = winrates_current - winrates_after
+    winrate_indices = [j for j, n in enumerate(per_move_vals) if n in winrate_per_move_vals]
+
+    for moveVals, winrate_current, winrate_current_elo, winrate_loss, winrate_opp in zip(plies_vals, winrates_current, winrates_current_elo, winrates_loss, winrates_opp):
+        if winrate_indices:
+            ply_locals = locals()
+            for j in winrate_indices:
+                moveVals[j] = per_move_funcs[per_move_vals[j]](ply_locals)
+        if as_rows:
+            retVals.append(gameVals + moveVals)
+        else:
+            retVals.append(','.join(gameVals + [str(v) for v in moveVals]))
     return retVals
@@ -16,6 +16,7 @@ import chess.pgn
 import maia_chess_backend
 
 logging_delay = 30 # in seconds
+game_per_put = 50
 
 
 def main():
@@ -30,6 +31,10 @@ def main():
     #parser.add_argument('--debug', help='DEBUG MODE', default = False, action="store_true")
     #parser.add_argument('--readers', type=int, help='number of simultaneous reader running per inputfile', default = 24)
     parser.add_argument('--queueSize', type=int, help='Max number of games to cache', default = 1000)
+    parser.add_argument('--parquet', help='Write zstd Parquet files instead of bz2 CSVs, needs pyarrow', default = False, action="store_true")
+    parser.add_argument('--shard_games', type=int, help='Write resumable shards of this many games each, with a manifest, instead of one file', default = None)
+    parser.add_argument('--shards', help='Only make this range of shards, a:b, to split a file between machines', default = None)
+    parser.add_argument('--bz2_workers', type=int, help='number of threads decompressing the input, 1 to use bz2 directly', default = 1)
 
     args = parser.parse_args()
 
@@ -37,32 +42,46 @@ def main():
 
     os.makedirs(args.outputDir, exist_ok=True)
 
+    if args.shard_games is not None:
+        shard_range = None if args.shards is None else maia_chess_backend.parse_shard_range(args.shards)
+        maia_chess_backend.run_sharded_csv(args.input, args.outputDir, args.shard_games, args.pool, queue_size = args.queueSize, shard_range = shard_range, allow_non_sf = args.allow_non_sf, parquet = args.parquet, bz2_workers = args.bz2_workers)
+        return
+
     name = os.path.basename(args.input).split('.')[0]
-    outputName = os.path.join(args.outputDir, f"{name}.csv.bz2")
+    outputName = os.path.join(args.outputDir, f"{name}.parquet" if args.parquet else f"{name}.csv.bz2")
     #names[n] = (name, outputName)
 
     maia_chess_backend.printWithDate(f"Loading file: {name}")
     maia_chess_backend.printWithDate(f"Starting main loop")
 
     tstart = time.time()
-    with multiprocessing.Manager() as manager:
-        with multiprocessing.Pool(args.pool) as workers_pool, multiprocessing.Pool(3) as io_pool:
-            pgnReader, gameReader, writer, unproccessedQueue, resultsQueue = processPGN(args.input, name, outputName, args.queueSize, args.pool, args.allow_non_sf, manager, workers_pool, io_pool)
+    #The queues have to exist before the pools so their workers can use them
+    queues = make_queues(args.queueSize)
+    try:
+        with multiprocessing.Pool(args.pool, initializer = maia_chess_backend.register_shared_queues, initargs = (queues,)) as workers_pool, multiprocessing.Pool(3, initializer = maia_chess_backend.register_shared_queues, initargs = (queues,)) as io_pool:
+            pgnReader, gameReader, writer, unproccessedQueue, resultsQueue = processPGN(args.input, name, outputName, queues, args.pool, args.allow_non_sf, workers_pool, io_pool, bz2_workers = args.bz2_workers)
 
             maia_chess_backend.printWithDate(f"Done loading Queues in {humanize.naturaldelta(time.time() - tstart)}, waiting for reading to finish")
 
             cleanup(pgnReader, gameReader, writer)
+    finally:
+        for q in queues:
+            q.unlink()
 
-def processPGN(gamesPath, inputName, outputName, queueSize, poolSize, allow_non_sf, manager, workers_pool, io_pool):
-    unproccessedQueue = manager.Queue(queueSize)
-    resultsQueue = manager.Queue(queueSize)
+def make_queues(queueSize):
+    #Games are sent in batches of game_per_put, and their CSV lines come back the same way
+    max_batches = max(queueSize // game_per_put, 1)
+    return [maia_chess_backend.SharedMemoryQueue(maxsize = max_batches), maia_chess_backend.SharedMemoryQueue(maxsize = max_batches)]
+
+def processPGN(gamesPath, inputName, outputName, queues, poolSize, allow_non_sf, workers_pool, io_pool, bz2_workers = 1):
+    unproccessedQueue, resultsQueue = queues
 
     readers = []
     for _ in range(poolSize - 1):
         reader = workers_pool.apply_async(gamesConverter, (unproccessedQueue, resultsQueue, allow_non_sf))
         readers.append(reader)
     maia_chess_backend.printWithDate(f"{inputName} Started {len(readers)} readers", flush = True)
-    pgnReader = io_pool.apply_async(readerWorker, (gamesPath, unproccessedQueue, resultsQueue, inputName, len(readers)))
+    pgnReader = io_pool.apply_async(readerWorker, (gamesPath, unproccessedQueue, resultsQueue, inputName, len(readers), bz2_workers))
     maia_chess_backend.printWithDate(f"{inputName} loader created")
 
     writer = io_pool.apply_async(writerWorker, (outputName, resultsQueue, len(readers), inputName))
@@ -82,33 +101,41 @@ def gamesConverter(inputQueue, outputQueue, allow_non_sf):
             outputQueue.put('kill', True, 1000)
             break
         else:
-            try:
-                s = maia_chess_backend.gameToCSVlines(dat, allow_non_sf = allow_non_sf)
-            except maia_chess_backend.NoStockfishEvals:
-                pass
-            except:
-                maia_chess_backend.printWithDate('error:')
-                maia_chess_backend.printWithDate(dat)
-                maia_chess_backend.printWithDate(traceback.format_exc())
-                raise
-            else:
-                if len(s) > 0:
-                    lines = '\n'.join(s) + '\n'
-                    outputQueue.put(lines.encode('utf8'), True, 1000)
+            lines = []
+            for game_str in dat:
+                try:
+                    s = maia_chess_backend.gameToCSVlines(game_str, allow_non_sf = allow_non_sf)
+                except maia_chess_backend.NoStockfishEvals:
+                    pass
+                except:
+                    maia_chess_backend.printWithDate('error:')
+                    maia_chess_backend.printWithDate(game_str)
+                    maia_chess_backend.printWithDate(traceback.format_exc())
+                    raise
+                else:
+                    lines += s
+            if len(lines) > 0:
+                outputQueue.put(('\n'.join(lines) + '\n').encode('utf8'), True, 1000)
     maia_chess_backend.printWithDate("Received shutdown signal to Converter", flush = True)
 
-def readerWorker(inputPath, unproccessedQueue, resultsQueue, name, num_readers):
+def readerWorker(inputPath, unproccessedQueue, resultsQueue, name, num_readers, bz2_workers = 1):
     tstart = time.time()
-    gamesFile = maia_chess_backend.LightGamesFile(inputPath, just_games = True)
+    gamesFile = maia_chess_backend.LightGamesFile(inputPath, just_games = True, bz2_workers = bz2_workers)
     try:
         tLast = time.time()
+        games_bundle = []
         for i, (_, gs) in enumerate(gamesFile):
-            unproccessedQueue.put(gs, True, 1000)
+            games_bundle.append(gs)
+            if len(games_bundle) >= game_per_put:
+                unproccessedQueue.put(games_bundle, True, 1000)
+                games_bundle = []
             if i % 1000 == 0 and  time.time() - tLast > logging_delay:
                 tLast = time.time()
                 maia_chess_backend.printWithDate(f"{name} Loaded {i} games, input queue depth: {unproccessedQueue.qsize()}, ouput queue depth: {resultsQueue.qsize()}", flush = True)
     except (EOFError, StopIteration):
         pass
+    if len(games_bundle) > 0:
+        unproccessedQueue.put(games_bundle, True, 1000)
 
     maia_chess_backend.printWithDate(f"{name} Done loading Queue in {humanize.naturaldelta(time.time() - tstart)}, sending kills")
     for i in range(num_readers):
@@ -121,9 +148,8 @@ def writerWorker(outputFile, inputQueue, num_readers, name):
     num_kill_remaining = num_readers
     tstart = time.time()
     maia_chess_backend.printWithDate("Writer created")
-    with bz2.open(outputFile, 'wb') as f:
+    with maia_chess_backend.open_per_move_writer(outputFile, maia_chess_backend.full_csv_header) as f:
         maia_chess_backend.printWithDate(f"Created: {outputFile}")
-        f.write((','.join(maia_chess_backend.full_csv_header) + '\n').encode('utf8'))
         tLast = time.time()
         while True:
             try:
@@ -144,9 +170,9 @@ def writerWorker(outputFile, inputQueue, num_readers, name):
                 i += 1
                 if i % 1000 == 0 and  time.time() - tLast > logging_delay:
                     tLast = time.time()
-                    maia_chess_backend.printWithDate(f"{name} Written {i} games in {humanize.naturaldelta(time.time() - tstart)}, doing {(i + 1) /(time.time() - tstart):.0f} games a second", flush = True)
+                    maia_chess_backend.printWithDate(f"{name} Written {i} batches in {humanize.naturaldelta(time.time() - tstart)}, doing {(i + 1) * game_per_put /(time.time() - tstart):.0f} games a second", flush = True)
     maia_chess_backend.printWithDate("Received shutdown signal to writer")
-    maia_chess_backend.printWithDate(f"Done a total of {i} games in {humanize.naturaldelta(time.time() - tstart)}")
+    maia_chess_backend.printWithDate(f"Done a total of {i} batches in {humanize.naturaldelta(time.time() - tstart)}")
 
 def cleanup(pgnReaders, gameReaders, writers):
 
@@ -6,7 +6,6 @@ import os
 import os.path
 import multiprocessing
 import time
-import json
 import chess
 
 import numpy as np
@@ -37,10 +36,12 @@ mmap_columns = [
 
 target_columns =  mmap_columns + ['game_id', 'low_time', 'board', 'move']
 
+board_chunk_size = 100000
+
 def main():
     parser = argparse.ArgumentParser(description='Make mmapped version of csv', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('inputs', nargs = '+', help='input csv')
+    parser.add_argument('inputs', nargs = '+', help='input csv or parquet')
     parser.add_argument('outputDir', help='output dir of mmapped files')
     parser.add_argument('--nrows', type=int, help='number of rows to read in, FOR TESTING', default = None)
 
@@ -51,6 +52,11 @@ def main():
     parser.add_argument('--min_ply', type=int, help='min move ply to consider', default = 6)
 
     parser.add_argument('--nb_to_b_ratio', type=float, help='ratio fof blunders to non blunders in dataset', default = 1.5)
+    parser.add_argument('--unpacked_boards', help='Write the boards as (N, 17, 8, 8) bools instead of packed', default = False, action="store_true")
+    parser.add_argument('--in_memory', help='Read each input into a DataFrame instead of streaming it in chunks', default = False, action="store_true")
+    parser.add_argument('--num_buckets', type=int, help='number of files the rows are spilled to when streaming, each is read into memory at the end', default = maia_chess_backend.csv_num_buckets)
+    parser.add_argument('--seed', type=int, help='seed of the shuffling and sampling when streaming', default = None)
+    parser.add_argument('--pool', type=int, help='number of inputs to process at once', default = 32)
 
 
     #parser.add_argument('split_column', help='what to split the csvs on, i.e. is_blunder')
@@ -61,25 +67,51 @@ def main():
 
     maia_chess_backend.printWithDate(f"Starting mmap of {', '.join(args.inputs)} writing to {args.outputDir} with {', '.join(mmap_columns)}")
 
-    with  multiprocessing.Pool(32) as pool:
+    with  multiprocessing.Pool(args.pool) as pool:
         pool.starmap(run_path, [(p, args) for p in args.inputs])
     maia_chess_backend.printWithDate("Done")
 
 def run_path(path, args):
     #helper for multiproc
     try:
+        if not args.in_memory:
+            maia_chess_backend.csv_to_mmaps(
+                path,
+                args.outputDir,
+                nb_to_b_ratio = args.nb_to_b_ratio,
+                packed_boards = not args.unpacked_boards,
+                seed = args.seed,
+                nrows = args.nrows,
+                num_buckets = args.num_buckets,
+                min_ply = args.min_ply,
+                min_elo = args.min_elo,
+                max_elo = args.max_elo,
+                allow_low_time = args.allow_low_time,
+                allow_negative_loss = args.allow_negative_loss,
+            )
+            return
         mmap_csv(
                 path,
-                load_csv(path, args.nrows),
+                load_csv(path, args.nrows, filters = row_filters(args)),
                 args.outputDir,
                 args,
             )
     except EOFError:
         maia_chess_backend.printWithDate(f"EOF error in: {path}")
 
-def load_csv(target_path, nrows):
+def row_filters(args):
+    #The same as the filtering in mmap_csv(), for Parquet these skip the row groups with nothing we need
+    return maia_chess_backend.mmap_row_filters(
+        min_ply = args.min_ply,
+        min_elo = args.min_elo,
+        max_elo = args.max_elo,
+        allow_low_time = args.allow_low_time,
+        allow_negative_loss = args.allow_negative_loss,
+        )
+
+def load_csv(target_path, nrows, filters = None):
     maia_chess_backend.printWithDate(f"Loading: {target_path}", flush = True)
-    return pandas.read_csv(target_path, usecols=target_columns, nrows = nrows)
+    return maia_chess_backend.read_per_move(target_path, columns = target_columns, filters = filters, nrows = nrows)
 
 def mmap_csv(target_path, df, outputDir, args):
     maia_chess_backend.printWithDate(f"Loading: {target_path}")
@@ -121,9 +153,9 @@ def mmap_csv(target_path, df, outputDir, args):
     maia_chess_backend.printWithDate(f"Starting mmaping")
 
     os.makedirs(outputDir, exist_ok = True)
-    make_df_mmaps(df_blunder, name, os.path.join(outputDir, name, 'blunder'))
+    make_df_mmaps(df_blunder, name, os.path.join(outputDir, name, 'blunder'), packed_boards = not args.unpacked_boards)
     del df_blunder
-    make_df_mmaps(df_non_blunder, name, os.path.join(outputDir, name, 'nonblunder'))
+    make_df_mmaps(df_non_blunder, name, os.path.join(outputDir, name, 'nonblunder'), packed_boards = not args.unpacked_boards)
 
 def make_var_mmap(y_name, outputPath, mmaps, df):
     a_c = df[y_name].values
@@ -139,6 +171,19 @@ def make_var_mmap(y_name, outputPath, mmaps, df):
             )
     mmaps[y_name][:] = a_c[:]
 
+def make_packed_board_mmap(outputPath, mmaps, df):
+    fens = df['board'].values
+    mmap_vec = np.memmap(
+        os.path.join(outputPath, f"board_packed+{len(df)}.mm"),
+        dtype=maia_chess_backend.packed_board_dtype,
+        mode='w+',
+        shape=(len(df),),
+        )
+    #The unpacked boards are 11 times larger so only a chunk is made at a time
+    for start in range(0, len(df), board_chunk_size):
+        mmap_vec[start:start + board_chunk_size] = maia_chess_backend.vecs_to_packed(maia_chess_backend.fens_to_array(fens[start:start + board_chunk_size]))
+    mmaps['board'] = mmap_vec
+
 def make_board_mmap(outputPath, mmaps, df):
     b_sample_shape = maia_chess_backend.fenToVec(chess.Board().fen()).shape
 
@@ -148,9 +193,7 @@ def make_board_mmap(outputPath, mmaps, df):
         mode='w+',
         shape=(len(df), b_sample_shape[0], b_sample_shape[1], b_sample_shape[2]),
         )
-    for i, (_, row) in enumerate(df.iterrows()):
-        mmap_vec[i, :] = maia_chess_backend.fenToVec(row['board'])[:]
-    #a_boards = np.stack(pool.map(maia_chess_backend.fenToVec, df['board']))
+    maia_chess_backend.fens_to_array(df['board'].values, out = mmap_vec)
     mmaps['board'] = mmap_vec
 
 def make_move_mmap(outputPath, mmaps, df):
@@ -164,13 +207,9 @@ def make_move_mmap(outputPath, mmaps, df):
     mmaps['move'][:] = a_moves[:]
 
 def make_game_id_mmap(outputPath, mmaps, df):
-    game_ids = set(df['game_id'])
-    game_ids_dict = {i : g_id for i, g_id in enumerate(game_ids)}
-    game_ids_reverse_dict = {g_id : i for i, g_id in game_ids_dict.items()}
-    with open(os.path.join(outputPath, "game_id_lookup.json"), 'w') as f:
-        json.dump(game_ids_dict, f, indent=2)
+    game_ids, a_c = np.unique(df['game_id'].astype(str).values, return_inverse = True)
+    game_id_table = maia_chess_backend.write_string_table(outputPath, 'game_id', game_ids.tolist())
 
-    a_c = df['game_id'].apply(lambda x : game_ids_reverse_dict[x]).values
     a_c = a_c.astype(np.long)
     mmaps['game_id'] = np.memmap(
             os.path.join(outputPath, f"game_id+{a_c.dtype}+{a_c.shape[0]}.mm"),
@@ -179,7 +218,9 @@ def make_game_id_mmap(outputPath, mmaps, df):
             shape=a_c.shape,
             )
     mmaps['game_id'][:] = a_c[:]
-def make_df_mmaps(df, name, output_dir):
+    return game_id_table
+
+def make_df_mmaps(df, name, output_dir, packed_boards = True):
     os.makedirs(output_dir, exist_ok = True)
 
     mmaps = {}
@@ -188,13 +229,20 @@ def make_df_mmaps(df, name, output_dir):
         make_var_mmap(y_name, output_dir, mmaps, df)
         #print(y_name, end = ' ', flush = True)
 
-    make_game_id_mmap(output_dir, mmaps, df)
+    game_id_table = make_game_id_mmap(output_dir, mmaps, df)
 
     maia_chess_backend.printWithDate(f"Making move array mmaps for: {name}", flush = True)
     make_move_mmap(output_dir, mmaps, df)
 
     maia_chess_backend.printWithDate(f"Making boards array mmaps for: {name}", flush = True)
-    make_board_mmap(output_dir, mmaps, df)
+    if packed_boards:
+        make_packed_board_mmap(output_dir, mmaps, df)
+    else:
+        make_board_mmap(output_dir, mmaps, df)
+
+    for mmap in mmaps.values():
+        mmap.flush()
+    maia_chess_backend.write_mmap_manifest(output_dir, len(df), [(m.filename, m.dtype, m.shape) for m in mmaps.values()], string_tables = {'game_id' : game_id_table})
 
 
 if __name__ == '__main__':
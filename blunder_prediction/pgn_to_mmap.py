@@ -0,0 +1,53 @@
+import maia_chess_backend
+
+import argparse
+import multiprocessing
+
+def main():
+    parser = argparse.ArgumentParser(description='Make the mmaps mmap_csv.py makes directly from PGNs with stockfish annotations, without the CSVs', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('inputs', nargs = '+', help='input PGNs')
+    parser.add_argument('outputDir', help='output dir of mmapped files')
+
+    parser.add_argument('--pool', type=int, help='number of processes converting games', default = 32)
+    parser.add_argument('--games_per_batch', type=int, help='number of games sent to a process at once', default = 200)
+    parser.add_argument('--bz2_workers', type=int, help='number of threads decompressing the input', default = None)
+    parser.add_argument('--seed', type=int, help='seed of the shuffling and sampling', default = None)
+
+    parser.add_argument('--min_elo', type=int, help='min active elo', default = 1000)
+    parser.add_argument('--max_elo', type=int, help='max active elo', default = 4000)
+    parser.add_argument('--allow_negative_loss', help='allow winrate losses below 0', default = False, action="store_true")
+    parser.add_argument('--allow_low_time', help='Include low time moves', default = False, action="store_true")
+    parser.add_argument('--allow_non_sf', help='Allow games with no stockfish info', default = False, action="store_true")
+    parser.add_argument('--min_ply', type=int, help='min move ply to consider', default = 6)
+
+    parser.add_argument('--nb_to_b_ratio', type=float, help='ratio fof blunders to non blunders in dataset', default = 1.5)
+    parser.add_argument('--unpacked_boards', help='Write the boards as (N, 17, 8, 8) bools instead of packed', default = False, action="store_true")
+
+    args = parser.parse_args()
+
+    maia_chess_backend.printWithDate(f"Starting mmap of {', '.join(args.inputs)} writing to {args.outputDir} with {', '.join(maia_chess_backend.blunder_mmap_columns)}")
+
+    with multiprocessing.Pool(args.pool) as pool:
+        for path in args.inputs:
+            maia_chess_backend.pgn_to_mmaps(
+                path,
+                args.outputDir,
+                pool,
+                args.pool,
+                games_per_batch = args.games_per_batch,
+                nb_to_b_ratio = args.nb_to_b_ratio,
+                seed = args.seed,
+                bz2_workers = args.bz2_workers,
+                packed_boards = not args.unpacked_boards,
+                min_ply = args.min_ply,
+                min_elo = args.min_elo,
+                max_elo = args.max_elo,
+                allow_low_time = args.allow_low_time,
+                allow_negative_loss = args.allow_negative_loss,
+                allow_non_sf = args.allow_non_sf,
+            )
+    maia_chess_backend.printWithDate("Done")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import maia_chess_backend
+import maia_chess_backend.torch
+
+import argparse
+import os.path
+import time
+
+import humanize
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a blunder model\'s predictions for every board of mmaps or per move CSVs/Parquets', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('model', help='model dir, with the net-*.pt saves')
+    parser.add_argument('inputs', nargs = '+', help='mmaps dirs, like a month or all of input_train, or per move CSVs/Parquets')
+
+    parser.add_argument('--output_name', help='name of the predictions column, the default is pred_ and the model\'s name', default = None)
+    parser.add_argument('--output_dir', help='where the CSVs\' predictions are written, the default is next to them, mmaps\' are always a column of them', default = None)
+    parser.add_argument('--batch_size', type=int, help='boards per batch', default = maia_chess_backend.torch.inference_batch_size)
+    parser.add_argument('--workers', type=int, help='number of processes decoding the mmaps\' boards, CSVs only use one', default = 4)
+    parser.add_argument('--prefetch_factor', type=int, help='batches each worker decodes ahead', default = 4)
+    parser.add_argument('--compile', choices = ['none', 'compile', 'trace'], help='run the model with torch.compile() or as TorchScript', default = 'none')
+    parser.add_argument('--device', help='device to run the model on, like cpu or cuda:1, the default is cuda if there is a GPU', default = None)
+    parser.add_argument('--nrows', type=int, help='number of rows of the CSVs to read in, FOR TESTING', default = None)
+
+    args = parser.parse_args()
+
+    model = maia_chess_backend.torch.ModelWrapper(args.model, device = args.device)
+    model.compile(args.compile)
+    output_name = args.output_name
+    if output_name is None:
+        #The column's name is the start of its file name
+        output_name = 'pred_' + model.name.replace('+', '_').replace('.', '_')
+    maia_chess_backend.printWithDate(f"Predicting with {model} from {model.newest_save} on {model.device} as {output_name}")
+
+    tstart = time.time()
+    num_boards = 0
+    for path in args.inputs:
+        if os.path.isfile(path):
+            num_boards += maia_chess_backend.torch.predict_per_move(
+                    model,
+                    path,
+                    output_name,
+                    output_dir = args.output_dir,
+                    batch_size = args.batch_size,
+                    nrows = args.nrows,
+                    prefetch_factor = args.prefetch_factor,
+                    )
+        else:
+            for target_dir in maia_chess_backend.torch.mmap_dirs(path):
+                num_boards += maia_chess_backend.torch.predict_mmaps(
+                    model,
+                    target_dir,
+                    output_name,
+                    batch_size = args.batch_size,
+                    num_workers = args.workers,
+                    prefetch_factor = args.prefetch_factor,
+                    )
+    maia_chess_backend.printWithDate(f"Done {num_boards} boards in {humanize.naturaldelta(time.time() - tstart)}, {num_boards / (time.time() - tstart):.0f} boards/second")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for running a blunder model over whole datasets, on the CPU
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+from maia_chess_backend.csv_mmaps import csv_to_mmaps
+from maia_chess_backend.fen_to_vec import fenToVec, arrays_to_fens, packed_to_vecs
+from maia_chess_backend.game_mmaps import open_mmap_column
+from test_prefetch_loader import random_month
+
+MODEL_CONFIG = {
+    'type': 'leela',
+    'channels': 8,
+    'blocks': 1,
+    'inputs': ['cp_rel', 'move_ply'],
+    'outputs': ['is_blunder_wr'],
+}
+
+
+@unittest.skipIf(torch is None, "needs torch")
+class TestBatchInference(unittest.TestCase):
+    """Test cases for predict_mmaps and predict_per_move."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Save a small random model and make a month of mmaps."""
+        import maia_chess_backend.torch
+        cls.mt = maia_chess_backend.torch
+        cls.tmp_dir = tempfile.mkdtemp()
+        torch.manual_seed(0)
+        model_dir = os.path.join(cls.tmp_dir, 'model')
+        os.makedirs(model_dir)
+        cls.mt.NetFromConfigNew(MODEL_CONFIG).save(os.path.join(model_dir, 'net-1.pt'))
+        cls.model = cls.mt.ModelWrapper(model_dir, device='cpu')
+        cls.csv_path = os.path.join(cls.tmp_dir, '2019-01.csv.bz2')
+        random_month(cls.csv_path, 0)
+        cls.mmaps_dir = os.path.join(cls.tmp_dir, 'mmaps')
+        csv_to_mmaps(cls.csv_path, cls.mmaps_dir, seed=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the model and mmaps."""
+        shutil.rmtree(cls.tmp_dir)
+
+    def expected(self, fens):
+        """The net's output for each FEN, one board at a time like the old run_batch."""
+        net = self.model.net
+        extra_x = {n: self.model.defaults_dict[n] * torch.ones([len(fens)]) for n in self.model.extras}
+        x = torch.stack([torch.from_numpy(fenToVec(f)).float() for f in fens])
+        with torch.no_grad():
+            return net.dict_forward(x, extra_x=extra_x)['is_blunder_wr'].numpy().reshape(-1)
+
+    def test_predict_mmaps(self):
+        """Every board of the mmaps is predicted in order, with DataLoader workers."""
+        num_boards = self.mt.predict_mmaps(self.model, self.mmaps_dir + '/2019-01/blunder', 'pred', batch_size=100, num_workers=2)
+        target_dir = self.mmaps_dir + '/2019-01/blunder'
+        preds = open_mmap_column(target_dir, 'pred')
+        self.assertEqual(len(preds), num_boards)
+        fens = arrays_to_fens(packed_to_vecs(open_mmap_column(target_dir, 'board_packed')))
+        np.testing.assert_allclose(preds, self.expected(fens), atol=1e-5)
+        np.testing.assert_allclose(self.model.run_batch(fens[:10]).reshape(-1), preds[:10], atol=1e-5)
+
+    def test_predict_per_move(self):
+        """Every row of a per move CSV is predicted in order."""
+        output_dir = os.path.join(self.tmp_dir, 'csv_preds')
+        os.makedirs(output_dir)
+        num_boards = self.mt.predict_per_move(self.model, self.csv_path, 'pred', output_dir=output_dir, batch_size=100)
+        fens = pandas.read_csv(self.csv_path)['board'].tolist()
+        self.assertEqual(num_boards, len(fens))
+        preds = np.fromfile(os.path.join(output_dir, f"2019-01-pred+float32+{num_boards}.mm"), dtype='<f4')
+        np.testing.assert_allclose(preds, self.expected(fens), atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
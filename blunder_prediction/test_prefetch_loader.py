@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Smoke tests for the training batch loaders with DataLoader workers, on the CPU
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import chess
+import pandas
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+from maia_chess_backend.csv_mmaps import csv_to_mmaps, mmap_csv_columns
+from maia_chess_backend.fen_to_vec import arrays_to_fens
+from maia_chess_backend.game_mmaps import blunder_mmap_columns
+
+BATCH_SIZE = 64
+
+
+def random_month(path, seed, num_games=30, max_ply=40):
+    """A per move CSV of random games that passes the mmap filters, returns the positions as FEN prefixes."""
+    rng = random.Random(seed)
+    rows = []
+    for g in range(num_games):
+        board = chess.Board()
+        for ply in range(max_ply):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            row = {c: rng.random() for c in blunder_mmap_columns}
+            row.update(move_ply=ply, is_blunder_wr=rng.random() < 0.3, active_elo=1500, opponent_elo=1500,
+                       winrate_loss=rng.random() + 0.01, game_id=f"{seed}-{g}", low_time=False,
+                       board=board.fen(), move=move.uci())
+            rows.append(row)
+            board.push(move)
+    df = pandas.DataFrame(rows)[mmap_csv_columns]
+    df.to_csv(path, index=False)
+    return {fen_prefix(f) for f in df['board']}
+
+
+def fen_prefix(fen):
+    # The boards only keep the pieces, side to move and castling
+    return ' '.join(fen.split(' ')[:3])
+
+
+@unittest.skipIf(torch is None, "needs torch")
+class TestPrefetchLoader(unittest.TestCase):
+    """Test cases for PrefetchLoader on the CPU."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Make two months of mmaps from random games."""
+        import maia_chess_backend.torch
+        cls.mt = maia_chess_backend.torch
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.mmaps_dir = os.path.join(cls.tmp_dir, 'mmaps')
+        cls.fens = set()
+        for i in range(2):
+            csv_path = os.path.join(cls.tmp_dir, f"2019-0{i + 1}.csv.bz2")
+            cls.fens |= random_month(csv_path, i)
+            csv_to_mmaps(csv_path, cls.mmaps_dir, seed=i)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the mmaps."""
+        shutil.rmtree(cls.tmp_dir)
+
+    def check_batches(self, loader, num_batches=12):
+        batches = [next(loader) for _ in range(num_batches)]
+        for x, y in batches:
+            self.assertEqual(x.dtype, torch.float32)
+            self.assertEqual(tuple(x.shape), (BATCH_SIZE, 17, 8, 8))
+            # Half blunders then half non blunders
+            expected = torch.tensor([1] * (BATCH_SIZE // 2) + [0] * (BATCH_SIZE // 2))
+            self.assertTrue(torch.equal(y['is_blunder_wr'].long(), expected))
+            self.assertLessEqual({fen_prefix(f) for f in arrays_to_fens(x.bool())}, self.fens)
+        return batches
+
+    def test_iter_loader_workers(self):
+        """MmapIterLoaderMap batches come through two workers, which don't repeat each other."""
+        dataset = self.mt.MmapIterLoaderMap(self.mmaps_dir, ['is_blunder_wr'], BATCH_SIZE, device='cpu')
+        loader = self.mt.PrefetchLoader(dataset, num_workers=2, prefetch_factor=2)
+        self.assertEqual(loader.num_blunders, dataset.num_blunders)
+        batches = self.check_batches(loader)
+        for (x_a, _), (x_b, _) in zip(batches, batches[1:]):
+            self.assertFalse(torch.equal(x_a, x_b))
+
+    def test_shuffle_loader_workers(self):
+        """MmapShuffleLoaderMap batches come through two workers."""
+        dataset = self.mt.MmapShuffleLoaderMap(self.mmaps_dir, ['is_blunder_wr'], BATCH_SIZE, block_size=4, window_size=64, seed=1, device='cpu')
+        self.check_batches(self.mt.PrefetchLoader(dataset, num_workers=2, prefetch_factor=2))
+
+    def test_direct_batches(self):
+        """The dataset's own next() and PrefetchLoader without workers make CPU batches too."""
+        dataset = self.mt.MmapIterLoaderMap(self.mmaps_dir, ['is_blunder_wr'], BATCH_SIZE, device='cpu')
+        self.check_batches(dataset)
+        self.check_batches(self.mt.PrefetchLoader(dataset, num_workers=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
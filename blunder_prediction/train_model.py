@@ -1,6 +1,8 @@
 import os
 import os.path
 import argparse
+import contextlib
+import functools
 import time
 
 import numpy as np
@@ -32,24 +34,38 @@ def main():
     os.makedirs(outputDir, exist_ok = True)
     tensorboard_writer = maia_chess_backend.torch.TB_wrapper(name, log_dir = os.path.join('runs', collection_name))
 
-    with torch.cuda.device(config['device']):
-        maia_chess_backend.printWithDate(f"Loading model:{config['model']}")
+    #device can be a GPU index, like older configs, or any torch device, like cpu
+    device = maia_chess_backend.torch.config_device(config.get('device', None))
+    if device == 'pinned':
+        raise ValueError("The model can't be on pinned memory, use cpu or cuda")
+    with torch.cuda.device(device) if device.type == 'cuda' else contextlib.nullcontext():
+        maia_chess_backend.printWithDate(f"Loading model:{config['model']} on {device}")
         net = maia_chess_backend.torch.NetFromConfigNew(config['model'])
 
-        train_loader, test_loader, val_loader = setupLoaders(config)
+        train_loader, test_loader, val_loader = setupLoaders(config, device)
         try:
-            train_loop(net, config, train_loader, test_loader, val_loader, tensorboard_writer, outputDir)
+            train_loop(net, config, train_loader, test_loader, val_loader, tensorboard_writer, outputDir, device)
         except KeyboardInterrupt:
             net.save(os.path.join(outputDir, f"net-final.pt"))
 
     maia_chess_backend.printWithDate(f"Done everything in {humanize.naturaldelta(time.time() - tstart)}, exiting")
 
 @maia_chess_backend.profile_helper
-def setupLoaders(config):
+def setupLoaders(config, device = None):
     if config['training'].get('old_loader', None):
+        if device is not None and device.type != 'cuda':
+            raise ValueError(f"old_loader only makes CUDA batches, not {device}")
         loader_type = maia_chess_backend.torch.MmapIterLoaderMap_old
+    elif config['training'].get('shuffle_rows', None):
+        #Batches of rows from all the months instead of slices of one
+        loader_type = functools.partial(
+                    maia_chess_backend.torch.MmapShuffleLoaderMap,
+                    block_size = config['training'].get('shuffle_block_size', maia_chess_backend.shuffle_block_size),
+                    window_size = config['training'].get('shuffle_window_size', maia_chess_backend.shuffle_window_size),
+                    device = device,
+                    )
     else:
-        loader_type = maia_chess_backend.torch.MmapIterLoaderMap
+        loader_type = functools.partial(maia_chess_backend.torch.MmapIterLoaderMap, device = device)
     mmap_loader_train = loader_type(
                     config['dataset']['input_train'],
                     config['model']['outputs'] + config['model'].get('inputs', []),
@@ -72,15 +88,39 @@ def setupLoaders(config):
                     config['training']['batch_size'],
                     max_samples = config['training'].get('max_samples', None),
                     linear_mode = True,
+                    device = device,
+                    )
+
+    #The training and testing batches are made by worker processes ahead of
+    #time, the validation ones stay in order so they're made as needed. On
+    #the CPU receiving and converting a batch from a worker takes longer than
+    #making it (see loader_speed.py), so by default they're only used with CUDA
+    default_workers = 4 if maia_chess_backend.torch.is_cuda_device(device or maia_chess_backend.torch.default_device()) else 0
+    num_workers = config['training'].get('loader_workers', default_workers)
+    if num_workers > 0 and not config['training'].get('old_loader', None):
+        mmap_loader_train = maia_chess_backend.torch.PrefetchLoader(
+                    mmap_loader_train,
+                    num_workers = num_workers,
+                    prefetch_factor = config['training'].get('prefetch_factor', 4),
+                    )
+        mmap_loader_test = maia_chess_backend.torch.PrefetchLoader(
+                    mmap_loader_test,
+                    num_workers = max(1, num_workers // 4),
+                    prefetch_factor = config['training'].get('prefetch_factor', 4),
                     )
 
     return mmap_loader_train, mmap_loader_test, mmap_loader_val
 
 @maia_chess_backend.profile_helper
-def train_loop(net, config, train_loader, test_loader, val_loader, tensorboard_writer, outputDir):
+def train_loop(net, config, train_loader, test_loader, val_loader, tensorboard_writer, outputDir, device = None):
     maia_chess_backend.printWithDate(f"Starting training loop")
-    if torch.cuda.is_available():
-        net.cuda()
+    if device is None:
+        device = maia_chess_backend.torch.config_device()
+    if device.type == 'cuda':
+        #NetBaseNew.cuda() also moves the output layers
+        net.cuda(device)
+    else:
+        net.cpu()
 
     lastFewAcs = []
 
@@ -1,3 +1,6 @@
+import sys
+sys.path.append("../move_prediction")
+
 import json
 import argparse
 import time
@@ -16,6 +19,7 @@ import chess
 import chess.pgn
 
 import haibrid_chess_utils
+import maia_chess_backend
 
 import haibrid_chess_utils.pickle4reducer
 ctx = multiprocessing.get_context()
@@ -100,8 +104,7 @@ def processTarget(target, outputDir, nrows, queue_out):
     tname = os.path.basename(target).split('.')[0]
     haibrid_chess_utils.printWithDate(f"Starting on {tname}", colour = 'green', flush = True)
 
-    with bz2.open(target, 'rt') as f:
-        df = pandas.read_csv(f, index_col = None, nrows = nrows, usecols = ['cp_rel', 'active_elo' , 'opponent_elo', 'clock', 'opp_clock', 'move_ply', 'type', 'low_time', 'active_won'])
+    df = maia_chess_backend.read_per_move(target, nrows = nrows, columns = ['cp_rel', 'active_elo' , 'opponent_elo', 'clock', 'opp_clock', 'move_ply', 'type', 'low_time', 'active_won'])
 
     haibrid_chess_utils.printWithDate(f"{tname} loaded: {len(df)} lines in {humanize.naturaldelta(time.time() - tstart)}", colour = 'green', flush = True)
 
@@ -131,7 +134,7 @@ def processTarget(target, outputDir, nrows, queue_out):
 def main():
     parser = argparse.ArgumentParser(description='Run groupby on the csv files', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('inputs', nargs = '+', help='input CSVs')
+    parser.add_argument('inputs', nargs = '+', help='input CSVs or Parquet files')
     parser.add_argument('outputDir', help='output dir name')
 
     parser.add_argument('--pool', type=int, help='number of simultaneous jobs running', default = 32)
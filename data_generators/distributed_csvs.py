@@ -0,0 +1,52 @@
+import sys
+sys.path.append("../move_prediction")
+
+import maia_chess_backend
+
+import argparse
+import os
+
+@maia_chess_backend.logged_main
+def main():
+    parser = argparse.ArgumentParser(description='Make the month CSVs as shards on several machines sharing outputDir, see run_distributed.sh', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest = 'command')
+    subparsers.required = True
+
+    plan_parser = subparsers.add_parser('plan', help='index the inputs and write their tasks to the queue', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    plan_parser.add_argument('inputs', nargs = '+', help='input PGNs')
+    plan_parser.add_argument('outputDir', help='output CSVs dir, shared by all the machines')
+    plan_parser.add_argument('--shard_games', type=int, help='number of games per shard', default = 200000)
+    plan_parser.add_argument('--shards_per_task', type=int, help='number of shards a worker claims at once', default = 5)
+    plan_parser.add_argument('--allow_non_sf', help='Allow games with no stockfish info', default = False, action="store_true")
+    plan_parser.add_argument('--parquet', help='Write zstd Parquet files instead of bz2 CSVs, needs pyarrow', default = False, action="store_true")
+    plan_parser.add_argument('--pool', type=int, help='number of inputs to index at once', default = 8)
+    plan_parser.add_argument('--bz2_workers', type=int, help='number of threads decompressing each input', default = None)
+
+    for command, help_str in [('work', 'claim and run tasks until they are all done'), ('local', 'run several workers on this machine')]:
+        p = subparsers.add_parser(command, help=help_str, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+        p.add_argument('outputDir', help='output CSVs dir with the queue')
+        p.add_argument('--pool', type=int, help='number of simultaneous jobs running per worker', default = 30)
+        p.add_argument('--queueSize', type=int, help='Max number of games to cache', default = 1000)
+        p.add_argument('--bz2_workers', type=int, help='number of threads decompressing the input', default = None)
+        if command == 'local':
+            p.add_argument('--workers', type=int, help='number of workers', default = 2)
+        else:
+            p.add_argument('--max_tasks', type=int, help='stop after this many tasks', default = None)
+
+    status_parser = subparsers.add_parser('status', help='count the tasks by state')
+    status_parser.add_argument('outputDir', help='output CSVs dir with the queue')
+
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        os.makedirs(args.outputDir, exist_ok=True)
+        maia_chess_backend.printWithDate(f"Planning {len(args.inputs)} inputs into {args.outputDir}")
+        maia_chess_backend.ShardWorkQueue.create(args.inputs, args.outputDir, args.shard_games, args.shards_per_task, allow_non_sf = args.allow_non_sf, parquet = args.parquet, pool_size = args.pool, bz2_workers = args.bz2_workers)
+    elif args.command == 'work':
+        maia_chess_backend.work_loop(args.outputDir, args.pool, queue_size = args.queueSize, bz2_workers = args.bz2_workers, max_tasks = args.max_tasks)
+    elif args.command == 'local':
+        maia_chess_backend.run_local_workers(args.outputDir, args.workers, args.pool, queue_size = args.queueSize, bz2_workers = args.bz2_workers)
+    print(maia_chess_backend.ShardWorkQueue(args.outputDir).status())
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@ def main():
     parser.add_argument('targets', nargs='+', help='target files')
     parser.add_argument('--remove_bullet', action='store_true', help='Remove bullet and ultrabullet games')
     parser.add_argument('--remove_low_time', action='store_true', help='Remove low time moves from games')
+    parser.add_argument('--index', action='store_true', help='Select games with the game index sidecar (built if missing) instead of parsing every game')
+    parser.add_argument('--bz2_workers', type=int, help='number of threads decompressing the input', default = None)
 
     args = parser.parse_args()
     gamesWritten = 0
@@ -22,30 +24,31 @@ def main():
     with bz2.open(args.output, 'wt') as f:
         for num_files, target in enumerate(sorted(args.targets)):
             print(f"{num_files} reading: {target}")
-            Games = maia_chess_backend.LightGamesFile(target, parseMoves = False)
-            for i, (dat, lines) in enumerate(Games):
-                try:
-                    whiteELO = int(dat['WhiteElo'])
-                    BlackELO = int(dat['BlackElo'])
-                except ValueError:
-                    continue
-                if whiteELO > args.eloMax or whiteELO <= args.eloMin:
-                    continue
-                elif BlackELO > args.eloMax or BlackELO <= args.eloMin:
-                    continue
-                elif dat['Result']  not in ['1-0', '0-1', '1/2-1/2']:
-                    continue
-                elif args.remove_bullet and 'Bullet' in dat['Event']:
-                    continue
+            results = ['1-0', '0-1', '1/2-1/2']
+            exclude_event = 'Bullet' if args.remove_bullet else None
+            if args.index:
+                Games = maia_chess_backend.LightGamesFile(target, parseMoves = False, bz2_workers = args.bz2_workers)
+                games = Games.filterGames(min_elo = args.eloMin, max_elo = args.eloMax, results = results, exclude_event = exclude_event)
+            else:
+                #Only the headers are looked at, games are filtered in bulk
+                games = ((dat, lines.decode('utf8')) for dat, lines in maia_chess_backend.scan_pgn(
+                        target,
+                        maia_chess_backend.elo_range_filter(args.eloMin, args.eloMax, results = results, exclude_event = exclude_event),
+                        bz2_workers = args.bz2_workers,
+                        with_headers = False,
+                        ))
+            #Only the games that pass the filters are seen, so this counts what's written from the file
+            fileWritten = 0
+            for dat, lines in games:
+                if args.remove_low_time:
+                    f.write(maia_chess_backend.remove_low_time(lines))
                 else:
-                    if args.remove_low_time:
-                        f.write(maia_chess_backend.remove_low_time(lines))
-                    else:
-                        f.write(lines)
-                    gamesWritten += 1
-                if i % 1000 == 0:
-                    print(f"{i}: written {gamesWritten} files {num_files}: {target}".ljust(79), end = '\r')
-            print(f"Done: {target} {i}".ljust(79))
+                    f.write(lines)
+                fileWritten += 1
+                gamesWritten += 1
+                if fileWritten % 1000 == 0:
+                    print(f"{fileWritten}: written {gamesWritten} files {num_files}: {target}".ljust(79), end = '\r')
+            print(f"Done: {target} {fileWritten}".ljust(79))
 
 if __name__ == '__main__':
     main()
@@ -1,9 +1,13 @@
+import sys
+sys.path.append("../move_prediction")
+
 import pandas
 import bz2
 import argparse
 import os
 
 import haibrid_chess_utils
+import maia_chess_backend
 
 target_columns = ['game_id', 'type', 'time_control', 'num_ply', 'move_ply', 'move', 'cp', 'cp_rel', 'cp_loss', 'is_blunder', 'winrate', 'winrate_loss', 'blunder_wr', 'is_capture', 'opp_winrate', 'white_active', 'active_elo', 'opponent_elo', 'active_won', 'clock', 'opp_clock', 'board']
 
@@ -11,7 +15,7 @@ target_columns = ['game_id', 'type', 'time_control', 'num_ply', 'move_ply', 'mov
 def main():
     parser = argparse.ArgumentParser(description='Create new cvs with select columns', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('input', help='input CSV')
+    parser.add_argument('input', help='input CSV or Parquet file, the output is the same format')
     parser.add_argument('outputDir', help='output CSV')
 
     args = parser.parse_args()
@@ -20,19 +24,22 @@ def main():
     haibrid_chess_utils.printWithDate(f"Collecting {', '.join(target_columns)}")
 
     name = os.path.basename(args.input).split('.')[0]
-    outputName = os.path.join(args.outputDir, f"{name}_trimmed.csv.bz2")
+    is_parquet = maia_chess_backend.is_parquet_path(args.input)
+    outputName = os.path.join(args.outputDir, f"{name}_trimmed.parquet" if is_parquet else f"{name}_trimmed.csv.bz2")
 
     haibrid_chess_utils.printWithDate(f"Created output name {outputName}")
 
     os.makedirs(args.outputDir, exist_ok = True)
 
     haibrid_chess_utils.printWithDate(f"Starting read")
-    with bz2.open(args.input, 'rt') as f:
-        df = pandas.read_csv(f, usecols = target_columns)
+    df = maia_chess_backend.read_per_move(args.input, columns = target_columns)
 
     haibrid_chess_utils.printWithDate(f"Starting write")
-    with bz2.open(outputName, 'wt') as f:
-        df.to_csv(f, index = False)
+    if is_parquet:
+        df.to_parquet(outputName, compression = maia_chess_backend.parquet_compression, index = False)
+    else:
+        with bz2.open(outputName, 'wt') as f:
+            df.to_csv(f, index = False)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,11 @@
+import sys
+sys.path.append("../move_prediction")
+
 import haibrid_chess_utils
+import maia_chess_backend
 
 import argparse
+import contextlib
 import time
 import humanize
 import multiprocessing
@@ -31,11 +36,13 @@ target_columns = [
     'cp_loss',
 ]
 
+read_columns = target_columns + ['low_time', 'board', 'is_blunder_wr', 'move']
+
 @haibrid_chess_utils.logged_main
 def main():
     parser = argparse.ArgumentParser(description='Group by board', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('inputs', nargs = '+', help='input CSVs')
+    parser.add_argument('inputs', nargs = '+', help='input CSVs or Parquet files')
     parser.add_argument('outputDir', help='output CSVs dir')
     parser.add_argument('--nrows', type=int, help='number of rows to read in, FOR TESTING', default = None)
 
@@ -118,8 +125,7 @@ def get_boards_dict(fPath, outputDir, queues, nrows):
     blunder_moves = {}
     nonblunder_moves = {}
     target_columns_dicts = {c : {} for c in target_columns}
-    with bz2.open(fPath, 'rt') as f:
-        reader = csv.DictReader(f)
+    with contextlib.closing(maia_chess_backend.iter_per_move_rows(fPath, columns = read_columns)) as reader:
         tstart = time.time()
         for i, line in enumerate(reader):
             #import pdb; pdb.set_trace()
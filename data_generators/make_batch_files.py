@@ -1,4 +1,7 @@
 # similar to pgnCPsToCSV_single but makes a zip with make seperate csvs
+import sys
+sys.path.append("../move_prediction")
+
 import argparse
 import time
 import humanize
@@ -17,6 +20,7 @@ import chess
 import chess.pgn
 
 import haibrid_chess_utils
+import maia_chess_backend
 
 logging_delay = 30 # in seconds
 game_per_put = 5
@@ -93,15 +97,22 @@ def parseLines(gameStr, num_samples, min_elo, max_elo, allow_negative_loss, allo
 
     return ret_blunder, ret_non_blunder
 
-def readerWorker(inputPath, unproccessedQueue, resultsQueue, stopLoadingQueue, num_readers, testing):
+def elo_predicate(min_elo, max_elo):
+    #Same Elo checks as parseLines, done on the headers before sending games to the parsers
+    def predicate(cols):
+        elo_w, elo_b = cols['WhiteElo'], cols['BlackElo']
+        return (elo_w >= 0) & (elo_b >= 0) & (elo_w >= min_elo) & (elo_w <= max_elo) & (elo_b <= max_elo)
+    return predicate
+
+def readerWorker(inputPath, unproccessedQueue, resultsQueue, stopLoadingQueue, num_readers, testing, min_elo, max_elo):
     tstart = time.time()
-    gamesFile = haibrid_chess_utils.LightGamesFile(inputPath, just_games = True)
+    gamesFile = maia_chess_backend.scan_pgn(inputPath, elo_predicate(min_elo, max_elo), with_headers = False)
     haibrid_chess_utils.printWithDate(f"Reader created", flush = True)
     try:
         tLast = time.time()
         games_bundle = []
         for i, (_, gs) in enumerate(gamesFile):
-            games_bundle.append(gs)
+            games_bundle.append(gs.decode('utf8'))
             if len(games_bundle) >= game_per_put:
                 unproccessedQueue.put(games_bundle, True)
                 games_bundle = []
@@ -261,10 +272,15 @@ def writerWorker(outputFile, inputQueue, stopLoadingQueue, num_readers, num_spli
                     tLast = time.time()
                     haibrid_chess_utils.printWithDate(f"Written {i} games {last_b_batch} b batches {last_nb_batch} nb batches in {humanize.naturaldelta(time.time() - tstart)}, doing {(i + 1) /(time.time() - tstart):.0f} games a second", flush = True)
 
-def setupProcessors(gamesPath, ouput_path, manager, worker_pool, io_pool, poolSize, num_boards, batch_size, queueSize, min_elo, max_elo, allow_negative_loss, allow_low_time, max_bs, testing):
-    unproccessedQueue = manager.Queue(queueSize)
-    resultsQueue = manager.Queue(queueSize)
-    stopLoadingQueue = manager.Queue()
+def make_queues(queueSize):
+    #Games go out in bundles of game_per_put and come back one at a time
+    unproccessedQueue = maia_chess_backend.SharedMemoryQueue(maxsize = max(queueSize // game_per_put, 1))
+    resultsQueue = maia_chess_backend.SharedMemoryQueue(maxsize = queueSize)
+    stopLoadingQueue = maia_chess_backend.SharedMemoryQueue(capacity = 1024)
+    return unproccessedQueue, resultsQueue, stopLoadingQueue
+
+def setupProcessors(gamesPath, ouput_path, queues, worker_pool, io_pool, poolSize, num_boards, batch_size, min_elo, max_elo, allow_negative_loss, allow_low_time, max_bs, testing):
+    unproccessedQueue, resultsQueue, stopLoadingQueue = queues
 
     parsers = []
     for _ in range(poolSize):
@@ -272,7 +288,7 @@ def setupProcessors(gamesPath, ouput_path, manager, worker_pool, io_pool, poolSi
         parsers.append(parser)
     haibrid_chess_utils.printWithDate(f"Started {len(parsers)} parsers")
 
-    pgnReader = io_pool.apply_async(readerWorker, (gamesPath, unproccessedQueue, resultsQueue, stopLoadingQueue, len(parsers), testing))
+    pgnReader = io_pool.apply_async(readerWorker, (gamesPath, unproccessedQueue, resultsQueue, stopLoadingQueue, len(parsers), testing, min_elo, max_elo))
     haibrid_chess_utils.printWithDate(f"loader created")
 
     writer = io_pool.apply_async(writerWorker, (ouput_path, resultsQueue, stopLoadingQueue, len(parsers), num_boards, batch_size, max_bs))
@@ -328,13 +344,18 @@ def main():
     haibrid_chess_utils.printWithDate(f"Starting PGN conversion of {args.input} writing to {args.output}")
 
     tstart = time.time()
-    with multiprocessing.Manager() as manager:
-        with multiprocessing.Pool(args.pool) as worker_pool, multiprocessing.Pool(3) as io_pool:
-            pgnReader, gameParsers, writer, unproccessedQueue, resultsQueue, stopQueue = setupProcessors(args.input, args.output, manager, worker_pool, io_pool, args.pool, args.num_boards, args.batch_size, args.queueSize, args.min_elo, args.max_elo, args.allow_negative_loss, args.allow_low_time, args.max_bs, args.testing)
+    #The queues have to exist before the pools so their workers can use them
+    queues = make_queues(args.queueSize)
+    try:
+        with multiprocessing.Pool(args.pool, initializer = maia_chess_backend.register_shared_queues, initargs = (queues,)) as worker_pool, multiprocessing.Pool(3, initializer = maia_chess_backend.register_shared_queues, initargs = (queues,)) as io_pool:
+            pgnReader, gameParsers, writer, unproccessedQueue, resultsQueue, stopQueue = setupProcessors(args.input, args.output, queues, worker_pool, io_pool, args.pool, args.num_boards, args.batch_size, args.min_elo, args.max_elo, args.allow_negative_loss, args.allow_low_time, args.max_bs, args.testing)
 
             haibrid_chess_utils.printWithDate(f"Done setting up Queues in {humanize.naturaldelta(time.time() - tstart)}, waiting for reading to finish")
 
             cleanup(pgnReader, gameParsers, writer)
+    finally:
+        for q in queues:
+            q.unlink()
 
     haibrid_chess_utils.printWithDate(f"Done everything in {humanize.naturaldelta(time.time() - tstart)}, exiting")
 
@@ -0,0 +1,24 @@
+import sys
+sys.path.append("../move_prediction")
+
+import maia_chess_backend
+
+import argparse
+import time
+
+import humanize
+
+@maia_chess_backend.logged_main
+def main():
+    parser = argparse.ArgumentParser(description='Build the game index sidecar (game offsets and header columns) of PGN files', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('targets', nargs='+', help='target PGN files, .pgn or .pgn.bz2')
+    parser.add_argument('--bz2_workers', type=int, help='number of threads decompressing the input', default = None)
+    args = parser.parse_args()
+
+    for target in sorted(args.targets):
+        tstart = time.time()
+        index = maia_chess_backend.build_game_index(target, bz2_workers = args.bz2_workers)
+        print(f"Indexed {len(index)} games of {target} into {index.index_path} in {humanize.naturaldelta(time.time() - tstart)}")
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
 #Working functions used by single
 
+import sys
+sys.path.append("../move_prediction")
+
 import argparse
 import time
 import humanize
@@ -16,8 +19,10 @@ import chess
 import chess.pgn
 
 import haibrid_chess_utils
+import maia_chess_backend
 
 logging_delay = 30 # in seconds
+game_per_put = 50
 
 num_move_per_game = 35 #For clock remaing calculations
 low_time_threshold = 30
@@ -61,18 +66,24 @@ properties = [
 
 properties += haibrid_chess_utils.board_stats_header
 
-def readerWorker(inputPath, unproccessedQueue, resultsQueue, name, num_readers):
+def readerWorker(inputPath, unproccessedQueue, resultsQueue, name, num_readers, bz2_workers = 1):
     tstart = time.time()
-    gamesFile = haibrid_chess_utils.LightGamesFile(inputPath, just_games = True)
+    gamesFile = maia_chess_backend.LightGamesFile(inputPath, just_games = True, bz2_workers = bz2_workers)
     try:
         tLast = time.time()
+        games_bundle = []
         for i, (_, gs) in enumerate(gamesFile):
-            unproccessedQueue.put(gs, True, 1000)
+            games_bundle.append(gs)
+            if len(games_bundle) >= game_per_put:
+                unproccessedQueue.put(games_bundle, True, 1000)
+                games_bundle = []
             if i % 1000 == 0 and  time.time() - tLast > logging_delay:
                 tLast = time.time()
                 haibrid_chess_utils.printWithDate(f"{name} Loaded {i} games, input queue depth: {unproccessedQueue.qsize()}, ouput queue depth: {resultsQueue.qsize()}", flush = True)
     except EOFError:
         pass
+    if len(games_bundle) > 0:
+        unproccessedQueue.put(games_bundle, True, 1000)
 
     haibrid_chess_utils.printWithDate(f"{name} Done loading Queue in {humanize.naturaldelta(time.time() - tstart)}, sending kills")
     for i in range(num_readers):
@@ -85,9 +96,8 @@ def writerWorker(outputFile, inputQueue, num_readers, name):
     num_kill_remaining = num_readers
     tstart = time.time()
     haibrid_chess_utils.printWithDate("Writer created")
-    with bz2.open(outputFile, 'wb') as f:
+    with maia_chess_backend.open_per_move_writer(outputFile, maia_chess_backend.full_csv_header) as f:
         haibrid_chess_utils.printWithDate(f"Created: {outputFile}")
-        f.write((','.join(haibrid_chess_utils.full_csv_header) + '\n').encode('utf8'))
         tLast = time.time()
         while True:
             try:
@@ -108,9 +118,9 @@ def writerWorker(outputFile, inputQueue, num_readers, name):
                 i += 1
                 if i % 1000 == 0 and  time.time() - tLast > logging_delay:
                     tLast = time.time()
-                    haibrid_chess_utils.printWithDate(f"{name} Written {i} games in {humanize.naturaldelta(time.time() - tstart)}, doing {(i + 1) /(time.time() - tstart):.0f} games a second", flush = True)
+                    haibrid_chess_utils.printWithDate(f"{name} Written {i} batches in {humanize.naturaldelta(time.time() - tstart)}, doing {(i + 1) * game_per_put /(time.time() - tstart):.0f} games a second", flush = True)
     haibrid_chess_utils.printWithDate("Received shutdown signal to writer")
-    haibrid_chess_utils.printWithDate(f"Done a total of {i} games in {humanize.naturaldelta(time.time() - tstart)}")
+    haibrid_chess_utils.printWithDate(f"Done a total of {i} batches in {humanize.naturaldelta(time.time() - tstart)}")
 
 def gamesConverter(inputQueue, outputQueue):
     #haibrid_chess_utils.printWithDate("Converter created")
@@ -124,19 +134,21 @@ def gamesConverter(inputQueue, outputQueue):
             outputQueue.put('kill', True, 1000)
             break
         else:
-            try:
-                s = haibrid_chess_utils.gameToCSVlines(dat)
-            except haibrid_chess_utils.NoStockfishEvals:
-                pass
-            except:
-                haibrid_chess_utils.printWithDate('error:')
-                haibrid_chess_utils.printWithDate(dat)
-                haibrid_chess_utils.printWithDate(traceback.format_exc())
-                raise
-            else:
-                if len(s) > 0:
-                    lines = '\n'.join(s) + '\n'
-                    outputQueue.put(lines.encode('utf8'), True, 1000)
+            lines = []
+            for game_str in dat:
+                try:
+                    s = maia_chess_backend.gameToCSVlines(game_str)
+                except maia_chess_backend.NoStockfishEvals:
+                    pass
+                except:
+                    haibrid_chess_utils.printWithDate('error:')
+                    haibrid_chess_utils.printWithDate(game_str)
+                    haibrid_chess_utils.printWithDate(traceback.format_exc())
+                    raise
+                else:
+                    lines += s
+            if len(lines) > 0:
+                outputQueue.put(('\n'.join(lines) + '\n').encode('utf8'), True, 1000)
     haibrid_chess_utils.printWithDate("Received shutdown signal to Converter", flush = True)
 
 def makeCSVlines(gameStr):
@@ -295,9 +307,13 @@ def makeCSVlines(gameStr):
 
     return retVals
 
-def processPGN(gamesPath, inputName, outputName, queueSize, poolSize, manager, workers_pool, io_pool):
-    unproccessedQueue = manager.Queue(queueSize)
-    resultsQueue = manager.Queue(queueSize)
+def make_queues(queueSize):
+    #Games are sent in batches of game_per_put, and their CSV lines come back the same way
+    max_batches = max(queueSize // game_per_put, 1)
+    return maia_chess_backend.SharedMemoryQueue(maxsize = max_batches), maia_chess_backend.SharedMemoryQueue(maxsize = max_batches)
+
+def processPGN(gamesPath, inputName, outputName, queues, poolSize, workers_pool, io_pool, bz2_workers = 1):
+    unproccessedQueue, resultsQueue = queues
 
     readers = []
     for _ in range(poolSize - 1):
@@ -305,7 +321,7 @@ def processPGN(gamesPath, inputName, outputName, queueSize, poolSize, manager, w
         readers.append(reader)
     haibrid_chess_utils.printWithDate(f"{inputName} Started {len(readers)} readers", flush = True)
 
-    pgnReader = io_pool.apply_async(readerWorker, (gamesPath, unproccessedQueue, resultsQueue, inputName, len(readers)))
+    pgnReader = io_pool.apply_async(readerWorker, (gamesPath, unproccessedQueue, resultsQueue, inputName, len(readers), bz2_workers))
     haibrid_chess_utils.printWithDate(f"{inputName} loader created")
 
     writer = io_pool.apply_async(writerWorker, (outputName, resultsQueue, len(readers), inputName))
@@ -340,6 +356,10 @@ def main():
     parser.add_argument('--pool', type=int, help='number of simultaneous jobs running per fil', default = 20)
     #parser.add_argument('--readers', type=int, help='number of simultaneous reader running per inputfile', default = 24)
     parser.add_argument('--queueSize', type=int, help='Max number of games to cache', default = 1000)
+    parser.add_argument('--parquet', help='Write zstd Parquet files instead of bz2 CSVs, needs pyarrow', default = False, action="store_true")
+    parser.add_argument('--shard_games', type=int, help='Write resumable shards of this many games each, with a manifest, instead of one file', default = None)
+    parser.add_argument('--shards', help='Only make this range of shards, a:b, to split a file between machines', default = None)
+    parser.add_argument('--bz2_workers', type=int, help='number of threads decompressing the input, 1 to use bz2 directly', default = 1)
 
     args = parser.parse_args()
 
@@ -347,10 +367,16 @@ def main():
 
     os.makedirs(args.outputDir, exist_ok=True)
 
+    if args.shard_games is not None:
+        shard_range = None if args.shards is None else maia_chess_backend.shards.parse_shard_range(args.shards)
+        for n in args.inputs:
+            maia_chess_backend.shards.run_sharded_csv(n, args.outputDir, args.shard_games, args.pool, queue_size = args.queueSize, shard_range = shard_range, parquet = args.parquet, bz2_workers = args.bz2_workers)
+        return
+
     names = {}
     for n in args.inputs:
         name = os.path.basename(n).split('.')[0]
-        outputName = os.path.join(args.outputDir, f"{name}.csv.bz2")
+        outputName = os.path.join(args.outputDir, f"{name}.parquet" if args.parquet else f"{name}.csv.bz2")
         names[n] = (name, outputName)
 
 
@@ -364,18 +390,25 @@ def main():
     writers = {}
     queues = {}
 
-    with multiprocessing.Manager() as manager:
-        with multiprocessing.Pool(args.pool * len(names)) as workers_pool, multiprocessing.Pool(len(names) * 2 + 4) as io_pool:
+    #The queues have to exist before the pools so their workers can use them
+    for p, (i, o) in names.items():
+        queues[i] = make_queues(args.queueSize)
+    all_queues = [q for qs in queues.values() for q in qs]
+
+    try:
+        with multiprocessing.Pool(args.pool * len(names), initializer = maia_chess_backend.register_shared_queues, initargs = (all_queues,)) as workers_pool, multiprocessing.Pool(len(names) * 2 + 4, initializer = maia_chess_backend.register_shared_queues, initargs = (all_queues,)) as io_pool:
             for p, (i, o) in names.items():
-                pgnReader, gameReader, writer, unproccessedQueue, resultsQueue = processPGN(p, i, o, args.queueSize, args.pool, manager, workers_pool, io_pool)
+                pgnReader, gameReader, writer, unproccessedQueue, resultsQueue = processPGN(p, i, o, queues[i], args.pool, workers_pool, io_pool, bz2_workers = args.bz2_workers)
                 pgnReaders[i] = pgnReader
                 gameReaders[i] = gameReader
                 writers[i] = writer
-                queues[i] = (unproccessedQueue, resultsQueue)
 
             haibrid_chess_utils.printWithDate(f"Done loading Queues in {humanize.naturaldelta(time.time() - tstart)}, waiting for reading to finish")
 
             cleanup(pgnReaders, gameReaders, writers)
+    finally:
+        for q in all_queues:
+            q.unlink()
 
     haibrid_chess_utils.printWithDate(f"Done everything in {humanize.naturaldelta(time.time() - tstart)}, exiting")
 
@@ -0,0 +1,17 @@
+#!/usr/bin/env bash
+
+#The months planned once, then one worker per machine, all with ../datasets on the shared filesystem
+python3 distributed_csvs.py plan /ada/data/chess/bz2/standard/lichess_db_standard_rated_2017-*.pgn.bz2 /ada/data/chess/bz2/standard/lichess_db_standard_rated_2018-*.pgn.bz2 ../datasets/lichess_board_csvs
+
+for host in ada01 ada02 ada03 ada04
+do
+   ssh $host "cd $(pwd); screen -S csv-worker -dm bash -c 'source ~/.bashrc; python3 distributed_csvs.py work --pool 60 ../datasets/lichess_board_csvs'"
+done
+
+#To check on them
+#python3 distributed_csvs.py status ../datasets/lichess_board_csvs
+
+#for host in ada01 ada02 ada03 ada04
+#do
+#   ssh $host "screen -S csv-worker -X quit"
+#done
@@ -1,6 +1,16 @@
 #from .uci import *
 from .games import *
+from .game_index import *
+from .pgn_scanner import *
 from .utils import *
+from .movetext import *
+from .parquet_io import *
+from .shared_queue import *
+from .shards import *
+from .work_queue import *
+from .game_mmaps import *
+from .csv_mmaps import *
+from .mmap_sampler import *
 from .tourney import *
 from .loaders import *
 from .models_loader import *
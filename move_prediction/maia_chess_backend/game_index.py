@@ -0,0 +1,237 @@
+import bisect
+import io
+import os.path
+
+import numpy as np
+
+from .parallel_bz2 import ParallelBZ2Reader, decompress_bz2_block
+
+#Sidecar index of a PGN file: the byte offset and length of every game in the
+#decompressed text plus its main header fields, stored as columns so filters
+#are numpy expressions. For .bz2 files the bz2 block boundaries are stored too,
+#so a game can be read by decompressing only the blocks it is in.
+
+index_suffix = '.index.npz'
+
+result_codes = {
+    '1-0' : 1,
+    '0-1' : 0,
+    '1/2-1/2' : 2,
+}
+
+def index_path_for(path):
+    return path + index_suffix
+
+def _header_value(line):
+    #[Key "Value"]
+    return line.split(b'"', 2)[1]
+
+def _to_int(v, default = -1):
+    try:
+        return int(v)
+    except ValueError:
+        return default
+
+def _parse_time_control(tc):
+    #'180+2' -> (180, 2), '-' (correspondence) -> (-1, -1)
+    base, _, inc = tc.partition(b'+')
+    return _to_int(base), _to_int(inc)
+
+class _GameColumns(object):
+    def __init__(self):
+        self.offsets = []
+        self.white_elo = []
+        self.black_elo = []
+        self.result = []
+        self.tc_base = []
+        self.tc_inc = []
+        self.event = []
+        self.event_codes = {}
+        self._headers = None
+
+    def start_game(self, offset):
+        self.finish_game()
+        self.offsets.append(offset)
+        self._headers = {}
+
+    def add_header(self, line):
+        if self._headers is None:
+            return
+        key = line[1:line.find(b' ')]
+        if key in (b'WhiteElo', b'BlackElo', b'Result', b'TimeControl', b'Event'):
+            self._headers[key] = _header_value(line)
+
+    def finish_game(self):
+        if self._headers is None:
+            return
+        h = self._headers
+        self.white_elo.append(_to_int(h.get(b'WhiteElo', b'')))
+        self.black_elo.append(_to_int(h.get(b'BlackElo', b'')))
+        self.result.append(result_codes.get(h.get(b'Result', b'*').decode(), -1))
+        base, inc = _parse_time_control(h.get(b'TimeControl', b'-'))
+        self.tc_base.append(base)
+        self.tc_inc.append(inc)
+        event = h.get(b'Event', b'').decode('utf8', 'replace')
+        self.event.append(self.event_codes.setdefault(event, len(self.event_codes)))
+        self._headers = None
+
+def scan_games(f, columns):
+    """Reads binary PGN lines from f and records every game in columns, returns the total length"""
+    offset = 0
+    in_headers = False
+    for line in f:
+        if line.startswith(b'['):
+            if not in_headers:
+                columns.start_game(offset)
+                in_headers = True
+            columns.add_header(line)
+        elif line.strip():
+            in_headers = False
+        offset += len(line)
+    columns.finish_game()
+    return offset
+
+def build_game_index(path, index_path = None, bz2_workers = None):
+    """Scans a .pgn or .pgn.bz2 file once and writes its game index sidecar, returns the GameIndex"""
+    if index_path is None:
+        index_path = index_path_for(path)
+    columns = _GameColumns()
+    if path.endswith('bz2'):
+        raw = ParallelBZ2Reader(path, workers = bz2_workers)
+        with io.BufferedReader(raw, buffer_size = 1024 * 1024) as f:
+            total = scan_games(f, columns)
+            blocks = np.array(raw.blocks, dtype = np.int64).reshape(-1, 3)
+    else:
+        with open(path, 'rb') as f:
+            total = scan_games(f, columns)
+        blocks = np.zeros((0, 3), dtype = np.int64)
+    offsets = np.array(columns.offsets + [total], dtype = np.int64)
+    events = sorted(columns.event_codes, key = columns.event_codes.get)
+    with open(index_path, 'wb') as f:
+        np.savez(f,
+            offset = offsets[:-1],
+            length = np.diff(offsets),
+            white_elo = np.array(columns.white_elo, dtype = np.int32),
+            black_elo = np.array(columns.black_elo, dtype = np.int32),
+            result = np.array(columns.result, dtype = np.int8),
+            tc_base = np.array(columns.tc_base, dtype = np.int32),
+            tc_inc = np.array(columns.tc_inc, dtype = np.int32),
+            event = np.array(columns.event, dtype = np.int32),
+            events = np.array(events, dtype = str),
+            blocks = blocks,
+            source_size = np.int64(os.path.getsize(path)),
+            )
+    return GameIndex(path, index_path)
+
+class GameIndex(object):
+    """Columns of the game index of a PGN file, see build_game_index()
+
+    Columns are numpy arrays with one entry per game: offset, length,
+    white_elo, black_elo (-1 if missing), result (1 white win, 0 black win,
+    2 draw, -1 other), tc_base, tc_inc (seconds, -1 if missing) and event (an
+    index into events).
+    """
+    columns = ['offset', 'length', 'white_elo', 'black_elo', 'result', 'tc_base', 'tc_inc', 'event']
+
+    def __init__(self, path, index_path = None):
+        self.path = path
+        self.index_path = index_path or index_path_for(path)
+        with np.load(self.index_path) as dat:
+            if int(dat['source_size']) != os.path.getsize(path):
+                raise ValueError(f"{self.index_path} is out of date for {path}")
+            for c in self.columns:
+                setattr(self, c, dat[c])
+            self.events = list(dat['events'])
+            self.blocks = dat['blocks']
+        self._cached_block = (None, None)
+
+    @classmethod
+    def load_or_build(cls, path, index_path = None, bz2_workers = None):
+        try:
+            return cls(path, index_path)
+        except (OSError, ValueError, KeyError):
+            return build_game_index(path, index_path, bz2_workers = bz2_workers)
+
+    def __len__(self):
+        return len(self.offset)
+
+    def event_mask(self, substring):
+        """Mask of games whose Event header contains substring"""
+        matches = np.array([substring in e for e in self.events] + [False], dtype = bool)
+        return matches[self.event]
+
+    def filter(self, min_elo = None, max_elo = None, results = None, min_tc_base = None, exclude_event = None):
+        """Returns a boolean mask of the games matching all the given conditions
+
+        Both players' Elo must be in (min_elo, max_elo], games without Elo
+        never match an Elo condition. results is a list of Result strings.
+        """
+        mask = np.ones(len(self), dtype = bool)
+        if min_elo is not None or max_elo is not None:
+            mask &= (self.white_elo >= 0) & (self.black_elo >= 0)
+        if min_elo is not None:
+            mask &= (self.white_elo > min_elo) & (self.black_elo > min_elo)
+        if max_elo is not None:
+            mask &= (self.white_elo <= max_elo) & (self.black_elo <= max_elo)
+        if results is not None:
+            mask &= np.isin(self.result, [result_codes.get(r, -1) for r in results])
+        if min_tc_base is not None:
+            mask &= self.tc_base >= min_tc_base
+        if exclude_event is not None:
+            mask &= ~self.event_mask(exclude_event)
+        return mask
+
+    def _read_block(self, i):
+        if self._cached_block[0] != i:
+            start, end, _ = self.blocks[i]
+            self._cached_block = (i, decompress_bz2_block(self.path, int(start), int(end)))
+        return self._cached_block[1]
+
+    def _read_bz2(self, offset, length):
+        uoffsets = self.blocks[:, 2]
+        i = bisect.bisect_right(uoffsets, offset) - 1
+        parts = []
+        while length > 0:
+            block = self._read_block(i)
+            start = offset - int(uoffsets[i])
+            part = block[start:start + length]
+            parts.append(part)
+            offset += len(part)
+            length -= len(part)
+            i += 1
+        return b''.join(parts)
+
+    def read_game(self, i):
+        """Returns the raw bytes of game i"""
+        offset, length = int(self.offset[i]), int(self.length[i])
+        if len(self.blocks) > 0:
+            return self._read_bz2(offset, length)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def iter_games(self, selection = None):
+        """Yields (game number, raw bytes) for the games selected by a mask or a list of game numbers, in file order"""
+        if selection is None:
+            indices = range(len(self))
+        else:
+            selection = np.asarray(selection)
+            if selection.dtype == bool:
+                indices = np.flatnonzero(selection)
+            else:
+                indices = np.sort(selection)
+        if len(self.blocks) > 0:
+            for i in indices:
+                yield int(i), self.read_game(i)
+        else:
+            with open(self.path, 'rb') as f:
+                for i in indices:
+                    f.seek(int(self.offset[i]))
+                    yield int(i), f.read(int(self.length[i]))
+
+    def seek_segments(self, i):
+        """The bz2 blocks from the one holding game i onwards, and the offset of game i in the first of them"""
+        uoffsets = self.blocks[:, 2]
+        b = bisect.bisect_right(uoffsets, int(self.offset[i])) - 1
+        segments = [(int(s), int(e)) for s, e, _ in self.blocks[b:]]
+        return segments, int(self.offset[i]) - int(uoffsets[b])
@@ -0,0 +1,129 @@
+import numpy as np
+
+from .fen_to_vec import packed_to_vecs
+from .game_mmaps import read_mmap_manifest, open_mmap_column
+
+#Samples the rows of many directories of mmaps, like all the months of the
+#blunders, in one random order across all of them. The rows are split into
+#blocks of block_size consecutive rows and the blocks of all the directories
+#are shuffled together each epoch. They're then read window_size rows at a
+#time, sorted so each directory's mmaps are read in order, and the rows of
+#the window are shuffled. Larger blocks read more sequentially but a window
+#then mixes rows from fewer places, block_size of 1 is a uniform shuffle of
+#all the rows. Larger windows mix more blocks at the cost of memory.
+
+shuffle_block_size = 64
+shuffle_window_size = 262144
+
+class ShuffledMmapRows(object):
+    """Iterates over the rows of the mmaps in target_dirs in a random order across all of them, see take()
+
+    max_rows limits the rows used from each directory. The order of the
+    blocks depends only on seed and the epoch, so copies of this made by
+    forking can each take their own share of the blocks with set_worker().
+    """
+    def __init__(self, target_dirs, y_names, block_size = shuffle_block_size, window_size = shuffle_window_size, max_rows = None, seed = None):
+        self.target_dirs = list(target_dirs)
+        self.y_names = list(y_names)
+        self.block_size = block_size
+        self.window_size = max(window_size, block_size)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+
+        self.lengths = []
+        self.boards = []
+        self.packed = []
+        self.y_vals = []
+        for d in self.target_dirs:
+            manifest = read_mmap_manifest(d)
+            n = manifest['num_rows'] if max_rows is None else min(max_rows, manifest['num_rows'])
+            self.lengths.append(n)
+            is_packed = 'board_packed' in manifest['columns']
+            self.packed.append(is_packed)
+            self.boards.append(open_mmap_column(d, 'board_packed' if is_packed else 'board')[:n])
+            try:
+                self.y_vals.append({name : open_mmap_column(d, name)[:n] for name in self.y_names})
+            except KeyError as e:
+                raise FileNotFoundError(f"{d} is missing {e.args[0]} value")
+        #Packed boards are kept packed until they're taken
+        self.all_packed = all(self.packed)
+
+        block_counts = [(n + block_size - 1) // block_size for n in self.lengths]
+        self.block_dirs = np.repeat(np.arange(len(self.lengths)), block_counts)
+        self.block_starts = np.concatenate([np.arange(c) * block_size for c in block_counts] + [np.zeros(0, dtype = int)])
+        if len(self.block_dirs) < 1:
+            raise ValueError(f"No rows in: {', '.join(self.target_dirs)}")
+        self.set_worker(0, 1)
+
+    def __len__(self):
+        return sum(self.lengths)
+
+    def __repr__(self):
+        return f"<ShuffledMmapRows {len(self.target_dirs)} dirs {len(self)} rows block_size {self.block_size} window_size {self.window_size}>"
+
+    def set_worker(self, worker_id, num_workers):
+        """Only uses every num_workers'th block of each epoch, starting at worker_id, and restarts the epochs"""
+        if num_workers > len(self.block_dirs):
+            raise ValueError(f"{num_workers} workers for only {len(self.block_dirs)} blocks, use a smaller block_size")
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.rng = np.random.default_rng([self.seed, worker_id])
+        self.epoch = 0
+        self.order = self.epoch_order()
+        self.order_index = 0
+        self.window_boards = None
+        self.window_ys = None
+        self.window_index = 0
+
+    def epoch_order(self):
+        order = np.random.default_rng([self.seed, self.epoch]).permutation(len(self.block_dirs))
+        return order[self.worker_id::self.num_workers]
+
+    def next_blocks(self, n):
+        #Up to n, a window doesn't go past the end of an epoch so each epoch has every row once
+        if self.order_index >= len(self.order):
+            self.epoch += 1
+            self.order = self.epoch_order()
+            self.order_index = 0
+        blocks = self.order[self.order_index:self.order_index + n]
+        self.order_index += len(blocks)
+        return blocks
+
+    def fill_window(self):
+        blocks = self.next_blocks(max(1, self.window_size // self.block_size))
+        boards = []
+        ys = {name : [] for name in self.y_names}
+        for d in np.unique(self.block_dirs[blocks]):
+            #The rows of the directory's blocks, in file order
+            starts = np.sort(self.block_starts[blocks[self.block_dirs[blocks] == d]])
+            rows = (starts[:, None] + np.arange(self.block_size)).ravel()
+            rows = rows[rows < self.lengths[d]]
+            b = self.boards[d][rows]
+            if self.packed[d] and not self.all_packed:
+                b = packed_to_vecs(b)
+            boards.append(b)
+            for name in self.y_names:
+                ys[name].append(self.y_vals[d][name][rows])
+        order = self.rng.permutation(sum(len(b) for b in boards))
+        self.window_boards = np.concatenate(boards)[order]
+        self.window_ys = {name : np.concatenate(v)[order] for name, v in ys.items()}
+        self.window_index = 0
+
+    def take(self, n):
+        """The next n rows, as (n, 17, 8, 8) bool boards and a dict of the y_names values"""
+        boards = []
+        ys = {name : [] for name in self.y_names}
+        while n > 0:
+            if self.window_boards is None or self.window_index >= len(self.window_boards):
+                self.fill_window()
+            end = min(self.window_index + n, len(self.window_boards))
+            boards.append(self.window_boards[self.window_index:end])
+            for name in self.y_names:
+                ys[name].append(self.window_ys[name][self.window_index:end])
+            n -= end - self.window_index
+            self.window_index = end
+        boards = np.concatenate(boards)
+        if self.all_packed:
+            boards = packed_to_vecs(boards)
+        return boards, {name : np.concatenate(v) for name, v in ys.items()}
@@ -0,0 +1,173 @@
+import bz2
+import io
+import os
+import collections
+import concurrent.futures
+
+#A bz2 file is a sequence of independently compressed blocks, each starting
+#with a 48 bit magic number that is not byte aligned. We find the magic
+#numbers, then rebuild each block as a standalone single block stream so it can
+#be decompressed on its own. bz2.decompress releases the GIL so threads are
+#enough to use all the cores, and threads unlike processes can be started from
+#inside the daemonic pool workers the data generators run their readers in.
+
+block_magic = 0x314159265359
+eos_magic = 0x177245385090
+
+scan_chunk_size = 16 * 1024 * 1024
+
+def _magic_patterns(magic, is_eos):
+    #For each bit offset of the magic within a byte: the 5 bytes always fully
+    #covered by it, plus the partial bytes before and after with their masks
+    pats = []
+    for shift in range(8):
+        v = (magic << (8 - shift)).to_bytes(7, 'big')
+        pats.append((v[1:6], shift, v[0], 0xFF >> shift, v[6], (0xFF00 >> shift) & 0xFF, is_eos))
+    return pats
+
+_patterns = _magic_patterns(block_magic, False) + _magic_patterns(eos_magic, True)
+
+def iter_bz2_boundaries(f, chunk_size = scan_chunk_size):
+    """Yields (bit offset, is_eos) for every block start and end of stream marker in f, in order"""
+    buf = b''
+    buf_offset = 0
+    start = 1
+    while True:
+        chunk = f.read(chunk_size)
+        buf += chunk
+        #Candidates need the byte before and after the 5 byte core
+        end = len(buf) - 5
+        found = []
+        for core, shift, head, head_mask, tail, tail_mask, is_eos in _patterns:
+            i = buf.find(core, start, end + 4)
+            while i >= 0:
+                if (buf[i - 1] & head_mask) == head and (buf[i + 5] & tail_mask) == tail:
+                    found.append(((buf_offset + i - 1) * 8 + shift, is_eos))
+                i = buf.find(core, i + 1, end + 4)
+        yield from sorted(found)
+        if not chunk:
+            break
+        keep = max(end - 1, 0)
+        buf_offset += keep
+        buf = buf[keep:]
+        start = 1
+
+def decompress_bz2_block(path, start_bit, end_bit):
+    """Decompresses the bz2 block stored between the two bit offsets of path"""
+    first = start_bit // 8
+    last = (end_bit + 7) // 8
+    with open(path, 'rb') as f:
+        f.seek(first)
+        data = f.read(last - first)
+    nbits = end_bit - start_bit
+    v = int.from_bytes(data, 'big') >> ((last - first) * 8 - (end_bit - first * 8))
+    v &= (1 << nbits) - 1
+    #The 32 bits after the block magic are the block's CRC, which is also the
+    #combined CRC of a stream with just that block
+    crc = (v >> (nbits - 80)) & 0xFFFFFFFF
+    v = (v << 80) | (eos_magic << 32) | crc
+    nbits += 80
+    pad = -nbits % 8
+    return bz2.decompress(b'BZh9' + (v << pad).to_bytes((nbits + pad) // 8, 'big'))
+
+class ParallelBZ2Reader(io.RawIOBase):
+    """Read only binary file object that decompresses a bz2 file with multiple threads
+
+    Works on single and multi stream files (e.g. from pbzip2 or lbzip2), the output is identical to bz2.open(path, 'rb')
+    """
+    def __init__(self, path, workers = None, max_pending = None, segments = None):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4 * self.workers
+        #(start bit, end bit, uncompressed offset) of every block read so far
+        self.blocks = []
+        self._uoffset = 0
+        if segments is None:
+            self._f = open(path, 'rb')
+            self._segments = self._iter_segments()
+        else:
+            #Known block boundaries, e.g. from a game index, skip the scan
+            self._f = None
+            self._segments = iter(segments)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.workers)
+        self._pending = collections.deque()
+        self._buf = b''
+        self._buf_pos = 0
+
+    def _iter_segments(self):
+        block_start = None
+        for bit, is_eos in iter_bz2_boundaries(self._f):
+            if block_start is not None:
+                yield block_start, bit
+            block_start = None if is_eos else bit
+        if block_start is not None:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+    def _fill(self):
+        for seg in self._segments:
+            self._pending.append((seg, self._executor.submit(decompress_bz2_block, self.path, *seg)))
+            if len(self._pending) >= self.max_pending:
+                break
+
+    def _next_block(self):
+        if len(self._pending) < self.max_pending:
+            self._fill()
+        if not self._pending:
+            return None
+        (start, end), fut = self._pending.popleft()
+        try:
+            data = fut.result()
+        except (OSError, ValueError, EOFError):
+            end, data = self._merge_next(start, end)
+        self.blocks.append((start, end, self._uoffset))
+        self._uoffset += len(data)
+        return data
+
+    def _merge_next(self, start, end):
+        #The magic can occur by chance inside compressed data, which splits
+        #a block in two, so retry with the following segment merged in
+        if not self._pending:
+            self._fill()
+        if self._pending:
+            (next_start, next_end), _ = self._pending.popleft()
+            for merged_end in sorted({next_start, next_end}):
+                if merged_end <= end:
+                    continue
+                try:
+                    return merged_end, decompress_bz2_block(self.path, start, merged_end)
+                except (OSError, ValueError, EOFError):
+                    pass
+        raise OSError(f"Invalid bz2 block at bit {start} of {self.path}")
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._buf_pos >= len(self._buf):
+            block = self._next_block()
+            if block is None:
+                return 0
+            self._buf = block
+            self._buf_pos = 0
+        n = min(len(b), len(self._buf) - self._buf_pos)
+        b[:n] = self._buf[self._buf_pos:self._buf_pos + n]
+        self._buf_pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait = False, cancel_futures = True)
+            if self._f is not None:
+                self._f.close()
+        super().close()
+
+def open_parallel_bz2(path, workers = None, mode = 'rt', segments = None):
+    """Like bz2.open(path, mode) for reading, but decompressing with multiple threads"""
+    raw = ParallelBZ2Reader(path, workers = workers, segments = segments)
+    f = io.BufferedReader(raw, buffer_size = 1024 * 1024)
+    if mode == 'rb':
+        return f
+    elif mode == 'rt':
+        return io.TextIOWrapper(f)
+    else:
+        raise ValueError(f"Invalid mode: {mode}")
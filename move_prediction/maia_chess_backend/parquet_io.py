@@ -0,0 +1,265 @@
+import bz2
+import csv
+import io
+import operator
+import shutil
+
+import pandas
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+#The per move datasets can be written as Parquet instead of bz2 CSVs. The
+#writers get the same CSV lines either way, for Parquet they are buffered and
+#parsed into typed columns by pyarrow, each buffer becoming a row group. The
+#readers take either format so the downstream scripts don't need to care, but
+#only Parquet can skip the columns and row groups that aren't needed.
+
+parquet_row_group_size = 250000
+parquet_compression = 'zstd'
+concat_buffer_size = 16 * 1024 * 1024
+
+#Types of the columns in full_csv_header, anything else is kept as a string
+per_move_column_types = {
+    'white_elo' : 'int32',
+    'black_elo' : 'int32',
+    'num_ply' : 'int32',
+    'white_won' : 'bool',
+    'black_won' : 'bool',
+    'no_winner' : 'bool',
+    'move_ply' : 'int32',
+    'cp_rel' : 'float64',
+    'cp_loss' : 'float64',
+    'is_blunder_cp' : 'bool',
+    'winrate' : 'float64',
+    'winrate_elo' : 'float64',
+    'winrate_loss' : 'float64',
+    'is_blunder_wr' : 'bool',
+    'opp_winrate' : 'float64',
+    'white_active' : 'bool',
+    'active_elo' : 'int32',
+    'opponent_elo' : 'int32',
+    'active_won' : 'bool',
+    'is_capture' : 'bool',
+    'clock' : 'int32',
+    'opp_clock' : 'int32',
+    'clock_percent' : 'float64',
+    'opp_clock_percent' : 'float64',
+    'low_time' : 'bool',
+    'active_bishop_count' : 'int32',
+    'active_knight_count' : 'int32',
+    'active_pawn_count' : 'int32',
+    'active_queen_count' : 'int32',
+    'active_rook_count' : 'int32',
+    'is_check' : 'int32',
+    'num_legal_moves' : 'int32',
+    'opp_bishop_count' : 'int32',
+    'opp_knight_count' : 'int32',
+    'opp_pawn_count' : 'int32',
+    'opp_queen_count' : 'int32',
+    'opp_rook_count' : 'int32',
+}
+
+_filter_ops = {
+    '==' : operator.eq,
+    '=' : operator.eq,
+    '!=' : operator.ne,
+    '<' : operator.lt,
+    '<=' : operator.le,
+    '>' : operator.gt,
+    '>=' : operator.ge,
+}
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("pyarrow is needed for Parquet files, install it with: pip install pyarrow")
+
+def is_parquet_path(path):
+    return path.endswith('.parquet')
+
+def per_move_schema(header):
+    _require_pyarrow()
+    return pyarrow.schema([(c, pyarrow.type_for_alias(per_move_column_types.get(c, 'string'))) for c in header])
+
+class ParquetCSVWriter(object):
+    """Binary file like object that takes CSV lines (without a header) and writes them as Parquet row groups
+
+    The lines are the ones gameToCSVlines() makes, so they are never quoted.
+    Empty values, and '?' for numbers, become nulls.
+    """
+    def __init__(self, path, header, row_group_size = parquet_row_group_size, compression = parquet_compression):
+        self.path = path
+        self.header = list(header)
+        self.row_group_size = row_group_size
+        self.schema = per_move_schema(self.header)
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression = compression)
+        self._read_options = pyarrow.csv.ReadOptions(column_names = self.header, block_size = 64 * 1024 * 1024)
+        self._parse_options = pyarrow.csv.ParseOptions(quote_char = False)
+        self._convert_options = pyarrow.csv.ConvertOptions(
+                column_types = self.schema,
+                null_values = ['', '?'],
+                true_values = ['True'],
+                false_values = ['False'],
+                strings_can_be_null = False,
+                )
+        self._buffer = []
+        self._buffered_rows = 0
+        self.rows_written = 0
+
+    def write(self, data):
+        #Same as a binary file, writerWorker relies on this for its kill messages
+        if not isinstance(data, bytes):
+            raise TypeError(f"a bytes-like object is required, not '{type(data).__name__}'")
+        self._buffer.append(data)
+        self._buffered_rows += data.count(b'\n')
+        if self._buffered_rows >= self.row_group_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffered_rows < 1:
+            return
+        table = pyarrow.csv.read_csv(
+                io.BytesIO(b''.join(self._buffer)),
+                read_options = self._read_options,
+                parse_options = self._parse_options,
+                convert_options = self._convert_options,
+                )
+        self._writer.write_table(table, row_group_size = len(table))
+        self.rows_written += len(table)
+        self._buffer = []
+        self._buffered_rows = 0
+
+    def close(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def open_per_move_writer(path, header):
+    """Opens path for writing CSV lines, as Parquet if it ends with .parquet, otherwise as a bz2 CSV with header
+
+    The CSV's header is its own bz2 stream, so concat_per_move() can join
+    files by copying the bytes after it.
+    """
+    if is_parquet_path(path):
+        return ParquetCSVWriter(path, header)
+    with open(path, 'wb') as f:
+        f.write(bz2.compress((','.join(header) + '\n').encode('utf8')))
+    return bz2.open(path, 'ab')
+
+def concat_per_move(paths, output_path):
+    """Concatenates per move datasets with the same columns into output_path, which must be the same format
+
+    Parquet row groups are copied over without parsing the rows. bz2 CSVs
+    made by open_per_move_writer() are copied as is after their header's
+    stream, others are decompressed and recompressed.
+    """
+    if len(paths) < 1:
+        raise ValueError(f"No files to concatenate into {output_path}")
+    if is_parquet_path(output_path):
+        _require_pyarrow()
+        writer = None
+        try:
+            for p in paths:
+                pf = pyarrow.parquet.ParquetFile(p)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(output_path, pf.schema_arrow, compression = parquet_compression)
+                elif pf.schema_arrow != writer.schema:
+                    raise ValueError(f"{p} doesn't have the same columns as {paths[0]}")
+                for i in range(pf.num_row_groups):
+                    writer.write_table(pf.read_row_group(i))
+        finally:
+            if writer is not None:
+                writer.close()
+        return
+    with bz2.open(paths[0], 'rb') as f:
+        header = f.readline()
+    header_stream = bz2.compress(header)
+    with open(output_path, 'wb') as f_out:
+        f_out.write(header_stream)
+        for p in paths:
+            with open(p, 'rb') as f_in:
+                if f_in.read(len(header_stream)) == header_stream:
+                    shutil.copyfileobj(f_in, f_out, concat_buffer_size)
+                    continue
+            with bz2.open(p, 'rb') as f_in, bz2.open(f_out, 'wb') as z_out:
+                if f_in.readline() != header:
+                    raise ValueError(f"{p} doesn't have the same columns as {paths[0]}")
+                shutil.copyfileobj(f_in, z_out, concat_buffer_size)
+
+def apply_filters(df, filters):
+    """pyarrow style filters, a list of (column, op, value) that must all be true, on a DataFrame"""
+    for c, op, v in filters:
+        if op == 'in':
+            df = df[df[c].isin(v)]
+        elif op == 'not in':
+            df = df[~df[c].isin(v)]
+        else:
+            df = df[_filter_ops[op](df[c], v)]
+    return df
+
+def read_per_move(path, columns = None, filters = None, nrows = None):
+    """Reads a per move dataset, Parquet or CSV, into a DataFrame
+
+    For Parquet only the given columns are read and filters (a list of
+    (column, op, value) like pyarrow's) skip row groups that can't match, for
+    CSVs the filters are applied after reading. nrows is applied before the
+    filters.
+    """
+    if not is_parquet_path(path):
+        df = pandas.read_csv(path, usecols = columns, nrows = nrows)
+        return df if filters is None else apply_filters(df, filters)
+    _require_pyarrow()
+    if nrows is not None:
+        #Filters can't be pushed down past a row limit
+        pf = pyarrow.parquet.ParquetFile(path)
+        table = next(pf.iter_batches(batch_size = nrows, columns = columns), None)
+        df = pf.schema_arrow.empty_table().select(columns or pf.schema_arrow.names).to_pandas() if table is None else table.to_pandas()
+        return df if filters is None else apply_filters(df, filters)
+    return pyarrow.parquet.read_table(path, columns = columns, filters = filters).to_pandas()
+
+def iter_per_move_chunks(path, columns = None, filters = None, chunk_size = parquet_row_group_size, nrows = None):
+    """Yields a per move dataset, Parquet or CSV, as DataFrames of up to chunk_size rows, so it never has to all be in memory
+
+    filters and nrows are as in read_per_move(), the filters are applied to each chunk.
+    """
+    num_read = 0
+    if not is_parquet_path(path):
+        chunks = pandas.read_csv(path, usecols = columns, nrows = nrows, chunksize = chunk_size)
+    else:
+        _require_pyarrow()
+        pf = pyarrow.parquet.ParquetFile(path)
+        chunks = (b.to_pandas() for b in pf.iter_batches(batch_size = chunk_size, columns = columns))
+    for df in chunks:
+        if nrows is not None:
+            if num_read >= nrows:
+                break
+            df = df.iloc[:nrows - num_read]
+        num_read += len(df)
+        yield df if filters is None else apply_filters(df, filters)
+
+def iter_per_move_rows(path, columns = None, batch_size = 65536):
+    """Yields the rows of a per move dataset as dicts of strings, like csv.DictReader on the bz2 CSV
+
+    Nulls are '', so the values compare the same as the CSV's text.
+    """
+    if not is_parquet_path(path):
+        with bz2.open(path, 'rt') as f:
+            yield from csv.DictReader(f)
+        return
+    _require_pyarrow()
+    pf = pyarrow.parquet.ParquetFile(path)
+    for batch in pf.iter_batches(batch_size = batch_size, columns = columns):
+        for row in batch.to_pylist():
+            yield {k : '' if v is None else str(v) for k, v in row.items()}
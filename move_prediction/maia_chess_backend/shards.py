@@ -0,0 +1,259 @@
+import json
+import multiprocessing
+import os
+import os.path
+import socket
+import time
+import traceback
+
+import humanize
+
+from .games import LightGamesFile
+from .game_index import GameIndex
+from .parquet_io import open_per_move_writer
+from .shared_queue import SharedMemoryQueue, register_shared_queues
+from .utils import gameToCSVlines, NoStockfishEvals, full_csv_header, printWithDate
+
+#Sharded per move datasets: the games of a PGN file are split into numbered
+#shards of consecutive games using its game index, each shard is written to
+#its own file and only renamed into place once it's complete. The manifest
+#records the games and bytes of the input each shard covers, so a rerun (or
+#another machine given a different range of shards) skips the shards that
+#already exist and seeks straight to the first game of the others.
+
+manifest_name = 'manifest.json'
+shard_game_per_put = 50
+shard_logging_delay = 30 # in seconds
+
+def shard_dir_for(output_dir, name):
+    return os.path.join(output_dir, name)
+
+def plan_shards(index, games_per_shard):
+    """Splits the games of a GameIndex into shards of games_per_shard consecutive games"""
+    shards = []
+    for first in range(0, len(index), games_per_shard):
+        end = min(first + games_per_shard, len(index))
+        shards.append({
+            'shard' : len(shards),
+            'first_game' : first,
+            'num_games' : end - first,
+            'offset' : int(index.offset[first]),
+            'end_offset' : int(index.offset[end - 1] + index.length[end - 1]),
+        })
+    return shards
+
+def parse_shard_range(s):
+    """'a:b' -> (a, b), either end can be left out"""
+    start, _, end = s.partition(':')
+    return int(start) if start else None, int(end) if end else None
+
+class ShardManifest(object):
+    """The shards of one input file, see plan_shards()
+
+    The manifest is only written when it's created, a shard is done when its
+    file exists as the file is renamed into place after it's been closed.
+    """
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        self.path = os.path.join(shard_dir, manifest_name)
+        with open(self.path) as f:
+            dat = json.load(f)
+        self.input_path = dat['input_path']
+        self.input_size = dat['input_size']
+        self.name = dat['name']
+        self.extension = dat['extension']
+        self.games_per_shard = dat['games_per_shard']
+        self.settings = dat['settings']
+        self.shards = dat['shards']
+
+    @classmethod
+    def load_or_create(cls, input_path, shard_dir, games_per_shard, extension = '.csv.bz2', settings = None, bz2_workers = None):
+        """Loads the manifest in shard_dir, making it (and the input's game index) if there isn't one
+
+        Raises ValueError if the existing manifest was made for a different
+        input or with different settings, as the shards wouldn't match.
+        """
+        settings = {} if settings is None else settings
+        path = os.path.join(shard_dir, manifest_name)
+        if not os.path.isfile(path):
+            os.makedirs(shard_dir, exist_ok = True)
+            index = GameIndex.load_or_build(input_path, bz2_workers = bz2_workers)
+            dat = {
+                'input_path' : os.path.abspath(input_path),
+                'input_size' : os.path.getsize(input_path),
+                'name' : os.path.basename(shard_dir.rstrip('/')),
+                'extension' : extension,
+                'games_per_shard' : games_per_shard,
+                'settings' : settings,
+                'shards' : plan_shards(index, games_per_shard),
+            }
+            tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                json.dump(dat, f, indent = 2)
+            os.replace(tmp_path, path)
+        manifest = cls(shard_dir)
+        found = (manifest.input_size, manifest.games_per_shard, manifest.extension, manifest.settings)
+        expected = (os.path.getsize(input_path), games_per_shard, extension, settings)
+        if found != expected:
+            raise ValueError(f"{path} was made for different settings or a different input: {found} instead of {expected}")
+        return manifest
+
+    def __len__(self):
+        return len(self.shards)
+
+    def shard_path(self, k):
+        return os.path.join(self.shard_dir, f"{self.name}-{k:05d}{self.extension}")
+
+    def partial_path(self, k):
+        #Same extension so the writer picks the same format, and unique to the
+        #writer so two machines given the same shard don't write the same file
+        return os.path.join(self.shard_dir, 'partial', f"{socket.gethostname()}-{os.getpid()}-{os.path.basename(self.shard_path(k))}")
+
+    def is_done(self, k):
+        return os.path.isfile(self.shard_path(k))
+
+    def pending(self, shard_range = None):
+        """Numbers of the shards in range(*shard_range) that aren't done"""
+        start, end = (None, None) if shard_range is None else shard_range
+        return [s['shard'] for s in self.shards[start:end] if not self.is_done(s['shard'])]
+
+def shard_reader_worker(manifest_dir, shards, games_queue, results_queue, num_converters, bz2_workers = None):
+    tstart = time.time()
+    manifest = ShardManifest(manifest_dir)
+    gamesFile = LightGamesFile(manifest.input_path, just_games = True, bz2_workers = bz2_workers)
+    next_game = 0
+    tLast = time.time()
+    for k in shards:
+        shard = manifest.shards[k]
+        if shard['first_game'] != next_game:
+            gamesFile.seekGame(shard['first_game'])
+        num_batches = 0
+        games_bundle = []
+        for _ in range(shard['num_games']):
+            _, gs = gamesFile.readNextGame()
+            games_bundle.append(gs)
+            if len(games_bundle) >= shard_game_per_put:
+                games_queue.put((k, games_bundle), True, 1000)
+                num_batches += 1
+                games_bundle = []
+        if len(games_bundle) > 0:
+            games_queue.put((k, games_bundle), True, 1000)
+            num_batches += 1
+        #The writer knows the shard is done once it has this many batches
+        results_queue.put(('end', k, num_batches), True, 1000)
+        next_game = shard['first_game'] + shard['num_games']
+        if time.time() - tLast > shard_logging_delay:
+            tLast = time.time()
+            printWithDate(f"{manifest.name} Loaded shard {k}, input queue depth: {games_queue.qsize()}, ouput queue depth: {results_queue.qsize()}", flush = True)
+    printWithDate(f"{manifest.name} Done loading {len(shards)} shards in {humanize.naturaldelta(time.time() - tstart)}, sending kills")
+    for i in range(num_converters):
+        games_queue.put('kill', True, 100)
+
+def shard_converter_worker(games_queue, results_queue, allow_non_sf = False):
+    while True:
+        dat = games_queue.get()
+        if dat == 'kill':
+            results_queue.put('kill', True, 1000)
+            break
+        k, games = dat
+        lines = []
+        for game_str in games:
+            try:
+                lines += gameToCSVlines(game_str, allow_non_sf = allow_non_sf)
+            except NoStockfishEvals:
+                pass
+            except:
+                printWithDate('error:')
+                printWithDate(game_str)
+                printWithDate(traceback.format_exc())
+                raise
+        #Empty batches are sent too, the writer counts them
+        results_queue.put((k, ('\n'.join(lines) + '\n').encode('utf8') if lines else b''), True, 1000)
+
+def shard_writer_worker(manifest_dir, results_queue, num_converters):
+    tstart = time.time()
+    manifest = ShardManifest(manifest_dir)
+    os.makedirs(os.path.join(manifest.shard_dir, 'partial'), exist_ok = True)
+    writers = {}
+    received = {}
+    expected = {}
+    num_kill_remaining = num_converters
+    num_done = 0
+
+    def finish_shard(k):
+        writers.pop(k).close()
+        os.replace(manifest.partial_path(k), manifest.shard_path(k))
+        printWithDate(f"{manifest.name} Finished shard {k} in {humanize.naturaldelta(time.time() - tstart)}", flush = True)
+
+    while num_kill_remaining > 0:
+        dat = results_queue.get()
+        if dat == 'kill':
+            num_kill_remaining -= 1
+            continue
+        if dat[0] == 'end':
+            _, k, n = dat
+            expected[k] = n
+        else:
+            k, lines = dat
+            received[k] = received.get(k, 0) + 1
+            if k not in writers:
+                writers[k] = open_per_move_writer(manifest.partial_path(k), full_csv_header)
+            if lines:
+                writers[k].write(lines)
+        #Every shard has at least one batch
+        if k in writers and received[k] == expected.get(k):
+            finish_shard(k)
+            num_done += 1
+    if writers:
+        raise RuntimeError(f"{manifest.name} Shards {sorted(writers)} never got all their batches")
+    printWithDate(f"{manifest.name} Done writing {num_done} shards in {humanize.naturaldelta(time.time() - tstart)}")
+    return num_done
+
+def _wait_for(results, delay = 1):
+    #Raises the first error as soon as any worker fails instead of waiting on the others forever
+    while not all(r.ready() for r in results):
+        for r in results:
+            if r.ready() and not r.successful():
+                r.get()
+        time.sleep(delay)
+    return [r.get() for r in results]
+
+def load_or_create_csv_manifest(input_path, output_dir, games_per_shard, allow_non_sf = False, parquet = False, bz2_workers = None):
+    """The manifest of input_path's shards in output_dir/name/, see ShardManifest.load_or_create()"""
+    name = os.path.basename(input_path).split('.')[0]
+    return ShardManifest.load_or_create(
+            input_path,
+            shard_dir_for(output_dir, name),
+            games_per_shard,
+            extension = '.parquet' if parquet else '.csv.bz2',
+            settings = {'allow_non_sf' : allow_non_sf},
+            bz2_workers = bz2_workers,
+            )
+
+def run_sharded_csv(input_path, output_dir, games_per_shard, pool_size, queue_size = 1000, shard_range = None, allow_non_sf = False, parquet = False, bz2_workers = None):
+    """Converts input_path to CSV lines like the month CSV scripts, but as resumable shards in output_dir/name/
+
+    Only the shards in range(*shard_range) are made, shards that already
+    exist are skipped. Returns the manifest.
+    """
+    manifest = load_or_create_csv_manifest(input_path, output_dir, games_per_shard, allow_non_sf = allow_non_sf, parquet = parquet, bz2_workers = bz2_workers)
+    name = manifest.name
+    shards = manifest.pending(shard_range)
+    printWithDate(f"{name} {len(shards)} shards to make of {len(manifest)}, in {manifest.shard_dir}")
+    if len(shards) < 1:
+        return manifest
+
+    num_converters = max(pool_size - 1, 1)
+    max_batches = max(queue_size // shard_game_per_put, 1)
+    queues = [SharedMemoryQueue(maxsize = max_batches), SharedMemoryQueue(maxsize = max_batches)]
+    games_queue, results_queue = queues
+    try:
+        with multiprocessing.Pool(num_converters, initializer = register_shared_queues, initargs = (queues,)) as workers_pool, multiprocessing.Pool(2, initializer = register_shared_queues, initargs = (queues,)) as io_pool:
+            converters = [workers_pool.apply_async(shard_converter_worker, (games_queue, results_queue, allow_non_sf)) for _ in range(num_converters)]
+            reader = io_pool.apply_async(shard_reader_worker, (manifest.shard_dir, shards, games_queue, results_queue, num_converters, bz2_workers))
+            writer = io_pool.apply_async(shard_writer_worker, (manifest.shard_dir, results_queue, num_converters))
+            _wait_for([reader, writer] + converters)
+    finally:
+        for q in queues:
+            q.unlink()
+    return manifest
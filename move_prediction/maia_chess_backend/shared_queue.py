@@ -0,0 +1,170 @@
+import multiprocessing
+import multiprocessing.context
+import multiprocessing.shared_memory
+import pickle
+import queue
+import struct
+
+#Queue between the processes of the multiprocess generators that keeps its
+#messages in a shared memory ring buffer, so putting and getting is a memcpy
+#under a lock instead of a round trip through a Manager's server process.
+#bytes are stored as is, anything else is pickled. The buffer's size bounds
+#the queue (and so the memory used), put() blocks while a message doesn't fit.
+
+shared_queue_capacity = 64 * 1024 * 1024
+
+#head, tail, used bytes, number of messages
+_state = struct.Struct('qqqq')
+_msg_header = struct.Struct('qq') # length, is_pickled
+
+#The queues a process can use, Pool workers get them from their initializer
+_registered_queues = {}
+
+def register_shared_queues(queues):
+    """Pool initializer that makes queues usable as arguments of the Pool's tasks
+
+    Locks can only be shared with processes when they are started, so the
+    queues must be created before the Pool and given to it like this:
+    multiprocessing.Pool(n, initializer = register_shared_queues, initargs = (queues,))
+    """
+    for q in queues:
+        _registered_queues[q.name] = q
+
+def _registered_queue(name):
+    try:
+        return _registered_queues[name]
+    except KeyError:
+        raise RuntimeError(f"SharedMemoryQueue {name} was not given to this process's Pool, see register_shared_queues()") from None
+
+class SharedMemoryQueue(object):
+    """Bounded multi producer multi consumer queue in shared memory, with the same put()/get() as queue.Queue
+
+    capacity is in bytes, maxsize is the max number of messages (0 for no
+    limit). Call unlink() in the creating process when done.
+    """
+    def __init__(self, capacity = shared_queue_capacity, maxsize = 0, ctx = None):
+        if ctx is None:
+            ctx = multiprocessing.get_context()
+        self.capacity = capacity
+        self.maxsize = maxsize
+        #New shared memory is zeroed, so the state starts as an empty queue
+        self._shm = multiprocessing.shared_memory.SharedMemory(create = True, size = _state.size + capacity)
+        self.name = self._shm.name
+        self._lock = ctx.Lock()
+        self._not_empty = ctx.Condition(self._lock)
+        self._not_full = ctx.Condition(self._lock)
+        register_shared_queues([self])
+
+    def __reduce__(self):
+        if multiprocessing.context.get_spawning_popen() is not None:
+            #Being given to a new process
+            return (self._attach, (self.name, self.capacity, self.maxsize, self._lock, self._not_empty, self._not_full))
+        #Being sent to a task of a Pool, which already has it
+        return (_registered_queue, (self.name,))
+
+    @classmethod
+    def _attach(cls, name, capacity, maxsize, lock, not_empty, not_full):
+        self = cls.__new__(cls)
+        self.name = name
+        self.capacity = capacity
+        self.maxsize = maxsize
+        self._shm = multiprocessing.shared_memory.SharedMemory(name = name)
+        self._lock = lock
+        self._not_empty = not_empty
+        self._not_full = not_full
+        return self
+
+    #Views of the buffer are only made for each copy, so the mapping can be closed any time
+    def _get_state(self):
+        return list(_state.unpack_from(self._shm.buf))
+
+    def _set_state(self, state):
+        _state.pack_into(self._shm.buf, 0, *state)
+
+    def _write(self, pos, data):
+        n = len(data)
+        first = min(n, self.capacity - pos)
+        start = _state.size + pos
+        self._shm.buf[start:start + first] = data[:first]
+        if first < n:
+            self._shm.buf[_state.size:_state.size + n - first] = data[first:]
+        return (pos + n) % self.capacity
+
+    def _read(self, pos, n):
+        first = min(n, self.capacity - pos)
+        start = _state.size + pos
+        data = bytes(self._shm.buf[start:start + first])
+        if first < n:
+            data += bytes(self._shm.buf[_state.size:_state.size + n - first])
+        return data, (pos + n) % self.capacity
+
+    def _fits(self, size):
+        _, _, used, count = self._get_state()
+        return self.capacity - used >= size and (self.maxsize < 1 or count < self.maxsize)
+
+    def put(self, obj, block = True, timeout = None):
+        if isinstance(obj, bytes):
+            data, is_pickled = obj, 0
+        else:
+            data, is_pickled = pickle.dumps(obj, protocol = pickle.HIGHEST_PROTOCOL), 1
+        size = _msg_header.size + len(data)
+        if size > self.capacity:
+            raise ValueError(f"Message of {size} bytes is larger than the queue's {self.capacity} bytes")
+        with self._not_full:
+            if not self._wait(self._not_full, lambda : self._fits(size), block, timeout):
+                raise queue.Full
+            head, tail, used, count = self._get_state()
+            tail = self._write(tail, _msg_header.pack(len(data), is_pickled))
+            tail = self._write(tail, data)
+            self._set_state((head, tail, used + size, count + 1))
+            self._not_empty.notify()
+
+    def put_nowait(self, obj):
+        self.put(obj, block = False)
+
+    def get(self, block = True, timeout = None):
+        with self._not_empty:
+            if not self._wait(self._not_empty, lambda : self.qsize() > 0, block, timeout):
+                raise queue.Empty
+            head, tail, used, count = self._get_state()
+            header, head = self._read(head, _msg_header.size)
+            length, is_pickled = _msg_header.unpack(header)
+            data, head = self._read(head, length)
+            self._set_state((head, tail, used - _msg_header.size - length, count - 1))
+            #Messages are different sizes so any of the putters might fit now
+            self._not_full.notify_all()
+        return pickle.loads(data) if is_pickled else data
+
+    def get_nowait(self):
+        return self.get(block = False)
+
+    @staticmethod
+    def _wait(cond, predicate, block, timeout):
+        if not block:
+            return predicate()
+        if timeout is None:
+            return cond.wait_for(predicate)
+        return cond.wait_for(predicate, timeout)
+
+    def qsize(self):
+        return self._get_state()[3]
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def close(self):
+        """Releases this process's mapping of the buffer"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self):
+        """Frees the shared memory, call once from the creating process after every user is done"""
+        self._shm.unlink()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
@@ -0,0 +1,292 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import os.path
+import socket
+import threading
+import time
+
+import humanize
+
+from .parquet_io import concat_per_move
+from .shards import load_or_create_csv_manifest, run_sharded_csv, ShardManifest
+from .utils import printWithDate
+
+#Work queue for making the sharded per move datasets (see shards.py) on many
+#machines at once. It's only a directory on a filesystem they all mount: the
+#coordinator plans the shards of every input and writes a task file for each
+#range of shards_per_task shards, plus one per input to merge its shards into
+#a single file once they are all done. A worker claims a task by creating its
+#claim file, which only one can do, and touches the claim while it works. A
+#claim that hasn't been touched in claim_timeout is from a dead worker, so
+#another worker takes the task over. Shards are only renamed into place when
+#complete, so redoing some of a task is safe. The claim times are the
+#filesystem's, so the machines' clocks need to roughly agree.
+
+queue_dir_name = '_queue'
+queue_config_name = 'queue.json'
+claim_timeout = 15 * 60 # in seconds
+heartbeat_delay = 60 # in seconds
+poll_delay = 30 # in seconds
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _write_json_atomic(path, dat):
+    tmp_path = f"{path}.{worker_name()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(dat, f, indent = 2)
+    os.replace(tmp_path, path)
+
+def _manifest_for(task):
+    return ShardManifest(task['shard_dir'])
+
+def merged_path(output_dir, manifest):
+    """Where the merged shards go, the same file the month CSV scripts make without sharding"""
+    return os.path.join(output_dir, f"{manifest.name}{manifest.extension}")
+
+def plan_tasks(manifest, shards_per_task):
+    """The tasks for one input: its shards in ranges of shards_per_task, then the merge"""
+    tasks = []
+    for start in range(0, len(manifest), shards_per_task):
+        shards = manifest.shards[start:start + shards_per_task]
+        tasks.append({
+            'task' : f"{manifest.name}-{start:05d}",
+            'kind' : 'shards',
+            'shard_dir' : manifest.shard_dir,
+            'input_path' : manifest.input_path,
+            'shard_range' : [start, start + len(shards)],
+            'first_game' : shards[0]['first_game'],
+            'num_games' : sum(s['num_games'] for s in shards),
+            'offset' : shards[0]['offset'],
+            'end_offset' : shards[-1]['end_offset'],
+        })
+    if len(tasks) > 0:
+        tasks.append({
+            'task' : f"{manifest.name}-merge",
+            'kind' : 'merge',
+            'shard_dir' : manifest.shard_dir,
+            'input_path' : manifest.input_path,
+        })
+    return tasks
+
+def _plan_input(input_path, output_dir, games_per_shard, shards_per_task, allow_non_sf, parquet, bz2_workers):
+    manifest = load_or_create_csv_manifest(input_path, output_dir, games_per_shard, allow_non_sf = allow_non_sf, parquet = parquet, bz2_workers = bz2_workers)
+    printWithDate(f"{manifest.name} planned {len(manifest)} shards", flush = True)
+    return plan_tasks(manifest, shards_per_task)
+
+class ShardWorkQueue(object):
+    """The tasks of a sharded run in output_dir/_queue/, see create() and work_loop()
+
+    tasks/ has the task files, claims/ the claims of the tasks being worked
+    on and done/ a marker for each finished task.
+    """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.queue_dir = os.path.join(output_dir, queue_dir_name)
+        with open(os.path.join(self.queue_dir, queue_config_name)) as f:
+            self.config = json.load(f)
+
+    @classmethod
+    def create(cls, inputs, output_dir, games_per_shard, shards_per_task, allow_non_sf = False, parquet = False, pool_size = 1, bz2_workers = None):
+        """Plans the shards of each input and writes their tasks, a no-op for the tasks that already exist
+
+        The game indices of the inputs are made in pool_size processes.
+        Raises ValueError if the queue was made with different settings.
+        """
+        queue_dir = os.path.join(output_dir, queue_dir_name)
+        config = {
+            'games_per_shard' : games_per_shard,
+            'shards_per_task' : shards_per_task,
+            'allow_non_sf' : allow_non_sf,
+            'parquet' : parquet,
+        }
+        for d in ('tasks', 'claims', 'done'):
+            os.makedirs(os.path.join(queue_dir, d), exist_ok = True)
+        config_path = os.path.join(queue_dir, queue_config_name)
+        if not os.path.isfile(config_path):
+            _write_json_atomic(config_path, config)
+        work_queue = cls(output_dir)
+        if work_queue.config != config:
+            raise ValueError(f"{config_path} was made with different settings: {work_queue.config} instead of {config}")
+
+        plan_args = [(p, output_dir, games_per_shard, shards_per_task, allow_non_sf, parquet, bz2_workers) for p in inputs]
+        if pool_size > 1 and len(inputs) > 1:
+            with multiprocessing.Pool(min(pool_size, len(inputs))) as pool:
+                input_tasks = pool.starmap(_plan_input, plan_args)
+        else:
+            input_tasks = [_plan_input(*a) for a in plan_args]
+        for tasks in input_tasks:
+            for task in tasks:
+                path = work_queue.task_path(task)
+                if not os.path.isfile(path):
+                    _write_json_atomic(path, task)
+        return work_queue
+
+    def task_path(self, task):
+        return os.path.join(self.queue_dir, 'tasks', f"{task['task']}.json")
+
+    def claim_path(self, task):
+        return os.path.join(self.queue_dir, 'claims', task['task'])
+
+    def done_path(self, task):
+        return os.path.join(self.queue_dir, 'done', task['task'])
+
+    def tasks(self):
+        tasks = []
+        for e in sorted(os.listdir(os.path.join(self.queue_dir, 'tasks'))):
+            if e.endswith('.json'):
+                with open(os.path.join(self.queue_dir, 'tasks', e)) as f:
+                    tasks.append(json.load(f))
+        return tasks
+
+    def is_done(self, task):
+        return os.path.isfile(self.done_path(task))
+
+    def is_ready(self, task):
+        #An input is only merged after all of its shards are made
+        return task['kind'] != 'merge' or len(_manifest_for(task).pending()) < 1
+
+    def claim(self, task):
+        """Tries to claim task for this process, taking over stale claims, True if it got it"""
+        path = self.claim_path(task)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(path)
+                except FileNotFoundError:
+                    #Released since we tried
+                    continue
+                if age < claim_timeout:
+                    return False
+                #Renaming only works for one of the workers that found it stale
+                stale_path = f"{path}.stale-{worker_name()}"
+                try:
+                    os.rename(path, stale_path)
+                except FileNotFoundError:
+                    return False
+                os.remove(stale_path)
+                printWithDate(f"Taking over {task['task']}, its claim is {humanize.naturaldelta(age)} old", flush = True)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(worker_name())
+            return True
+        return False
+
+    def release(self, task, done):
+        if done:
+            _write_json_atomic(self.done_path(task), {'worker' : worker_name(), 'time' : time.time()})
+        try:
+            os.remove(self.claim_path(task))
+        except FileNotFoundError:
+            pass
+
+    @contextlib.contextmanager
+    def heartbeat(self, task, delay = heartbeat_delay):
+        """Keeps touching task's claim while in the with block"""
+        path = self.claim_path(task)
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(delay):
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    #Taken over, finishing anyway is harmless
+                    return
+        t = threading.Thread(target = beat, daemon = True)
+        t.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            t.join()
+
+    def run_task(self, task, pool_size, queue_size = 1000, bz2_workers = None):
+        if task['kind'] == 'shards':
+            manifest = run_sharded_csv(
+                    task['input_path'],
+                    self.output_dir,
+                    self.config['games_per_shard'],
+                    pool_size,
+                    queue_size = queue_size,
+                    shard_range = tuple(task['shard_range']),
+                    allow_non_sf = self.config['allow_non_sf'],
+                    parquet = self.config['parquet'],
+                    bz2_workers = bz2_workers,
+                    )
+            missing = manifest.pending(tuple(task['shard_range']))
+            if len(missing) > 0:
+                raise RuntimeError(f"{task['task']} is missing shards {missing} after running")
+        elif task['kind'] == 'merge':
+            manifest = _manifest_for(task)
+            output_path = merged_path(self.output_dir, manifest)
+            tmp_path = os.path.join(manifest.shard_dir, 'partial', f"{worker_name()}-{os.path.basename(output_path)}")
+            os.makedirs(os.path.dirname(tmp_path), exist_ok = True)
+            concat_per_move([manifest.shard_path(s['shard']) for s in manifest.shards], tmp_path)
+            os.replace(tmp_path, output_path)
+        else:
+            raise ValueError(f"Unknown task kind: {task['kind']}")
+
+    def status(self):
+        """Counts of the tasks by state: done, claimed, ready and waiting"""
+        counts = {'done' : 0, 'claimed' : 0, 'ready' : 0, 'waiting' : 0}
+        for task in self.tasks():
+            if self.is_done(task):
+                counts['done'] += 1
+            elif os.path.isfile(self.claim_path(task)):
+                counts['claimed'] += 1
+            elif self.is_ready(task):
+                counts['ready'] += 1
+            else:
+                counts['waiting'] += 1
+        return counts
+
+def work_loop(output_dir, pool_size, queue_size = 1000, bz2_workers = None, max_tasks = None):
+    """Claims and runs tasks from the queue in output_dir until they are all done, returns the number run
+
+    Waits for the tasks other workers have claimed, so it can take them over
+    if their worker dies. Stops after max_tasks if it's given.
+    """
+    work_queue = ShardWorkQueue(output_dir)
+    tstart = time.time()
+    num_run = 0
+    while max_tasks is None or num_run < max_tasks:
+        remaining = [t for t in work_queue.tasks() if not work_queue.is_done(t)]
+        if len(remaining) < 1:
+            break
+        task = next((t for t in remaining if work_queue.is_ready(t) and work_queue.claim(t)), None)
+        if task is None:
+            time.sleep(poll_delay)
+            continue
+        if work_queue.is_done(task):
+            #Finished by another worker since we listed them
+            work_queue.release(task, False)
+            continue
+        printWithDate(f"{worker_name()} starting {task['task']}, {len(remaining)} tasks left", flush = True)
+        ttask = time.time()
+        try:
+            with work_queue.heartbeat(task):
+                work_queue.run_task(task, pool_size, queue_size = queue_size, bz2_workers = bz2_workers)
+        except:
+            #Let another worker retry it
+            work_queue.release(task, False)
+            raise
+        work_queue.release(task, True)
+        num_run += 1
+        printWithDate(f"{worker_name()} done {task['task']} in {humanize.naturaldelta(time.time() - ttask)}", flush = True)
+    printWithDate(f"{worker_name()} ran {num_run} tasks in {humanize.naturaldelta(time.time() - tstart)}")
+    return num_run
+
+def run_local_workers(output_dir, num_workers, pool_size, queue_size = 1000, bz2_workers = None):
+    """Runs num_workers work_loop()s as processes on this machine, like separate machines would"""
+    workers = [multiprocessing.Process(target = work_loop, args = (output_dir, pool_size, queue_size, bz2_workers)) for _ in range(num_workers)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    failed = [w.pid for w in workers if w.exitcode != 0]
+    if len(failed) > 0:
+        raise RuntimeError(f"Workers {failed} failed")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the vectorized board encoders in fen_to_vec
+"""
+
+import random
+import unittest
+
+import chess
+import numpy as np
+
+from maia_chess_backend.fen_to_vec import (
+    fenToVec,
+    fens_to_array,
+    array_to_fen,
+    arrays_to_fens,
+    arrays_to_boards,
+    board_to_masks,
+    board_to_vec,
+    masks_to_packed,
+    vecs_to_packed,
+    packed_to_vecs,
+    packed_board_dtype,
+)
+
+
+def random_boards(num_games=20, max_ply=80, seed=1):
+    """The positions of a few random games, both sides to move and with castling lost along the way."""
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(num_games):
+        board = chess.Board()
+        for _ in range(max_ply):
+            boards.append(board.copy(stack=False))
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+    return boards
+
+
+class TestFenToVec(unittest.TestCase):
+    """Test cases for fen_to_vec."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.boards = random_boards()
+        cls.fens = [b.fen() for b in cls.boards]
+        cls.vecs = np.stack([fenToVec(f) for f in cls.fens])
+
+    def test_fens_to_array(self):
+        """fens_to_array() matches fenToVec() of each FEN."""
+        a = fens_to_array(self.fens)
+        self.assertEqual(a.dtype, np.bool_)
+        np.testing.assert_array_equal(a, self.vecs)
+
+    def test_fens_to_array_out(self):
+        """fens_to_array() fills a preallocated array and checks its shape."""
+        out = np.zeros(self.vecs.shape, dtype=np.bool_)
+        self.assertIs(fens_to_array(self.fens, out=out), out)
+        np.testing.assert_array_equal(out, self.vecs)
+        with self.assertRaises(ValueError):
+            fens_to_array(self.fens, out=out[1:])
+
+    def test_fens_to_array_invalid(self):
+        """Strings that aren't FENs raise ValueError."""
+        self.assertEqual(fens_to_array([]).shape, (0, 17, 8, 8))
+        for bad in ['', 'not a fen', self.fens[0].split(' ')[0], 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1']:
+            with self.assertRaises(ValueError):
+                fens_to_array([self.fens[0], bad])
+
+    def test_board_to_vec(self):
+        """board_to_vec() matches fenToVec() of the board's FEN."""
+        for board, vec in zip(self.boards, self.vecs):
+            np.testing.assert_array_equal(board_to_vec(board), vec)
+
+    def test_packed_round_trip(self):
+        """Packed boards unpack to the same vectors, however they were packed."""
+        packed = vecs_to_packed(self.vecs)
+        self.assertEqual(packed.dtype, packed_board_dtype)
+        np.testing.assert_array_equal(packed_to_vecs(packed), self.vecs)
+        from_masks = masks_to_packed([board_to_masks(b) for b in self.boards])
+        np.testing.assert_array_equal(from_masks, packed)
+
+    def test_arrays_to_fens(self):
+        """arrays_to_fens() matches array_to_fen() of each board."""
+        fens = arrays_to_fens(self.vecs)
+        self.assertEqual(fens, [array_to_fen(v) for v in self.vecs])
+        self.assertEqual(arrays_to_fens(self.vecs[:0]), [])
+        self.assertEqual([b.fen() for b in arrays_to_boards(self.vecs[:5])], fens[:5])
+
+    def test_arrays_to_fens_round_trip(self):
+        """The FENs from arrays_to_fens() encode back to the same boards."""
+        np.testing.assert_array_equal(fens_to_array(arrays_to_fens(self.vecs)), self.vecs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for the lean PGN reader in movetext
+"""
+
+import io
+import random
+import unittest
+
+import chess
+import chess.pgn
+
+from maia_chess_backend.movetext import (
+    UnsupportedMovetext,
+    LeanGame,
+    fast_fen,
+    count_legal_moves,
+)
+
+PGN = '''[Event "Rated Blitz game"]
+[White "a"]
+[Black "b"]
+[Result "1-0"]
+[WhiteElo "1500"]
+
+1. e4 { [%clk 0:05:00] } 1... e5 { [%clk 0:05:00] } 2. Nf3 $1 { [%eval 0.2] [%clk 0:04:58] } 2... Nc6 3. Bc4 Nf6?! 4. O-O { A comment } { and another } 4... Bc5 5. d4 exd4 1-0'''
+
+
+def read_mainline(pgn_str):
+    game = chess.pgn.read_game(io.StringIO(pgn_str))
+    return game, [(node.move, node.comment) for node in game.mainline()]
+
+
+class TestMovetext(unittest.TestCase):
+    """Test cases for movetext."""
+
+    def test_lean_game(self):
+        """LeanGame reads the same headers, moves and comments as chess.pgn."""
+        game, mainline = read_mainline(PGN)
+        lean = LeanGame(PGN)
+        self.assertEqual(dict(lean.headers), dict(game.headers))
+        self.assertEqual(lean.num_ply, len(mainline))
+        self.assertEqual(list(lean), mainline)
+        self.assertEqual(lean.board.fen(), game.end().board().fen())
+
+    def test_lean_game_board(self):
+        """The board is at the position before each move as it's iterated."""
+        board = chess.Board()
+        for move, _ in LeanGame(PGN):
+            self.assertTrue(board.is_legal(move))
+            board.push(move)
+
+    def test_unsupported(self):
+        """Games chess.pgn would read differently raise UnsupportedMovetext."""
+        header = '[Event "a"]\n\n'
+        for movetext in ['1. e4 (1. d4) e5', '1. e4 e5 2. Ke3', '1. e4 -- 2. d4', '1. e4 e5\n\n2. Nf3']:
+            with self.assertRaises(UnsupportedMovetext):
+                LeanGame(header + movetext).finish()
+        with self.assertRaises(UnsupportedMovetext):
+            LeanGame('[FEN "8/8/8/8/8/8/8/K1k5 w - - 0 1"]\n\n1. Kb1')
+        with self.assertRaises(UnsupportedMovetext):
+            LeanGame('1. e4 e5')
+
+    def test_fast_fen_and_legal_moves(self):
+        """fast_fen() and count_legal_moves() match python-chess over random games."""
+        rng = random.Random(1)
+        for _ in range(20):
+            board = chess.Board()
+            for _ in range(120):
+                self.assertEqual(fast_fen(board), board.fen())
+                moves = list(board.legal_moves)
+                self.assertEqual(count_legal_moves(board), len(moves))
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+
+
+if __name__ == '__main__':
+    unittest.main()